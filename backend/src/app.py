@@ -10,6 +10,10 @@ from controllers.order_controller import order_bp
 from controllers.cart_controller import cart_bp
 from controllers.cart_item_controller import cart_item_bp
 from controllers.payment_controller import payment_bp
+from controllers.image_controller import image_bp
+from commands import register_commands
+from services import cart_store, reservation_service
+from models.schema import upgrade_schema
 from flask_migrate import Migrate
 from flask_cors import CORS
 
@@ -21,8 +25,8 @@ def create_app():
     # CORS to accept requests from the frontend container
     CORS(app, resources={r"/*": {
         "origins": ["http://localhost:3000", "http://frontend:3000"],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key"]
     }})
     
     # initialize extensions
@@ -41,10 +45,20 @@ def create_app():
     app.register_blueprint(cart_bp)
     app.register_blueprint(cart_item_bp)
     app.register_blueprint(payment_bp)
+    app.register_blueprint(image_bp)
+    
+    # register cli commands (e.g. `flask migrate-images`)
+    register_commands(app)
+
+    # write-behind carts are flushed to the db and expired stock holds released in the background
+    cart_store.init_app(app)
+    reservation_service.init_app(app)
 
     with app.app_context():
         if not app.config.get('TESTING', False):
             db.create_all()
+            # add the columns and indexes that create_all doesn't add to existing tables
+            upgrade_schema()
     
     return app
 
@@ -0,0 +1,96 @@
+import click
+from flask.cli import with_appcontext
+from models import db
+from services import idempotency_service, order_service, product_service, reservation_service, review_service
+from services.cart_item_service import CartItemService
+
+
+@click.command('migrate-images')
+@click.option('--batch-size', default=100, show_default=True, help='Number of products to migrate per commit.')
+@with_appcontext
+def migrate_images_command(batch_size: int):
+    """Move product images out of the product table and into the image store."""
+    moved = product_service.migrate_images_to_store(batch_size)
+    click.echo(f"Moved {moved} product images to the image store")
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Create (if needed) and rebuild the full-text index of the products."""
+    product_service.rebuild_search_index()
+    click.echo("Rebuilt the product search index")
+
+
+@click.command('import-products')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), help='File format (default: from the file extension).')
+@click.option('--batch-size', default=1000, show_default=True, help='Number of products inserted per commit.')
+@with_appcontext
+def import_products_command(file, file_format: str, batch_size: int):
+    """Bulk import products from an NDJSON or CSV FILE."""
+    if not file_format:
+        file_format = 'csv' if file.name.lower().endswith('.csv') else 'ndjson'
+
+    report = product_service.import_products(product_service.read_import_rows(file, file_format), batch_size)
+
+    for error in report['errors']:
+        click.echo(f"Row {error['row']}: {error['error']}", err=True)
+    click.echo(f"Imported {report['imported']} products ({report['error_count']} rows rejected)")
+
+
+@click.command('repair-ratings')
+@with_appcontext
+def repair_ratings_command():
+    """Recompute the ratings of the products and the review summaries from the reviews."""
+    repaired = review_service.repair_rating_aggregates()
+    click.echo(f"Corrected the rating of {repaired} products")
+
+
+@click.command('recompute-cart-subtotals')
+@with_appcontext
+def recompute_cart_subtotals_command():
+    """Recompute the subtotals of all carts from the current prices of their items."""
+    recomputed = CartItemService.recompute_subtotals()
+    db.session.commit()
+    click.echo(f"Recomputed the subtotals of {recomputed} carts")
+
+
+@click.command('release-expired-holds')
+@with_appcontext
+def release_expired_holds_command():
+    """Release the stock held by carts whose reservations have expired."""
+    released = reservation_service.release_expired_holds()
+    click.echo(f"Released {released} expired stock holds")
+
+
+@click.command('purge-idempotency-keys')
+@with_appcontext
+def purge_idempotency_keys_command():
+    """Delete the stored responses of idempotency keys that have expired."""
+    purged = idempotency_service.purge_expired_keys()
+    click.echo(f"Purged {purged} expired idempotency keys")
+
+
+@click.command('reconcile-order-stats')
+@with_appcontext
+def reconcile_order_stats_command():
+    """Rebuild the order count and lifetime spend of every user from the orders and their items."""
+    rebuilt = order_service.rebuild_order_stats()
+    click.echo(f"Rebuilt the order stats of {rebuilt} users")
+
+
+def register_commands(app):
+    """Register the custom flask cli commands with the app
+
+    Args:
+        app (Flask): the flask app
+    """
+    app.cli.add_command(migrate_images_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(import_products_command)
+    app.cli.add_command(repair_ratings_command)
+    app.cli.add_command(recompute_cart_subtotals_command)
+    app.cli.add_command(release_expired_holds_command)
+    app.cli.add_command(purge_idempotency_keys_command)
+    app.cli.add_command(reconcile_order_stats_command)
@@ -9,3 +9,29 @@ class Config:
   SECRET_KEY = os.getenv('SECRET_KEY')
   SQLALCHEMY_DATABASE_URI = 'sqlite:///sports_marketplace.db'
   SQLALCHEMY_TRACK_MODIFICATIONS = False
+  # content-addressed store that product images are saved in
+  IMAGE_STORE_PATH = os.getenv('IMAGE_STORE_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'image_store'))
+  # number of background threads that generate thumbnails of uploaded images
+  IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+
+  # in-process cache of serialized products and catalog pages (sizes are entry counts, ttl in seconds)
+  PRODUCT_CACHE_SIZE = int(os.getenv('PRODUCT_CACHE_SIZE', 2048))
+  LISTING_CACHE_SIZE = int(os.getenv('LISTING_CACHE_SIZE', 256))
+  PRODUCT_CACHE_TTL = float(os.getenv('PRODUCT_CACHE_TTL', 300))
+  # snapshot of the featured products on the home page (rebuilt when one of them changes, the ttl is a safety net)
+  FEATURED_PRODUCTS_LIMIT = int(os.getenv('FEATURED_PRODUCTS_LIMIT', 48))
+  FEATURED_SNAPSHOT_TTL = float(os.getenv('FEATURED_SNAPSHOT_TTL', 3600))
+  # where live carts are kept: "sql" writes every change to the db, "memory" holds carts in
+  # process and writes them every CART_FLUSH_INTERVAL seconds, at shutdown and before checkout
+  CART_STORE = os.getenv('CART_STORE', 'sql')
+  CART_FLUSH_INTERVAL = float(os.getenv('CART_FLUSH_INTERVAL', 5))
+  # how long adding to the cart or starting a payment holds stock, and how often expired holds are released (seconds)
+  RESERVATION_TTL = float(os.getenv('RESERVATION_TTL', 900))
+  RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', 60))
+  # how long the response of a request with an Idempotency-Key is kept for its retries, and how
+  # long a retry waits for the first request with its key to finish (seconds)
+  IDEMPOTENCY_KEY_TTL = float(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+  IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 30))
+  # how long a key stays claimed by a request that hasn't finished (e.g. its worker died) before
+  # a retry can claim it again (seconds)
+  IDEMPOTENCY_LEASE_TIMEOUT = float(os.getenv('IDEMPOTENCY_LEASE_TIMEOUT', 120))
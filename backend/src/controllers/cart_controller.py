@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from services.cart_service import CartService
 from services.cart_item_service import CartItemService
-from models.cart import Cart, db
+from models.cart import db
 from sqlalchemy.exc import SQLAlchemyError
 
 
@@ -20,19 +20,9 @@ def get_cart(user_id):
     Returns:
         JSON response: Cart details if found, otherwise error message.
     """
-    cart = CartService.get_cart_by_user_id(user_id)
+    cart = CartService.get_cart_view(user_id=user_id)
     if cart:
-        return jsonify({
-            'id': cart.id,
-            'user_id': cart.user_id,
-            'subtotal': cart.subtotal,
-            'items': [{
-                'product_id': item.product_id,
-                'quantity': item.quantity,
-                'product_name': item.product.name,
-                'product_price': item.product.price
-        } for item in cart.items]
-        }), 200
+        return jsonify(cart), 200
     return jsonify({'error': 'Cart not found'}), 404
 
 
@@ -80,29 +70,23 @@ def update_cart(cart_id):
 
     if product_id is None or quantity is None:
         return jsonify({'error': 'Product ID and quantity are required'}), 400
+
+    try:
+        CartItemService.check_quantity(quantity)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     
-    # Find the cart
-    cart = Cart.query.get(cart_id)
-    
-    cart_item = next((item for item in cart.items if item.product_id == product_id), None)
-    if not cart:
-        return jsonify({'error': 'Cart not found'}), 404
+    # Find the item of the product in the cart
+    cart_item_id = CartItemService.find_item_id(cart_id, product_id)
+    if cart_item_id is None:
+        return jsonify({'error': f'Product with ID {product_id} is not in cart {cart_id}.'}), 404
 
     try:
         # Call the CartItemService to update the item and recalculate the subtotal
-        CartItemService.update_item_and_cart(cart, cart_item.id, quantity)
+        CartItemService.update_item_and_cart(cart_id, cart_item_id, quantity)
         
-        return jsonify({
-            'id': cart.id,
-            'subtotal': cart.subtotal,
-            'items': [{
-                'product_id': item.product_id,
-                'quantity': item.quantity,
-                'product_name': item.product.name,
-                'product_price': item.product.price,
-            } for item in cart.items]
-        }), 200
+        return jsonify(CartService.get_cart_view(cart_id)), 200
 
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
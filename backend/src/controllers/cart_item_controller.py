@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from services.cart_item_service import CartItemService
-from models.cart import Cart
+from services.cart_service import CartService
 
 
 # blueprint for cart item routes
@@ -26,19 +26,16 @@ def add_to_cart(user_id: int):
     quantity = data.get('quantity', 1)
     
     # Add the product to the cart using CartItemService
-    cart = CartItemService.add_item_to_cart(user_id, product_id, quantity)
+    try:
+        cart = CartItemService.add_item_to_cart(user_id, product_id, quantity)
+    except ValueError as e:
+        # not a positive quantity, or not enough stock left that isn't held by other carts
+        return jsonify({'error': str(e)}), 400
+    if cart is None:
+        return jsonify({'error': 'Product not found'}), 404
 
     # Return the updated cart details
-    return jsonify({
-        'id': cart.id,
-        'subtotal': cart.subtotal,
-        'items': [{
-            'product_id': item.product_id,
-            'quantity': item.quantity,
-            'product_name': item.product.name,
-            'product_price': item.product.price
-        } for item in cart.items]
-    }), 201
+    return jsonify(CartService.get_cart_view(cart.id)), 201
 
 
 @cart_item_bp.route('/cart/<int:cart_id>/remove', methods=['DELETE'])
@@ -60,20 +57,43 @@ def remove_from_cart(cart_id: int):
     cart_item_id = data.get('cart_item_id')
     print(data)
 
-    cart = Cart.query.filter_by(id=cart_id).first()
-
     # Remove the item from the cart using CartItemService
     success = CartItemService.remove_item_from_cart(cart_id, cart_item_id)
     
     if success:
-        return jsonify({"message": "Item removed successfully", 
-                        'id': cart_id,
-                        'subtotal': cart.subtotal,
-                        'items': [{
-                            'product_id': item.product_id,
-                            'quantity': item.quantity,
-                            'product_name': item.product.name,
-                            'product_price': item.product.price
-                        } for item in cart.items]}), 200
+        # the cart as it is after the removal
+        return jsonify({"message": "Item removed successfully", **CartService.get_cart_view(cart_id)}), 200
     else:
         return jsonify({"error": "Item not found"}), 404
+
+
+@cart_item_bp.route('/cart/<int:cart_id>/items', methods=['PATCH'])
+def update_cart_items(cart_id: int):
+    """
+    Endpoint to apply a batch of changes to the items of a cart in one transaction
+    (e.g. the debounced quantity edits of the cart page).
+    
+    Args:
+        cart_id (int): ID of the cart.
+    
+    Request Body:
+        JSON object:
+            - operations (list): each with 'op' ('add', 'set' or 'remove'), 'product_id'
+              and 'quantity' (not needed for 'remove'), applied in order.
+    
+    Returns:
+        JSON response: Updated cart details, otherwise error message (nothing is changed).
+    """
+    try:
+        operations = CartItemService.parse_cart_operations(request.get_json(silent=True))
+        cart = CartItemService.apply_cart_operations(cart_id, operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        print(f"Error updating cart items: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+    if cart is None:
+        return jsonify({'error': 'Cart not found'}), 404
+
+    return jsonify(CartService.get_cart_view(cart_id)), 200
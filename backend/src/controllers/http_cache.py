@@ -0,0 +1,70 @@
+import hashlib
+from datetime import datetime, timezone
+from typing import Optional
+from flask import Response, request
+
+
+def make_etag(*parts) -> str:
+    """Build an ETag value from the things that identify a version of a response
+
+    Args:
+        *parts: the validator values (e.g. a version number, the query parameters)
+
+    Returns:
+        str: the (unquoted) ETag value
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """Convert a naive UTC datetime (how the db stores them) into an aware one, truncated to
+    whole seconds (the precision of the Last-Modified header)"""
+    if moment is None:
+        return None
+    return moment.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """Answer a conditional GET with 304 Not Modified if the client's copy is still current
+
+    If-None-Match takes precedence over If-Modified-Since (as in RFC 9110).
+
+    Args:
+        etag (str): the current ETag of the resource
+        last_modified (Optional[datetime]): when the resource last changed (naive UTC)
+
+    Returns:
+        Optional[Response]: the 304 response, or None if the full response has to be sent
+    """
+    if request.if_none_match:
+        is_current = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        is_current = _as_utc(last_modified) <= request.if_modified_since
+    else:
+        is_current = False
+
+    if not is_current:
+        return None
+
+    return add_validators(Response(status=304), etag, last_modified)
+
+
+def add_validators(response: Response, etag: str, last_modified: Optional[datetime] = None) -> Response:
+    """Set the ETag and Last-Modified headers of a response
+
+    The response is marked `no-cache` so clients revalidate it before every reuse, which
+    is cheap since unchanged resources are answered with an empty 304.
+
+    Args:
+        response (Response): the response
+        etag (str): the current ETag of the resource
+        last_modified (Optional[datetime]): when the resource last changed (naive UTC)
+
+    Returns:
+        Response: the response with the headers set
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _as_utc(last_modified)
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,66 @@
+import functools
+import hashlib
+from flask import Response, jsonify, make_response, request
+from services import idempotency_service
+
+
+# longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 255
+
+
+def idempotent(view):
+    """Decorator that makes a POST endpoint safe to retry with an Idempotency-Key header
+
+    The first request with a key runs the endpoint and its response is stored; retries with
+    the same key (on the same path) get the stored response back from one primary key lookup
+    instead of running the endpoint again.  A retry that arrives while the first request is
+    still running waits for it.  Server errors aren't stored, so a retry after one runs again.
+    Requests without the header run as usual.
+
+    Args:
+        view (Callable): the view function
+
+    Returns:
+        Callable: the wrapped view function
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+        scope = f'{request.method} {request.path}'
+        request_hash = hashlib.sha1(request.get_data()).hexdigest()
+
+        # a key given up by a first request that failed is claimed again once
+        for _ in range(2):
+            if idempotency_service.claim(scope, key, request_hash):
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except Exception:
+                    idempotency_service.release(scope, key)
+                    raise
+
+                if response.status_code >= 500:
+                    idempotency_service.release(scope, key)
+                else:
+                    idempotency_service.complete(scope, key, response.status_code, response.get_data(as_text=True), response.mimetype)
+                return response
+
+            record = idempotency_service.wait_for_response(scope, key)
+            if record is None:
+                continue
+            if record.request_hash != request_hash:
+                return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+            if record.status_code is None:
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+
+            replay = Response(record.response_body, status=record.status_code, mimetype=record.mimetype)
+            replay.headers['Idempotent-Replayed'] = 'true'
+            return replay
+
+        return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+
+    return wrapper
@@ -0,0 +1,87 @@
+import os
+from flask import Blueprint, jsonify, send_file
+from flask_cors import cross_origin
+from services import image_store
+from services.image_derivatives import DERIVATIVE_SIZES
+
+
+# blueprint for serving the images in the image store
+image_bp = Blueprint('image_bp', __name__)
+
+# stored images never change (they are named by their content), so clients may cache them for a year
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@image_bp.route('/images/<string:image_hash>', methods=['GET'])
+@cross_origin()
+def get_image(image_hash: str):
+    """Endpoint to get an image from the image store by its content hash
+
+    Supports conditional (If-None-Match) and Range requests.  The content hash is used
+    as a strong ETag and the response is marked immutable since the bytes behind a
+    hash can never change.
+
+    Args:
+        image_hash (str): the content hash of the image
+
+    Returns:
+        Response: the image bytes, or a JSON error message if the image isn't found
+    """
+    if not image_store.image_exists(image_hash):
+        return jsonify({'error': 'Image not found'}), 404
+
+    path = image_store.image_path(image_hash)
+
+    response = send_file(
+        path,
+        mimetype=image_store.guess_mimetype(path) or 'application/octet-stream',
+        conditional=True,
+        etag=image_hash,
+        max_age=IMAGE_MAX_AGE,
+    )
+    response.cache_control.immutable = True
+    return response
+
+
+@image_bp.route('/images/<string:image_hash>/<string:size>', methods=['GET'])
+@cross_origin()
+def get_image_derivative(image_hash: str, size: str):
+    """Endpoint to get a resized rendition (e.g. "thumb" or "medium") of an image
+
+    Derivatives are generated in the background after an image is uploaded.  Until the
+    requested one is ready the original image is served instead, marked `no-cache` so the
+    client revalidates and picks up the derivative once it exists.
+
+    Args:
+        image_hash (str): the content hash of the original image
+        size (str): the name of the derivative size
+
+    Returns:
+        Response: the image bytes, or a JSON error message if the image isn't found
+    """
+    if size not in DERIVATIVE_SIZES or not image_store.image_exists(image_hash):
+        return jsonify({'error': 'Image not found'}), 404
+
+    path = image_store.derivative_path(image_hash, size)
+
+    if not os.path.isfile(path):
+        # fall back to the original until the derivative is ready
+        original_path = image_store.image_path(image_hash)
+        response = send_file(
+            original_path,
+            mimetype=image_store.guess_mimetype(original_path) or 'application/octet-stream',
+            conditional=True,
+            etag=image_hash,
+        )
+        response.cache_control.no_cache = True
+        return response
+
+    response = send_file(
+        path,
+        mimetype=image_store.guess_mimetype(path) or 'application/octet-stream',
+        conditional=True,
+        etag=f'{image_hash}-{size}',
+        max_age=IMAGE_MAX_AGE,
+    )
+    response.cache_control.immutable = True
+    return response
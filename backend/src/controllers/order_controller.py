@@ -2,6 +2,9 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from services import order_service
 from services.auth import login_required
+from services.pagination import parse_limit
+from controllers.streaming import stream_json_collection
+from controllers.idempotency import idempotent
 
 # blueprint
 order_bp = Blueprint('order_bp', __name__)
@@ -9,31 +12,49 @@ order_bp = Blueprint('order_bp', __name__)
 
 @order_bp.route('/orders/user/<int:user_id>', methods=['GET'])
 def get_user_order_history(user_id: int):
-    """Endpoint to get the order history for a user
+    """Endpoint to get a page of the order history for a user (newest first)
 
     Args:
         user_id (int): the id of the user to get the orders for
 
+    Query Params:
+        limit (int, optional): the maximum number of orders to return (default 20, max 100)
+        cursor (str, optional): the `next_cursor` of the previous page
+        stream (bool, optional): stream all the orders as a chunked response instead of
+            returning one page (for exporting very long histories)
+
     Returns:
-        JSON: JSON message with a list of the orders or an error message
+        JSON: JSON message with a list of the orders and the cursor of the next page
+        (null when there are no more orders), or an error message
     """
     try:
-        # Fetch the orders for the user from the order service
-        orders = order_service.get_all_orders_by_userid(user_id)
+        if request.args.get('stream', '').lower() in ('true', '1'):
+            return stream_json_collection('orders', order_service.iter_orders_by_userid(user_id))
+
+        # Fetch the page of orders for the user from the order service
+        orders, next_cursor = order_service.get_orders_page(
+            user_id, parse_limit(request.args.get('limit')), request.args.get('cursor')
+        )
         
         orders_dict = [order.to_dict() for order in orders]
         
         # Return the orders in JSON format
-        return jsonify({"orders": orders_dict}), 200
+        return jsonify({"orders": orders_dict, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         # Handle exceptions (e.g., database errors, user not found, etc.)
         return jsonify({"error": str(e)}), 500
 
 
 @order_bp.route('/orders/create/<int:user_id>', methods=['POST'])
+@idempotent
 def create_order(user_id: int):
     """Endpoint to create a new order for the user
 
+    Retries with the same Idempotency-Key header get the first response back
+    instead of creating another order.
+
     Args:
         user_id (int): the id of the user who is making an order
 
@@ -44,5 +65,8 @@ def create_order(user_id: int):
         # Create an order for the given user
         new_order = order_service.create_order(user_id)
         return jsonify({"order": new_order.to_dict()}), 201
+    except ValueError as e:
+        # no cart, an empty cart or not enough stock (nothing was changed)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
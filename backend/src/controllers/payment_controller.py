@@ -4,6 +4,8 @@ from flask_cors import cross_origin
 import stripe
 from flask import jsonify, Blueprint, request
 from dotenv import load_dotenv
+from services import reservation_service
+from controllers.idempotency import idempotent
 
 
 load_dotenv()
@@ -14,6 +16,7 @@ payment_bp = Blueprint('payment_bp', __name__)
 
 @payment_bp.route('/create-payment-intent', methods=['POST'])
 @cross_origin()
+@idempotent
 def create_payment():
     """Create payment with external api (stripe)
     
@@ -22,23 +25,44 @@ def create_payment():
     returned by Stripe is sent back to the frontend for completing the 
     payment process
 
+    Retries with the same Idempotency-Key header get the first client secret
+    back instead of creating another PaymentIntent (the key is passed on to
+    Stripe, so a retry that runs again gets the same PaymentIntent)
+
+    If the `user_id` of the buyer is given, the stock of everything in their
+    cart is held (and existing holds extended) before the payment is started,
+    so the items can't sell out while they pay
+
     Returns:
         JSON: A JSON response containing the client secret if successful, 
-        or an error message with a 403 status code in case of failure
+        an error message with a 409 status code if an item of the cart is no
+        longer available, an error message with a 502 status code if Stripe can't be
+        reached or fails (so a retry with the same Idempotency-Key runs again), or an error
+        message with a 403 status code in case of other failures
     """
     data = request.json
     items = data.get('items', [])
     customer = data.get('customer', '')
+    user_id = data.get('user_id')
+
+    if user_id is not None:
+        try:
+            reservation_service.hold_user_cart(user_id)
+        except ValueError as e:
+            return jsonify(error=str(e)), 409
 
     try:
         # get stripe api key from .env file
         stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
         
-        # create PaymentIntent object
+        # create PaymentIntent object (Stripe deduplicates calls with the request's
+        # Idempotency-Key too, e.g. a retry that took over the key of an attempt that
+        # died after calling Stripe)
         payment_intent = stripe.PaymentIntent.create(
             amount=1000,
             currency='usd',
             metadata={'integration_check': 'accept_a_payment'},
+            idempotency_key=request.headers.get('Idempotency-Key'),
         )
         
         print(f"Stripe clientSecret: {payment_intent.client_secret}")
@@ -46,5 +70,9 @@ def create_payment():
         # Send the client secret to the frontend
         return jsonify({'clientSecret': payment_intent.client_secret})
 
+    except (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError) as e:
+        # transient errors of Stripe, the request can be retried
+        return jsonify(error=str(e)), 502
+
     except Exception as e:
         return jsonify(error=str(e)), 403
\ No newline at end of file
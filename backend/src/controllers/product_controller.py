@@ -1,8 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from datetime import datetime
 from services import product_service
+from services.pagination import parse_limit
+from controllers.http_cache import make_etag, not_modified, add_validators
+from controllers.streaming import stream_json_collection
 from flask_cors import cross_origin
 import base64
+import io
 from services.auth import login_required
 
 
@@ -20,86 +24,229 @@ def create_new_product():
 
     Returns:
         JSON: A response containing a success message and the created product 
-        details with the image re-encoded in base64 if successful, or an error 
+        details (with the url of its image) if successful, or an error 
         message status code if failed.
     """
     try:
         data = request.get_json()
-        seller_id = data.get('seller_id')
-
-        # Decode the base64 image data
-        image_data = data.get('image')
-        if image_data:
-            image_binary = base64.b64decode(image_data.split(',')[1])  # Strip "data:image/png;base64," part
-        else:
-            return jsonify({'error': 'Image data is missing'}), 400
-
-        # Extract other product details
-        product_details = {
-            'name': data.get('name'),
-            'description': data.get('description'),
-            'price': data.get('price'),
-            'gender': data.get('gender'),
-            'size': data.get('size'),
-            'youth_size': data.get('youth_size'),
-            'featured': data.get('featured'),
-            'brand': data.get('brand'),
-            'sport': data.get('sport'),
-            'quantity': data.get('quantity'),
-            'condition': data.get('condition'),
-            'year_product_made': data.get('year_product_made'),
-            'avg_rating': data.get('avg_rating'),
-        }
-
-        # Validate required fields
-        if not all([seller_id, product_details['name'], product_details['price'], product_details['quantity'], product_details['condition']]):
-            return jsonify({'error': 'Missing required fields'}), 400
+
+        # Validate the product details and decode the base64 image
+        try:
+            product_data = product_service.parse_product_data(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         # Create the product using the service
         product = product_service.create_product(
-            seller_id=seller_id,
-            image=image_binary,
             date_listed=datetime.now(),
-            **product_details
+            **product_data
         )
 
-        # Serialize product to dict and re-encode image for JSON response
-        product_dict = product.to_dict()
-        product_dict['image'] = base64.b64encode(product_dict['image']).decode('utf-8')
-
-        return jsonify({'message': 'Product created successfully', 'product': product_dict}), 201
+        return jsonify({'message': 'Product created successfully', 'product': product.to_dict()}), 201
 
     except Exception as e:
         print(f"Error creating product: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
-# Get all products
+# Bulk import products
+@product_bp.route('/products/import', methods=['POST'])
+@cross_origin()
+def import_products():
+    """Endpoint to import many products at once from an NDJSON or CSV file (the request body)
+
+    Every row is validated with the same rules as creating a single product.  Valid rows
+    are inserted in batches and invalid ones are skipped and listed in the report.  The body
+    is read as a stream, so large files are never held in memory.
+
+    Query Params:
+        format (str, optional): "ndjson" or "csv" (defaults to the body's Content-Type)
+        batch_size (int, optional): number of products inserted per commit (default 1000)
+
+    Returns:
+        JSON: JSON message with the number of imported products and the errors per row
+    """
+    file_format = request.args.get('format')
+    if not file_format:
+        file_format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+
+    try:
+        batch_size = int(request.args.get('batch_size', 1000))
+        if batch_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'batch_size must be a positive integer'}), 400
+
+    try:
+        text_stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        rows = product_service.read_import_rows(text_stream, file_format)
+        report = product_service.import_products(rows, batch_size)
+
+        return jsonify(report), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error importing products: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+# Bulk update products
+@product_bp.route('/products', methods=['PATCH'])
+@cross_origin()
+def bulk_update_products():
+    """Endpoint to apply the same changes to many products at once (e.g. re-pricing a range)
+
+    The products are selected by `ids` or by a `filter` (same attributes as the catalog
+    filters), and all of them are updated in one transaction.
+
+    JSON Body:
+        ids (list[int], optional): the ids of the products to update
+        filter (dict, optional): attribute -> value or list of values, price_min, price_max, rating_min
+        set (dict): the new price, quantity, featured and/or condition
+
+    Returns:
+        JSON: JSON message with the number of updated products and the ids of the products
+        that were skipped (carts hold more units of them than the new quantity)
+    """
+    try:
+        product_ids, filters, changes = product_service.parse_bulk_update(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        updated, skipped = product_service.bulk_update_products(changes, product_ids, filters)
+
+        return jsonify({'message': 'Products updated successfully', 'updated': updated, 'skipped': skipped}), 200
+
+    except Exception as e:
+        print(f"Error bulk updating products: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+# Get a page of products
 @product_bp.route('/products', methods=['GET'])
 @cross_origin()
 def get_products():
-    """Endpoint for getting all the products from the db
+    """Endpoint for getting a page of products from the db
+
+    Query Params:
+        limit (int, optional): the maximum number of products to return (default 20, max 100)
+        cursor (str, optional): the `next_cursor` of the previous page
+        fields (str, optional): comma separated product fields to return (default all but the description)
+        sport, brand, gender, size, condition, youth_size, featured (optional): only return products
+            with these values (repeat a parameter to accept several values)
+        price_min, price_max (float, optional): only return products in this price range
+        rating_min (float, optional): only return products with at least this average rating
+        sort (str, optional): "newest" (default) or "top_rated"
+        stream (bool, optional): stream every matching product as a chunked response instead
+            of returning one page (limit and cursor are ignored and no facets are sent)
 
     Returns:
-        JSON: JSON message with a list of the products
+        JSON: JSON message with a list of the products, the cursor of the next page
+        (null when there are no more products) and, on the first page, the facet counts
+        of each filterable attribute.  Empty 304 response if the client's copy (If-None-Match
+        or If-Modified-Since) is still current
     """
     try:
-        products = product_service.get_all_products()
+        limit = parse_limit(request.args.get('limit'))
+        fields = product_service.parse_fields(request.args.get('fields'), product_service.LISTING_FIELDS)
+        filters = product_service.parse_filters(request.args)
+        sort = product_service.parse_sort(request.args.get('sort'))
+        cursor = request.args.get('cursor')
+
+        if request.args.get('stream', '').lower() in ('true', '1'):
+            return stream_json_collection('products', product_service.iter_products(fields, filters, sort=sort))
 
-        products_list = []
-        for product in products:
-            product_dict = product.to_dict()
-            if product_dict.get('image'):
-                product_dict['image'] = base64.b64encode(product_dict['image']).decode('utf-8')
-            products_list.append(product_dict)
+        # revalidation costs one aggregate query, the page isn't loaded or serialized; the first
+        # page carries facet counts that each ignore a filter, so any product can change it
+        latest_update, count = product_service.get_listing_validators(filters if cursor else None)
+        etag = make_etag(latest_update, count, limit, cursor, fields, sort, sorted(filters.items()))
+        unchanged = not_modified(etag, latest_update)
+        if unchanged:
+            return unchanged
 
-        return jsonify({'products': products_list}), 200
+        listing = product_service.get_products_listing(limit, cursor, fields, filters, sort)
 
+        return add_validators(jsonify(listing), etag, latest_update), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error fetching products: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
+# Get the featured products
+@product_bp.route('/products/featured', methods=['GET'])
+@cross_origin()
+def get_featured_products():
+    """Endpoint for the featured products that are in stock (for the home page)
+
+    The response is prebuilt and served from memory until a featured product changes.
+
+    Returns:
+        JSON: JSON message with the featured products (newest first), or an empty 304
+        response if the client's copy (If-None-Match) is still current
+    """
+    try:
+        snapshot = product_service.get_featured_snapshot()
+
+        unchanged = not_modified(snapshot.etag)
+        if unchanged:
+            return unchanged
+
+        return add_validators(Response(snapshot.body, mimetype='application/json'), snapshot.etag), 200
+
+    except Exception as e:
+        print(f"Error fetching featured products: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+# Product cache counters
+@product_bp.route('/products/cache-stats', methods=['GET'])
+@cross_origin()
+def get_product_cache_stats():
+    """Endpoint for the hit/miss/eviction counters of the product caches (for tuning)
+
+    Returns:
+        JSON: JSON message with the counters of each cache
+    """
+    return jsonify({'caches': product_service.cache_stats()}), 200
+
+
+# Search products
+@product_bp.route('/products/search', methods=['GET'])
+@cross_origin()
+def search_products():
+    """Endpoint for full-text search of the products
+
+    Query Params:
+        q (str): the search text
+        limit (int, optional): the maximum number of results to return (default 20, max 100)
+        cursor (str, optional): the `next_cursor` of the previous page
+        fields (str, optional): comma separated product fields to return (default all but the description)
+
+    Returns:
+        JSON: JSON message with the best matching products first (each with a highlighted
+        `snippet` of the matching text) and the cursor of the next page
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        fields = product_service.parse_fields(request.args.get('fields'), product_service.LISTING_FIELDS)
+        results, next_cursor = product_service.search_products(
+            request.args.get('q', ''), limit, request.args.get('cursor'), fields
+        )
+
+        return jsonify({'products': results, 'next_cursor': next_cursor}), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error searching products: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 # Get a specific product by ID
 @product_bp.route('/product/<int:product_id>', methods=['GET'])
 @cross_origin()
@@ -109,21 +256,35 @@ def get_product(product_id):
     Args:
         product_id (int): The id of the product to get
 
+    Query Params:
+        fields (str, optional): comma separated product fields to return (default all)
+
     Returns:
-        JSON: JSON message with the product
+        JSON: JSON message with the product, or an empty 304 response if the client's
+        copy (If-None-Match or If-Modified-Since) is still current
     """
     try:
-        product = product_service.get_product_by_id(product_id)
+        fields = product_service.parse_fields(request.args.get('fields'))
 
-        if not product:
+        # revalidation only reads the version of the product, it isn't loaded or serialized
+        validators = product_service.get_product_validators(product_id)
+        if not validators:
             return jsonify({'error': 'Product not found'}), 404
 
-        product_dict = product.to_dict()
-        if product_dict.get('image'):
-            product_dict['image'] = base64.b64encode(product_dict['image']).decode('utf-8')
+        version, updated_at = validators
+        etag = make_etag(product_id, version, fields)
+        unchanged = not_modified(etag, updated_at)
+        if unchanged:
+            return unchanged
+
+        product_dict = product_service.get_product_dict(product_id, fields)
+        if not product_dict:
+            return jsonify({'error': 'Product not found'}), 404
 
-        return jsonify({'product': product_dict}), 200
+        return add_validators(jsonify({'product': product_dict}), etag, updated_at), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error fetching product: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -172,16 +333,12 @@ def update_product(product_id):
             condition=data.get('condition'),
             image=image_binary,
             year_product_made=data.get('year_product_made'),
-            avg_rating=data.get('avg_rating'),
         )
 
         # Fetch and return the updated product
         updated_product = product_service.get_product_by_id(product_id)
-        product_dict = updated_product.to_dict()
-        if product_dict.get('image'):
-            product_dict['image'] = base64.b64encode(product_dict['image']).decode('utf-8')
 
-        return jsonify({'message': 'Product updated successfully', 'product': product_dict}), 200
+        return jsonify({'message': 'Product updated successfully', 'product': updated_product.to_dict()}), 200
 
     except Exception as e:
         print(f"Error updating product: {e}")
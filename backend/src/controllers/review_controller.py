@@ -1,5 +1,13 @@
 from flask import Blueprint, request, jsonify
-from services.review_service import add_review, get_reviews_by_product, delete_review
+from services.review_service import (
+    add_review,
+    get_reviews_by_product,
+    get_review_summary,
+    get_review_summaries,
+    parse_product_ids,
+    delete_review,
+)
+from services.pagination import parse_limit
 
 
 # blueprint for review-related routes
@@ -32,6 +40,9 @@ def create_review():
             rating=float(data['rating']),  # Ensure rating is a float
             explanation=str(data['explanation'])  # Ensure explanation is a string
         )
+        if review is None:
+            return jsonify({'message': 'Product not found'}), 404
+
         # Return success response
         return jsonify({'id': review.id, 'message': 'Review created successfully'}), 201
     except ValueError:
@@ -42,28 +53,77 @@ def create_review():
 
 @review_blueprint.route('/reviews/product/<int:product_id>', methods=['GET'])
 def retrieve_reviews(product_id: int):
-    """Endpoint to get all the reviews for a given product
+    """Endpoint to get a page of the reviews for a given product
 
     Args:
-        product_id (int): the id of the product to get all the reviews for
+        product_id (int): the id of the product to get the reviews for
+
+    Query Params:
+        limit (int, optional): the maximum number of reviews to return (default 20, max 100)
+        cursor (str, optional): the `next_cursor` of the previous page
+        sort (str, optional): "newest" (default), "highest" or "lowest"
 
     Returns:
-        JSON: JSON message with a list of reviews or error message
+        JSON: JSON message with the product (and seller) details, a list of reviews and
+        the cursor of the next page, or error message
     """
     try:
+        limit = parse_limit(request.args.get('limit'))
+
         # Fetch reviews from the service
-        reviews = get_reviews_by_product(product_id)
-        
-        print(reviews)
+        result = get_reviews_by_product(product_id, limit, request.args.get('cursor'), request.args.get('sort', 'newest'))
+
+        if result is None:
+            return jsonify({'message': 'Product not found'}), 404
 
-        if not reviews:
-            return jsonify({'reviews': [], 'message': 'No reviews yet for this product'}), 200
+        if not result['reviews'] and not request.args.get('cursor'):
+            return jsonify({**result, 'message': 'No reviews yet for this product'}), 200
         
-        return jsonify({'reviews': reviews}), 200
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to retrieve reviews: {str(e)}'}), 500
 
 
+@review_blueprint.route('/reviews/product/<int:product_id>/summary', methods=['GET'])
+def retrieve_review_summary(product_id: int):
+    """Endpoint to get the rating summary of a product's reviews
+
+    Args:
+        product_id (int): the id of the product to get the summary for
+
+    Returns:
+        JSON: JSON message with the review count, average rating and the number of
+        reviews per star rating, or error message
+    """
+    try:
+        return jsonify({'summary': get_review_summary(product_id)}), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve review summary: {str(e)}'}), 500
+
+
+@review_blueprint.route('/reviews/summary', methods=['GET'])
+def retrieve_review_summaries():
+    """Endpoint to get the rating summaries of many products at once (e.g. for a page of the catalog)
+
+    Query Params:
+        product_ids (str): comma separated ids of the products (at most 100)
+
+    Returns:
+        JSON: JSON message with the summary of each product in the order given, or error message
+    """
+    try:
+        product_ids = parse_product_ids(request.args.getlist('product_ids'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        return jsonify({'summaries': get_review_summaries(product_ids)}), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve review summaries: {str(e)}'}), 500
+
+
 @review_blueprint.route('/reviews/<int:review_id>', methods=['DELETE'])
 def remove_review(review_id: int):
     """Endpoint to delete a review
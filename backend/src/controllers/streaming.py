@@ -0,0 +1,46 @@
+from typing import Iterable
+from flask import Response, current_app, stream_with_context
+
+
+# serialized rows are buffered into chunks of about this many characters before being sent
+CHUNK_SIZE = 64 * 1024
+
+
+def stream_json_collection(key: str, items: Iterable[dict]) -> Response:
+    """Stream a JSON object of the form `{"<key>": [item, ...]}` as a chunked response
+
+    Items are serialized one at a time as they're produced, so the memory used by the
+    request stays flat no matter how many items there are.  Pass a generator that reads
+    its query in batches (e.g. `yield_per`) to keep the database side flat as well.
+
+    Args:
+        key (str): the name of the collection in the JSON object
+        items (Iterable[dict]): the serialized items of the collection
+
+    Returns:
+        Response: the streaming response
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        buffer = [f'{{{dumps(key)}:[']
+        buffered = 0
+        separator = ''
+
+        for item in items:
+            encoded = dumps(item)
+            buffer.append(separator)
+            buffer.append(encoded)
+            separator = ','
+            buffered += len(encoded)
+
+            if buffered >= CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer = []
+                buffered = 0
+
+        buffer.append(']}')
+        yield ''.join(buffer)
+
+    # the request (and its db session) stays open until the last chunk is sent
+    return Response(stream_with_context(generate()), mimetype='application/json')
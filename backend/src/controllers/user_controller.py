@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from services.user_service import get_user_by_id, get_user_by_email, create_user, update_name
+from services.order_service import get_order_stats
 from models.user import User
 
 
@@ -46,4 +47,22 @@ def get_user_by_email_route(email):
         return jsonify(user.to_dict()), 200
     else:
         # If no user is found, return an error message with a 404 NOT FOUND status
-        return jsonify({'message': 'User not found'}), 404
\ No newline at end of file
+        return jsonify({'message': 'User not found'}), 404
+
+
+@user_blueprint.route('/users/<int:user_id>/order-stats', methods=['GET'])
+def get_user_order_stats(user_id: int):
+    """Endpoint to get the number of orders a user has placed and their lifetime spend
+
+    Args:
+        user_id (int): the id of the user to get the order stats of
+
+    Returns:
+        JSON: JSON message with the order count and lifetime spend (zero if the user has no
+        orders), or error message
+    """
+    try:
+        return jsonify(get_order_stats(user_id)), 200
+    except Exception as e:
+        print(f"Error retrieving order stats: {e}")
+        return jsonify({'error': 'Failed to retrieve order stats'}), 500
@@ -0,0 +1,32 @@
+from . import db
+
+
+class IdempotencyKey(db.Model):
+    """Database model of a request made with an Idempotency-Key header and its response
+
+    The first request with a key claims it (status_code is NULL while it runs) and stores
+    its response when it finishes; retries with the same key are answered with the stored
+    response until the key expires.
+
+    Attributes:
+        scope (str): the method and path the key was used on (part of the primary key)
+        key (str): the client's Idempotency-Key (part of the primary key)
+        request_hash (str): SHA-1 of the request body (a reused key must come with the same body)
+        status_code (int): status of the stored response (None while the first request runs)
+        response_body (str): body of the stored response
+        mimetype (str): mimetype of the stored response
+        expires_at (datetime): when the key can be reused for a new request (UTC)
+    """
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        # purging expired keys
+        db.Index('ix_idempotency_key_expires_at', 'expires_at'),
+    )
+
+    scope = db.Column(db.String(100), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(40), nullable=False)
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    mimetype = db.Column(db.String(100))
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -11,6 +11,11 @@ class Order(db.Model):
         
         user (relationship): relationship to the User model (the user who created this order)
     """
+    __table_args__ = (
+        # keyset pagination of a user's order history (newest first)
+        db.Index('ix_order_user_id_order_date_id', 'user_id', 'order_date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     total = db.Column(db.Float, nullable=False)
@@ -1,3 +1,5 @@
+from datetime import datetime
+from sqlalchemy import DDL, event
 from . import db
 from .review import Review
 from .cart_item import CartItem
@@ -19,17 +21,38 @@ class Product(db.Model):
         brand (str): Brand of the product.
         sport (str): Associated sport for the product.
         quantity (int): Quantity of the product available.
+        reserved_quantity (int): Units held by carts (active reservations); the stock available to
+            other carts is quantity - reserved_quantity.
         condition (str): Condition of the product.
-        image (bytes): Image of the product.
+        image (bytes): Legacy inline image of the product (moved to the image store by `flask migrate-images`).
+        image_hash (str): Content hash of the product's image in the image store.
         date_listed (datetime): Date the product was listed.
         year_product_made (str): Year the product was made.
-        avg_rating (float): Average rating of the product.
+        avg_rating (float): Average rating of the product (rating_sum / rating_count, kept up to date by the review service).
+        rating_count (int): Number of reviews of the product.
+        rating_sum (float): Sum of the ratings of the product's reviews.
+        version (int): Incremented on every change of the product (its HTTP cache validator).
+        updated_at (datetime): When the product was last changed (UTC).
         
         seller (relationship): relationship to the User model (the user who is selling this product)
         review (relationship): relationship to the Review model (the reviews that are of this product)
         cart_items (relationship): relationship to the CartItem model (the cart items that are linked to this product)
     """
     __tablename__ = 'product'
+    __table_args__ = (
+        # keyset pagination of the catalog (newest first)
+        db.Index('ix_product_date_listed_id', 'date_listed', 'id'),
+        # filtered pages of the catalog and their facet counts
+        db.Index('ix_product_sport_date_listed', 'sport', 'date_listed', 'id'),
+        db.Index('ix_product_brand_date_listed', 'brand', 'date_listed', 'id'),
+        db.Index('ix_product_gender_size', 'gender', 'size', 'date_listed'),
+        db.Index('ix_product_condition_price', 'condition', 'price'),
+        db.Index('ix_product_price', 'price'),
+        # featured products on the home page (partial, only the few featured rows are indexed)
+        db.Index('ix_product_featured_date_listed', 'date_listed', 'id', sqlite_where=db.text('featured = 1')),
+        # top rated sort order of the catalog
+        db.Index('ix_product_avg_rating_id', 'avg_rating', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -43,11 +66,17 @@ class Product(db.Model):
     brand = db.Column(db.String(30), nullable=False)
     sport = db.Column(db.String(30), nullable=False)
     quantity = db.Column(db.Integer, default=1, nullable=False)
+    reserved_quantity = db.Column(db.Integer, default=0, nullable=False)
     condition = db.Column(db.String(30), nullable=False)
-    image = db.Column(db.LargeBinary, nullable=True)  # allow nullable for optional images
+    image = db.deferred(db.Column(db.LargeBinary, nullable=True))  # legacy, images now live in the image store
+    image_hash = db.Column(db.String(64), nullable=True, index=True)  # allow nullable for optional images
     date_listed = db.Column(db.Date, nullable=False)
     year_product_made = db.Column(db.String(4))
     avg_rating = db.Column(db.Float, default=0.0)  # default to 0.0 for new products
+    rating_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Float, default=0.0, nullable=False)
+    version = db.Column(db.Integer, default=1, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
     # relationships
     seller = db.relationship('User', backref='products', lazy=True)
@@ -55,35 +84,71 @@ class Product(db.Model):
     cart_items = db.relationship('CartItem', back_populates='product', lazy='dynamic')
 
 
-    def to_dict(self):
+    # serialized field name -> the column its value is read from
+    SERIALIZED_COLUMNS = {
+        'id': 'id',
+        'seller_id': 'seller_id',
+        'name': 'name',
+        'description': 'description',
+        'price': 'price',
+        'gender': 'gender',
+        'size': 'size',
+        'youth_size': 'youth_size',
+        'featured': 'featured',
+        'brand': 'brand',
+        'sport': 'sport',
+        'quantity': 'quantity',
+        'condition': 'condition',
+        'image_url': 'image_hash',
+        'thumbnail_url': 'image_hash',
+        'medium_url': 'image_hash',
+        'date_listed': 'date_listed',
+        'year_product_made': 'year_product_made',
+        'avg_rating': 'avg_rating',
+        'rating_count': 'rating_count',
+    }
+
+
+    def to_dict(self, fields=None):
         """Convert product object into a dictionary
 
+        Only the requested fields are read, so a product loaded with just those
+        columns (`load_only`) never lazy loads the rest.
+
+        Args:
+            fields (list[str], optional): the fields to include (keys of SERIALIZED_COLUMNS). Defaults to all fields.
+
         Returns:
             dict: dict of the product object
         """
-        product_dict = {
-            'id': self.id,
-            'seller_id': self.seller_id,
-            'name': self.name,
-            'description': self.description,
-            'price': self.price,
-            'gender': self.gender,
-            'size': self.size,
-            'youth_size': self.youth_size,
-            'featured': self.featured,
-            'brand': self.brand,
-            'sport': self.sport,
-            'quantity': self.quantity,
-            'condition': self.condition,
-            'image': self.image,  # This will be base64-encoded at the API level
-            'date_listed': self.date_listed.isoformat() if self.date_listed else None,
-            'year_product_made': self.year_product_made,
-            'avg_rating': self.avg_rating,
-        }
+        if fields is None:
+            fields = self.SERIALIZED_COLUMNS.keys()
+
+        product_dict = {}
+        for field in fields:
+            value = getattr(self, self.SERIALIZED_COLUMNS[field])
+
+            if field == 'image_url':
+                value = f'/images/{value}' if value else None  # served by the image endpoint
+            elif field in ('thumbnail_url', 'medium_url'):
+                size = 'thumb' if field == 'thumbnail_url' else 'medium'
+                value = f'/images/{value}/{size}' if value else None  # resized renditions of the image
+            elif field == 'date_listed':
+                value = value.isoformat() if value else None
+
+            product_dict[field] = value
 
         return product_dict
 
 
+    def mark_modified(self):
+        """Bump the version of the product (`updated_at` is set when the change is flushed).
+
+        Done as a SQL expression so concurrent changes each get their own version.
+        """
+        self.version = Product.version + 1
+
+
     def __repr__(self):
         """String representation of the Product object for debugging purposes.
 
@@ -91,3 +156,35 @@ class Product(db.Model):
             str: string representation of the Product object
         """
         return f"<Product {self.name} (ID: {self.id})>"
+
+
+# full-text search index over the searchable text of products (SQLite FTS5).
+# it is an external content table (the text isn't copied) kept in sync by triggers,
+# so every way of writing products (orm, bulk statements, raw sql) updates it
+PRODUCT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description, brand, sport,
+        content='product', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    # rank results by bm25, with name matches weighing the most (name, description, brand, sport)
+    """INSERT INTO product_fts(product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 4.0, 4.0)')""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description, brand, sport)
+        VALUES (new.id, new.name, new.description, new.brand, new.sport);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, brand, sport)
+        VALUES ('delete', old.id, old.name, old.description, old.brand, old.sport);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, description, brand, sport ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, brand, sport)
+        VALUES ('delete', old.id, old.name, old.description, old.brand, old.sport);
+        INSERT INTO product_fts(rowid, name, description, brand, sport)
+        VALUES (new.id, new.name, new.description, new.brand, new.sport);
+    END""",
+]
+
+for statement in PRODUCT_FTS_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+event.listen(Product.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS product_fts').execute_if(dialect='sqlite'))
@@ -0,0 +1,30 @@
+from . import db
+
+
+class Reservation(db.Model):
+    """Database model representing a time-limited hold of a cart on units of a product
+
+    While a hold is active its units are counted in the product's `reserved_quantity`, so
+    they can't be put in other carts or sold to other users.  Holds are extended whenever the
+    cart's item of the product changes or a payment is started, released in bulk by the
+    expiry sweeper once `expires_at` passes, and turned into a sale by checkout.
+
+    Attributes:
+        id (int): The ID primary key of the reservation.
+        cart_id (int): foreign key of the cart.id that holds the units
+        product_id (int): foreign key of the product.id whose units are held
+        quantity (int): the number of units held
+        expires_at (datetime): when the hold is released (UTC)
+    """
+    __table_args__ = (
+        # one hold per cart and product
+        db.Index('ix_reservation_cart_id_product_id', 'cart_id', 'product_id', unique=True),
+        # the expiry sweeper
+        db.Index('ix_reservation_expires_at', 'expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
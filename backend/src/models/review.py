@@ -14,6 +14,12 @@ class Review(db.Model):
         reviewing_user (relationship): relationship to the User model (the user who created this review)
         reviewed_product (relationship): relationship to the Product model (the product that the review is for)
     """
+    __table_args__ = (
+        # pages of a product's reviews, newest or best/worst rated first
+        db.Index('ix_review_product_id_review_date_id', 'product_id', 'review_date', 'id'),
+        db.Index('ix_review_product_id_rating_id', 'product_id', 'rating', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     reviewer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
@@ -0,0 +1,71 @@
+from sqlalchemy import case
+from . import db
+from .review import Review
+
+
+class ReviewSummary(db.Model):
+    """Database model of the rating rollup of a product's reviews (one row per reviewed product)
+
+    Kept up to date by the review service when reviews are added or deleted, so a product's
+    rating summary is read with one primary key lookup however many reviews it has.
+
+    Attributes:
+        product_id (int): primary key, foreign key of the product.id that the summary is for
+        review_count (int): the number of reviews of the product
+        rating_sum (float): the sum of the ratings of the reviews
+        stars_1 .. stars_5 (int): the number of reviews per star rating (ratings are rounded to whole stars)
+    """
+    __tablename__ = 'review_summary'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Float, default=0.0, nullable=False)
+    stars_1 = db.Column(db.Integer, default=0, nullable=False)
+    stars_2 = db.Column(db.Integer, default=0, nullable=False)
+    stars_3 = db.Column(db.Integer, default=0, nullable=False)
+    stars_4 = db.Column(db.Integer, default=0, nullable=False)
+    stars_5 = db.Column(db.Integer, default=0, nullable=False)
+
+    # star rating -> the column that counts its reviews
+    STAR_COLUMNS = {1: 'stars_1', 2: 'stars_2', 3: 'stars_3', 4: 'stars_4', 5: 'stars_5'}
+
+
+    @staticmethod
+    def star_of(rating):
+        """Get the whole star rating a review is counted under (half stars round up)
+
+        Args:
+            rating (float): the rating of the review
+
+        Returns:
+            int: the star rating (1 to 5)
+        """
+        for stars in (1, 2, 3, 4):
+            if rating < stars + 0.5:
+                return stars
+        return 5
+
+
+    @staticmethod
+    def star_of_column():
+        """SQL expression of `star_of` for the rating column of the review table
+
+        Returns:
+            Case: the star rating of each review
+        """
+        return case(*((Review.rating < stars + 0.5, stars) for stars in (1, 2, 3, 4)), else_=5)
+
+
+    def to_dict(self):
+        """Convert review summary object into a dictionary
+
+        Returns:
+            dict: dict of the review summary, with the average rating and the histogram of star ratings
+        """
+        review_count = self.review_count or 0
+        return {
+            'product_id': self.product_id,
+            'count': review_count,
+            'average': round(self.rating_sum / review_count, 2) if review_count else 0.0,
+            'histogram': {str(stars): getattr(self, column) or 0 for stars, column in self.STAR_COLUMNS.items()},
+        }
@@ -0,0 +1,79 @@
+from sqlalchemy import inspect, text
+from . import db
+from .product import PRODUCT_FTS_DDL
+
+
+# columns added to tables after they were first created, which db.create_all() doesn't add to
+# databases that already have the table: (table, column, statements that add (and fill) the column)
+SCHEMA_UPGRADES = [
+    ('product', 'image_hash', [
+        "ALTER TABLE product ADD COLUMN image_hash VARCHAR(64)",
+    ]),
+    ('product', 'version', [
+        "ALTER TABLE product ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+    ]),
+    # sqlite only adds columns with a constant default, existing products count as changed now
+    ('product', 'updated_at', [
+        "ALTER TABLE product ADD COLUMN updated_at DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00.000000'",
+        "UPDATE product SET updated_at = strftime('%Y-%m-%d %H:%M:%S.000000', 'now')",
+    ]),
+    ('product', 'rating_count', [
+        "ALTER TABLE product ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0",
+    ]),
+    # the rating aggregates of existing products are counted from their reviews
+    ('product', 'rating_sum', [
+        "ALTER TABLE product ADD COLUMN rating_sum FLOAT NOT NULL DEFAULT 0.0",
+        """UPDATE product SET
+            rating_count = (SELECT COUNT(*) FROM review WHERE review.product_id = product.id),
+            rating_sum = (SELECT COALESCE(SUM(rating), 0.0) FROM review WHERE review.product_id = product.id),
+            avg_rating = COALESCE((SELECT AVG(rating) FROM review WHERE review.product_id = product.id), 0.0)""",
+    ]),
+    ('product', 'reserved_quantity', [
+        "ALTER TABLE product ADD COLUMN reserved_quantity INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+
+def upgrade_schema():
+    """Bring the tables of an existing database up to date with the models.
+
+    db.create_all() creates missing tables but never alters existing ones, so a database
+    created before a column was added fails every query of its table with "no such column".
+    The missing columns of SCHEMA_UPGRADES are added (each step only runs if its column is
+    missing, so this is safe to run at every start), then the indexes declared on the models
+    that don't exist yet are created (once the columns they index exist).  A product table
+    created before full-text search existed gets the search index (table and triggers), built
+    from its products.
+
+    Returns:
+        list[str]: the "table.column" of each column that was added (and "product_fts" if the
+        search index was created)
+    """
+    # everything runs on the session's connection: inspecting through another checkout of a
+    # shared connection (e.g. an in-memory database) would roll back the steps run so far
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    columns = {table: {column['name'] for column in inspector.get_columns(table)} for table in inspector.get_table_names()}
+
+    added = []
+    for table, column, statements in SCHEMA_UPGRADES:
+        if table not in columns or column in columns[table]:
+            continue
+        for statement in statements:
+            connection.execute(text(statement))
+        columns[table].add(column)
+        added.append(f'{table}.{column}')
+
+    if 'product' in columns and 'product_fts' not in columns:
+        for statement in PRODUCT_FTS_DDL:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+        added.append('product_fts')
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if {column.name for column in index.columns} <= columns.get(table.name, set()):
+                index.create(connection, checkfirst=True)
+
+    db.session.commit()
+    return added
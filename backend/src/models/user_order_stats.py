@@ -0,0 +1,33 @@
+from . import db
+
+
+class UserOrderStats(db.Model):
+    """Database model of the order rollup of a user (one row per user who has ordered)
+
+    Kept up to date by the order service in the transaction that creates each order, so a
+    user's order count and lifetime spend are read with one primary key lookup however many
+    orders they have.
+
+    Attributes:
+        user_id (int): primary key, foreign key of the user.id that the stats are for
+        order_count (int): the number of orders the user has placed
+        lifetime_spend (float): the sum of the totals of the user's orders
+    """
+    __tablename__ = 'user_order_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    lifetime_spend = db.Column(db.Float, default=0.0, nullable=False)
+
+
+    def to_dict(self):
+        """Convert user order stats object into a dictionary
+
+        Returns:
+            dict: dict of the user order stats
+        """
+        return {
+            'user_id': self.user_id,
+            'order_count': self.order_count or 0,
+            'lifetime_spend': round(self.lifetime_spend or 0.0, 2),
+        }
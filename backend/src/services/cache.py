@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class _Flight:
+    """A load of a cache key that is in progress (other threads missing the same key wait on it)."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUTTLCache:
+    """Thread-safe in-process cache with a size bound (least recently used entries are evicted)
+    and a time-to-live per entry.
+
+    Concurrent misses of the same key are coalesced: only the first thread runs the loader
+    and the others wait for its result, so a cold cache doesn't send a stampede of identical
+    queries to the database.
+
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Args:
+            max_size (int): maximum number of entries (0 disables caching, every get loads).
+            ttl (float): seconds an entry stays fresh after it's loaded.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+        # bumped by every invalidation so a load that raced with a write isn't cached
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0, 'coalesced': 0}
+
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Get the cached value of a key, loading (and caching) it on a miss.
+
+        Args:
+            key (Hashable): the cache key.
+            loader (Callable[[], Any]): called with no arguments to load the value on a miss.
+
+        Returns:
+            Any: the cached or freshly loaded value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                del self._entries[key]
+                self._stats['expirations'] += 1
+
+            self._stats['misses'] += 1
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and generation == self._generation and self.max_size > 0:
+                    self._store(key, flight.value)
+            flight.done.set()
+
+        return flight.value
+
+
+    def peek(self, key: Hashable) -> Any:
+        """Get the cached value of a key without loading it (or counting a hit or miss).
+
+        Args:
+            key (Hashable): the cache key.
+
+        Returns:
+            Any: the cached value, or None if it isn't cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+
+    def _store(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entries past the size bound (lock must be held)."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+
+    def invalidate(self, key: Hashable):
+        """Remove a key from the cache.
+
+        Args:
+            key (Hashable): the cache key.
+        """
+        self.invalidate_where(lambda cached_key: cached_key == key)
+
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        """Remove every key matching a predicate from the cache.
+
+        Args:
+            predicate (Callable[[Hashable], bool]): returns True for the keys to remove.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+                self._stats['invalidations'] += 1
+
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        self.invalidate_where(lambda key: True)
+
+
+    def stats(self) -> dict:
+        """Get the cache counters (for tuning the size and ttl).
+
+        Returns:
+            dict: hit/miss/eviction/expiration/invalidation/coalesced counts and the current size.
+        """
+        with self._lock:
+            return {**self._stats, 'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl}
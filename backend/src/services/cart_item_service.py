@@ -1,26 +1,79 @@
 from models.cart_item import CartItem, db
 from models.cart import Cart
+from models.product import Product
 from services.cart_service import CartService
+from services.cart_store import get_cart_store
+from services import reservation_service
+from sqlalchemy import and_, func, select, update
 from sqlalchemy.exc import SQLAlchemyError
 
 
 class CartItemService:
 
 
+    @staticmethod
+    def check_quantity(quantity, minimum=0):
+        """Validates the quantity of a cart item change.
+
+        Args:
+            quantity (int): the quantity to validate.
+            minimum (int, optional): the smallest allowed quantity. Defaults to 0.
+
+        Raises:
+            ValueError: if the quantity isn't an integer of at least `minimum`.
+
+        Returns:
+            int: the quantity
+        """
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < minimum:
+            raise ValueError(f"quantity must be an integer of at least {minimum}")
+        return quantity
+
+
     @staticmethod
     def add_item_to_cart(user_id, product_id, quantity=1):
         """Adds cart item to the given user's cart.
         If the cart item already exists in the cart, then the quantity
         of it is increased by 1
 
+        The subtotal is changed by the value of the added quantity, so the cost doesn't
+        depend on the number of items in the cart.
+
         Args:
             user_id (int): id of the user
             product_id (int): id of the product to add to the cart
             quantity (int, optional): quantity of the product to add. Defaults to 1.
 
+        Raises:
+            ValueError: if the quantity isn't a positive integer, or there isn't enough unreserved
+                stock of the product (nothing is changed).
+
         Returns:
-            Cart: The updated cart object
+            Cart: The updated cart object (the live CartState with a write-behind cart store),
+            or None if the product is not found
         """
+        CartItemService.check_quantity(quantity, 1)
+
+        # the price of the product (without loading the product)
+        price = db.session.execute(select(Product.price).where(Product.id == product_id)).scalar()
+        if price is None:
+            return None
+
+        # with a write-behind cart store only the cart in memory is changed
+        store = get_cart_store()
+        if store.write_behind:
+            while True:
+                cart_id = store.get_cart_id_of_user(user_id) or CartService.create_cart(user_id).id
+                with store.locked_cart(cart_id) as cart:
+                    # the cart is gone if it was ordered since it was looked up (the user gets a new one)
+                    if cart is None:
+                        continue
+                    new_quantity = cart.quantities().get(product_id, 0) + quantity
+                    CartItemService._check_stock(cart_id, {product_id: new_quantity})
+                    cart.set_quantity(product_id, new_quantity)
+                    store.mark_dirty(cart_id)
+                    return cart
+
         # retrieve the user's cart wth CartService
         cart = CartService.get_cart_by_user_id(user_id)
         
@@ -35,17 +88,24 @@ class CartItemService:
         # if the item already exists in the cart, increase the quantity
         if existing_item:
             existing_item.quantity += quantity
+            new_quantity = existing_item.quantity
         else:
             # otherwise, create a new cart item
             cart_item = CartItem(cart_id=cart.id, product_id=product_id, quantity=quantity)
             db.session.add(cart_item)
+            new_quantity = quantity
 
 
-        # update the cart's subtotal after adding/updating the item
-        CartItemService._update_cart_subtotal(cart)
+        # add the value of the added items to the cart's subtotal
+        CartItemService._apply_subtotal_delta(cart.id, quantity * price)
 
-        # commit changes to the db
-        db.session.commit()
+        # hold the stock of the cart's new quantity of the product and commit changes to the db
+        try:
+            reservation_service.hold_items(cart.id, {product_id: new_quantity})
+            db.session.commit()
+        except ValueError:
+            db.session.rollback()
+            raise
         
         # return the updated cart
         return cart
@@ -60,94 +120,436 @@ class CartItemService:
             cart_item_id (int): id of the cart item to remove.
 
         Returns:
-            Cart: The updated cart object, or None if the cart item is not found
+            Cart: The updated cart object (the live CartState with a write-behind cart store),
+            or None if the cart item is not found
         """
+        store = get_cart_store()
+        if store.write_behind:
+            with store.locked_cart(cart_id) as cart:
+                if not cart or cart_item_id not in cart.items:
+                    return None
+                product_id, _ = cart.items.pop(cart_item_id)
+                store.mark_dirty(cart_id)
+            CartItemService._release_removed(cart_id, [product_id])
+            return cart
         
-        # find the cart item by it's id
-        cart_item = CartItem.query.filter_by(id=cart_item_id).first()
+        # find the cart item (in this cart) by it's id, with the price of its product
+        row = db.session.execute(
+            select(CartItem, Product.price)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.id == cart_item_id, CartItem.cart_id == cart_id)
+        ).first()
         
-        if cart_item:
-            # delete the cart item from the database
+        if row:
+            cart_item, price = row
+
+            # delete the cart item, take its value off the cart's subtotal and release its stock
             db.session.delete(cart_item)
+            CartItemService._apply_subtotal_delta(cart_id, -cart_item.quantity * price)
+            reservation_service.hold_items(cart_id, {cart_item.product_id: 0})
             db.session.commit()
 
-            # recalculate the cart's subtotal after removal
-            cart = Cart.query.get(cart_id)
-            if cart:
-                # recalculate subtotal by summing up the product of quantity and price for each item
-                cart.subtotal = sum(item.quantity * item.product.price for item in cart.items)
-                
-                # commit changes to the db
-                db.session.commit()
-
             # return the updated cart object
-            return cart
+            return db.session.get(Cart, cart_id)
 
         # return None if the cart item is not found
         return None
             
             
     @staticmethod
-    def update_item_and_cart(cart, item_id, new_quantity):
+    def update_item_and_cart(cart_id, item_id, new_quantity):
         """Updates the quantity of a specific item in the cart or removes the item if quantity is zero.
 
         Args:
-            cart (Cart): the cart object.
+            cart_id (int): the ID of the cart.
             item_id (int): the ID of the cart item to update.
             new_quantity (int): the new quantity for the cart item.
 
         Raises:
-            ValueError: if the cart item is not found or the requested quantity exceeds stock.
+            ValueError: if the new quantity is negative, the cart item is not found or the
+                requested quantity exceeds the (unreserved) stock.
             RuntimeError: if a database error occurs.
 
         Returns:
             None
         """
-        # find the cart item, from the given cart object if it exists
-        cart_item = next((item for item in cart.items if item.id == item_id), None)
+        CartItemService.check_quantity(new_quantity)
+
+        store = get_cart_store()
+        if store.write_behind:
+            with store.locked_cart(cart_id) as cart:
+                if not cart or item_id not in cart.items:
+                    raise ValueError(f"Cart item with ID {item_id} not found.")
+                product_id = cart.items[item_id][0]
+
+                CartItemService._check_stock(cart_id, {product_id: new_quantity})
+                cart.set_quantity(product_id, new_quantity)
+                store.mark_dirty(cart_id)
+            if new_quantity == 0:
+                CartItemService._release_removed(cart_id, [product_id])
+            return
+
+        # find the cart item in the given cart, with the price, stock and name of its product
+        row = db.session.execute(
+            select(CartItem, Product.price, Product.quantity, Product.name)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.id == item_id, CartItem.cart_id == cart_id)
+        ).first()
         
         # if the cart item is not found in the given cart
-        if not cart_item:
+        if not row:
             raise ValueError(f"Cart item with ID {item_id} not found.")
+        cart_item, price, stock, product_name = row
         
 
         # if the new quantity exceeds the product quantity
-        if new_quantity > cart_item.product.quantity:
-            raise ValueError(f"Only {cart_item.product.quantity} units of {cart_item.product.name} are available.")
+        if new_quantity > stock:
+            raise ValueError(f"Only {stock} units of {product_name} are available.")
+
 
+        # change the subtotal by the difference in the value of the item
+        delta = (new_quantity - cart_item.quantity) * price
+        product_id = cart_item.product_id
 
         # update the quantity or remove the item if quantity is zero
         if new_quantity == 0:
-            cart.items = [item for item in cart.items if item.id != item_id]
+            db.session.delete(cart_item)
         else:
             cart_item.quantity = new_quantity
-            
-            
-        # recalculate the subtotal
-        cart.subtotal = sum(item.quantity * item.product.price for item in cart.items)
 
 
-        # commit the changes to the db
+        # hold the stock of the new quantity and commit the changes to the db
         try:
-            db.session.add(cart)
+            CartItemService._apply_subtotal_delta(cart_id, delta)
+            reservation_service.hold_items(cart_id, {product_id: new_quantity})
             db.session.commit()
+        except ValueError:
+            db.session.rollback()
+            raise
         except SQLAlchemyError as e:
             db.session.rollback()
             raise RuntimeError("Database error occurred: " + str(e))
 
         
+    # the operations of a batched cart change
+    CART_OPERATIONS = ('add', 'set', 'remove')
+
+    # most operations that can be applied to a cart in one batch
+    MAX_CART_OPERATIONS = 100
+
+
+    @staticmethod
+    def parse_cart_operations(data):
+        """Validates the body of a batched cart change.
+
+        Args:
+            data (dict): the request body, with a list of `operations`, each a dict of
+                `op` ("add", "set" or "remove"), `product_id` and `quantity` (not needed for "remove").
+
+        Raises:
+            ValueError: if the operations are missing or malformed, or there are too many of them.
+
+        Returns:
+            list[tuple]: the (op, product_id, quantity) of each operation, in order.
+        """
+        operations = (data or {}).get('operations')
+        if not isinstance(operations, list) or not operations:
+            raise ValueError("operations must be a non-empty list")
+        if len(operations) > CartItemService.MAX_CART_OPERATIONS:
+            raise ValueError(f"At most {CartItemService.MAX_CART_OPERATIONS} operations can be applied at once")
+
+        parsed = []
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict) or operation.get('op') not in CartItemService.CART_OPERATIONS:
+                raise ValueError(f"Operation {index}: op must be one of: {', '.join(CartItemService.CART_OPERATIONS)}")
+            op = operation['op']
+
+            product_id = operation.get('product_id')
+            if not isinstance(product_id, int) or isinstance(product_id, bool):
+                raise ValueError(f"Operation {index}: product_id must be an integer")
+
+            quantity = operation.get('quantity', 1 if op == 'add' else None)
+            if op != 'remove':
+                try:
+                    CartItemService.check_quantity(quantity, 1 if op == 'add' else 0)
+                except ValueError as e:
+                    raise ValueError(f"Operation {index}: {e}")
+
+            parsed.append((op, product_id, quantity))
+        return parsed
+
+
     @staticmethod
-    def _update_cart_subtotal(cart):
-        """Updates the subtotal of the cart based on its cart items.
+    def apply_cart_operations(cart_id, operations):
+        """Applies a batch of add, set quantity and remove operations to a cart in one transaction.
+
+        The products and the cart's items of them are read with one query, every operation is
+        validated against the stock before anything is written, and the subtotal is changed
+        with one UPDATE, so debounced edits of the cart page are saved in one round trip.
 
         Args:
-            cart (Cart): the cart object to update.
+            cart_id (int): id of the cart.
+            operations (list[tuple]): the (op, product_id, quantity) of each operation, applied
+                in order (from `parse_cart_operations`).
+
+        Raises:
+            ValueError: if a product doesn't exist or its final quantity exceeds its stock, or
+                its unreserved stock (nothing is changed).
+            RuntimeError: if a database error occurs.
+
+        Returns:
+            Cart: the updated cart object (the live CartState with a write-behind cart store),
+            or None if the cart is not found
+        """
+        product_ids = {product_id for _, product_id, _ in operations}
+
+        store = get_cart_store()
+        if store.write_behind:
+            with store.locked_cart(cart_id) as cart:
+                if not cart:
+                    return None
+
+                products = CartItemService._stock_of(cart_id, product_ids)
+                quantities = CartItemService._final_quantities(cart.quantities(), operations, products)
+
+                for product_id, quantity in quantities.items():
+                    cart.set_quantity(product_id, quantity)
+                store.mark_dirty(cart_id)
+            CartItemService._release_removed(cart_id, [product_id for product_id, quantity in quantities.items() if not quantity])
+            return cart
+
+        cart = db.session.get(Cart, cart_id)
+        if not cart:
+            return None
+
+        # every product of the batch (with its stock available to the cart) and the cart's item
+        # of it (if any), in one query
+        available = Product.quantity - Product.reserved_quantity + reservation_service.held_quantity(cart_id)
+        rows = {
+            row.id: row
+            for row in db.session.execute(
+                select(Product.id, Product.price, Product.name, available.label('available'), CartItem)
+                .outerjoin(CartItem, and_(CartItem.product_id == Product.id, CartItem.cart_id == cart_id))
+                .where(Product.id.in_(product_ids))
+            )
+        }
+        quantities = CartItemService._final_quantities(
+            {product_id: row.CartItem.quantity if row.CartItem else 0 for product_id, row in rows.items()},
+            operations,
+            rows,
+        )
+
+        # write the changed items and change the subtotal by their change in value
+        delta = 0.0
+        for product_id, quantity in quantities.items():
+            row = rows[product_id]
+            cart_item = row.CartItem
+            delta += (quantity - (cart_item.quantity if cart_item else 0)) * row.price
+
+            if cart_item and quantity == 0:
+                db.session.delete(cart_item)
+            elif cart_item:
+                cart_item.quantity = quantity
+            elif quantity:
+                db.session.add(CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity))
+
+        try:
+            CartItemService._apply_subtotal_delta(cart_id, delta)
+            reservation_service.hold_items(cart_id, quantities)
+            db.session.commit()
+        except ValueError:
+            db.session.rollback()
+            raise
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise RuntimeError("Database error occurred: " + str(e))
+
+        return cart
+
+
+    @staticmethod
+    def _final_quantities(current, operations, products):
+        """Works out the quantity of each product of a batch of cart operations once they're all
+        applied, and checks them against the stock.
+
+        Args:
+            current (dict[int, int]): product id -> quantity in the cart now.
+            operations (list[tuple]): the (op, product_id, quantity) of each operation, in order.
+            products (dict[int, Row]): product id -> row with the name and the stock available
+                to the cart (`available`) of every product of the batch.
+
+        Raises:
+            ValueError: if a product doesn't exist or its final quantity exceeds its available stock.
+
+        Returns:
+            dict[int, int]: product id -> final quantity, for every product of the batch
+        """
+        missing = {product_id for _, product_id, _ in operations} - products.keys()
+        if missing:
+            raise ValueError(f"Products not found: {', '.join(map(str, sorted(missing)))}")
+
+        quantities = {product_id: current.get(product_id, 0) for product_id in products}
+        for op, product_id, quantity in operations:
+            if op == 'add':
+                quantities[product_id] += quantity
+            elif op == 'set':
+                quantities[product_id] = quantity
+            else:
+                quantities[product_id] = 0
+
+        for product_id, quantity in quantities.items():
+            if quantity > products[product_id].available:
+                raise ValueError(f"Only {products[product_id].available} units of {products[product_id].name} are available.")
+        return quantities
+
+
+    @staticmethod
+    def _stock_of(cart_id, product_ids):
+        """Reads the stock of products that is available to a cart: the units that aren't held,
+        or are held by the cart.
+
+        Args:
+            cart_id (int): id of the cart.
+            product_ids (Iterable[int]): ids of the products.
+
+        Returns:
+            dict[int, Row]: product id -> row with the name and `available` stock of the product
+        """
+        available = Product.quantity - Product.reserved_quantity + reservation_service.held_quantity(cart_id)
+        return {
+            row.id: row
+            for row in db.session.execute(
+                select(Product.id, Product.name, available.label('available')).where(Product.id.in_(product_ids))
+            )
+        }
+
+
+    @staticmethod
+    def _check_stock(cart_id, quantities):
+        """Checks new quantities of products in a cart against the stock available to the cart.
+
+        Args:
+            cart_id (int): id of the cart.
+            quantities (dict[int, int]): product id -> its new quantity in the cart.
+
+        Raises:
+            ValueError: if a quantity exceeds the stock available to the cart.
+        """
+        for product_id, row in CartItemService._stock_of(cart_id, quantities).items():
+            if quantities[product_id] > row.available:
+                raise ValueError(f"Only {row.available} units of {row.name} are available.")
+
+
+    @staticmethod
+    def _release_removed(cart_id, product_ids):
+        """Releases the holds of a write-behind cart on products that were taken out of it.
+
+        Holds are only taken when a payment is started, so usually nothing is held and this is
+        one SELECT without a write.
+
+        Args:
+            cart_id (int): id of the cart.
+            product_ids (list[int]): ids of the products that are no longer in the cart.
 
         Returns:
             None
         """
-        # calculate the subtotal by summing up the product of quantity and price for each item
-        cart.subtotal = sum(item.quantity * item.product.price for item in cart.items)
-        
-        # add to the db
-        db.session.add(cart)
+        if not product_ids:
+            return
+
+        try:
+            reservation_service.hold_items(cart_id, dict.fromkeys(product_ids, 0))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+    @staticmethod
+    def find_item_id(cart_id, product_id):
+        """Finds the cart's item of a product.
+
+        Args:
+            cart_id (int): id of the cart.
+            product_id (int): id of the product.
+
+        Returns:
+            int: the id of the cart item, or None if the cart or the item is not found
+        """
+        store = get_cart_store()
+        if store.write_behind:
+            with store.locked_cart(cart_id) as cart:
+                return cart.item_of_product(product_id) if cart else None
+
+        return db.session.execute(
+            select(CartItem.id).where(CartItem.cart_id == cart_id, CartItem.product_id == product_id)
+        ).scalar()
+
+
+    @staticmethod
+    def _apply_subtotal_delta(cart_id, delta):
+        """Changes the subtotal of a cart by the change in value of its items, with one UPDATE
+        (in the caller's transaction).
+
+        Args:
+            cart_id (int): id of the cart to update.
+            delta (float): the change of the subtotal.
+
+        Returns:
+            None
+        """
+        if not delta:
+            return
+
+        # rounded to cents so repeated changes don't accumulate floating point error
+        db.session.execute(
+            update(Cart)
+            .where(Cart.id == cart_id)
+            .values(subtotal=func.round(func.coalesce(Cart.subtotal, 0.0) + delta, 2))
+            .execution_options(synchronize_session=False)
+        )
+
+
+    @staticmethod
+    def carts_containing(product_ids):
+        """Finds the carts that contain any of some products.
+
+        Args:
+            product_ids (list[int] | Select): ids of the products (a list or a select of them).
+
+        Returns:
+            list[int]: ids of the carts
+        """
+        return db.session.execute(
+            select(CartItem.cart_id).where(CartItem.product_id.in_(product_ids)).distinct()
+        ).scalars().all()
+
+
+    @staticmethod
+    def recompute_subtotals(cart_ids=None):
+        """Recomputes the subtotals of carts from the current prices of their items with one
+        UPDATE (a SUM(quantity * price) over the cart items joined with their products).
+
+        This is the authoritative subtotal, used when prices change (the incremental changes
+        are computed with the price at the time of each change). Runs in the caller's transaction.
+
+        Args:
+            cart_ids (list[int], optional): ids of the carts to recompute. Defaults to all carts.
+
+        Returns:
+            int: the number of carts recomputed
+        """
+        line_totals = (
+            select(func.coalesce(func.round(func.sum(CartItem.quantity * Product.price), 2), 0.0))
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.cart_id == Cart.id)
+            .scalar_subquery()
+        )
+
+        statement = update(Cart).values(subtotal=line_totals).execution_options(synchronize_session=False)
+        if cart_ids is not None:
+            if not cart_ids:
+                return 0
+            statement = statement.where(Cart.id.in_(cart_ids))
+
+        return db.session.execute(statement).rowcount
@@ -1,4 +1,9 @@
 from models.cart import Cart, db
+from models.cart_item import CartItem
+from models.product import Product
+from services.cart_store import get_cart_store
+from services import reservation_service
+from sqlalchemy import select
 
 
 class CartService:
@@ -18,6 +23,102 @@ class CartService:
         return Cart.query.filter_by(user_id=user_id).first()
     
     
+    @staticmethod
+    def get_cart_view(cart_id=None, user_id=None):
+        """
+        Read a cart with its items and their product names and prices in one joined query
+        (the response of every cart endpoint). Only the needed product columns are read.
+        
+        Args:
+            cart_id (int, optional): ID of the cart.
+            user_id (int, optional): ID of the user whose cart to read (if no cart_id is given).
+        
+        Returns:
+            dict: The cart's id, user_id, subtotal and items, or None if the cart is not found.
+        """
+        store = get_cart_store()
+        if store.write_behind:
+            return CartService._get_live_cart_view(store, cart_id, user_id)
+
+        if cart_id is None:
+            # the user's first cart, as in get_cart_by_user_id (a subquery of the same statement)
+            cart_id = select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.id).limit(1).scalar_subquery()
+
+        rows = db.session.execute(
+            select(
+                Cart.id, Cart.user_id, Cart.subtotal,
+                CartItem.id.label('item_id'), CartItem.product_id, CartItem.quantity,
+                Product.name.label('product_name'), Product.price.label('product_price'),
+            )
+            .outerjoin(CartItem, CartItem.cart_id == Cart.id)
+            .outerjoin(Product, Product.id == CartItem.product_id)
+            .where(Cart.id == cart_id)
+            .order_by(CartItem.id)
+        ).all()
+
+        if not rows:
+            return None
+
+        return {
+            'id': rows[0].id,
+            'user_id': rows[0].user_id,
+            'subtotal': rows[0].subtotal,
+            'items': [{
+                'id': row.item_id,
+                'product_id': row.product_id,
+                'quantity': row.quantity,
+                'product_name': row.product_name,
+                'product_price': row.product_price,
+            } for row in rows if row.item_id is not None],
+        }
+    
+    
+    @staticmethod
+    def _get_live_cart_view(store, cart_id, user_id):
+        """
+        Read a cart held by a write-behind cart store, with the names and prices of its products
+        in one query. The subtotal is worked out from the current prices.
+        
+        Args:
+            store (MemoryCartStore): the cart store.
+            cart_id (int): ID of the cart (or None to read the user's cart).
+            user_id (int): ID of the user whose cart to read.
+        
+        Returns:
+            dict: The cart's id, user_id, subtotal and items, or None if the cart is not found.
+        """
+        if cart_id is None:
+            cart_id = store.get_cart_id_of_user(user_id)
+            if cart_id is None:
+                return None
+
+        with store.locked_cart(cart_id) as cart:
+            if not cart:
+                return None
+            items = [(item_id, product_id, quantity) for item_id, (product_id, quantity) in cart.items.items()]
+
+        products = {
+            row.id: row
+            for row in db.session.execute(
+                select(Product.id, Product.name, Product.price)
+                .where(Product.id.in_({product_id for _, product_id, _ in items}))
+            )
+        }
+
+        return {
+            'id': cart.id,
+            'user_id': cart.user_id,
+            'subtotal': round(sum(quantity * products[product_id].price for _, product_id, quantity in items), 2),
+            'items': [{
+                'id': item_id,
+                'product_id': product_id,
+                'quantity': quantity,
+                'product_name': products[product_id].name,
+                'product_price': products[product_id].price,
+            } for item_id, product_id, quantity in items],
+        }
+    
+    
     @staticmethod
     def create_cart(user_id, subtotal=0.0):
         """
@@ -80,6 +181,10 @@ class CartService:
         
         # if found delete the cart and return true
         if cart:
+            # and drop its unwritten changes
+            get_cart_store().discard(cart_id)
+            # release the stock it holds
+            reservation_service.release_cart_holds(cart_id)
             db.session.delete(cart)
             db.session.commit()
             return True
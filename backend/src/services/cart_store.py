@@ -0,0 +1,513 @@
+import atexit
+import itertools
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from config.config import Config
+from models.cart import Cart, db
+from models.cart_item import CartItem
+from models.product import Product
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+# ids of cart items added to carts held in memory (negative so they never clash with the
+# ids of the cart_item table; the items take the ids of their rows when the cart is flushed)
+_new_item_ids = itertools.count(-1, -1)
+
+# number of locks the carts of the memory cart store are spread over (carts with different
+# locks are used concurrently)
+CART_LOCK_STRIPES = 64
+
+
+class CartState:
+    """A live cart held by the memory cart store.
+
+    Has the `id` and `user_id` of the Cart model, so callers can use either.
+
+    Attributes:
+        id (int): id of the cart (the cart row always exists, only its items are held back).
+        user_id (int): id of the user who owns the cart.
+        items (dict[int, list[int]]): cart item id -> [product_id, quantity], in the order the
+            items were added.
+    """
+
+    def __init__(self, cart_id, user_id, items=None):
+        self.id = cart_id
+        self.user_id = user_id
+        self.items = items if items is not None else {}
+
+
+    def item_of_product(self, product_id):
+        """Get the id of the cart's item of a product.
+
+        Args:
+            product_id (int): id of the product.
+
+        Returns:
+            int: the id of the cart item, or None if the product is not in the cart
+        """
+        return next((item_id for item_id, (item_product_id, _) in self.items.items() if item_product_id == product_id), None)
+
+
+    def quantities(self):
+        """Get the quantity of each product in the cart.
+
+        Returns:
+            dict[int, int]: product id -> quantity
+        """
+        return {product_id: quantity for product_id, quantity in self.items.values()}
+
+
+    def set_quantity(self, product_id, quantity):
+        """Set the quantity of a product in the cart (adding the item if needed, removing it if zero).
+
+        Args:
+            product_id (int): id of the product.
+            quantity (int): the new quantity.
+        """
+        item_id = self.item_of_product(product_id)
+        if quantity == 0:
+            if item_id is not None:
+                del self.items[item_id]
+        elif item_id is None:
+            self.items[next(_new_item_ids)] = [product_id, quantity]
+        else:
+            self.items[item_id][1] = quantity
+
+
+class SqlCartStore:
+    """Cart store that keeps nothing in memory: every cart change is written to the cart and
+    cart_item tables when it's made (the default)."""
+
+    write_behind = False
+
+
+    def flush(self, cart_ids=None):
+        """Nothing is held back, so there is nothing to write.
+
+        Returns:
+            int: 0
+        """
+        return 0
+
+
+    def flush_user(self, user_id):
+        """Nothing is held back, so there is nothing to write."""
+
+
+    def discard(self, cart_id):
+        """Nothing is held, so there is nothing to forget."""
+
+
+    def pin_user_cart(self, user_id):
+        """Nothing is held, so there is nothing to pin (checkout locks the rows it writes).
+
+        Returns:
+            None: no cart is pinned
+        """
+        return None
+
+
+    def unpin(self, cart_id, ordered=False):
+        """Nothing is pinned, so there is nothing to unpin."""
+
+
+class MemoryCartStore:
+    """Write-behind cart store: live carts are held in process and their items are written to
+    the cart_item table in batches (periodically, at shutdown, and before a cart is ordered).
+
+    Adding, changing and removing items only takes an in-process lock, not SQLite's write lock
+    (so no stock is held for the items until a payment is started, see reservation_service).
+    A cart is loaded with one query the first time it's used, and carts that weren't used
+    between two periodic flushes are dropped from memory (they're up to date in the db).
+
+    Each cart has its own lock (one of CART_LOCK_STRIPES locks), which the services hold while
+    they read or change it (see `locked_cart`), so a request only waits for requests on the same
+    cart (or one sharing its lock), never for the db IO of other carts.  A cart that is being
+    ordered stays locked by its checkout (see `pin_user_cart`): other threads wait for the
+    checkout to end before they can use it, and periodic flushes leave it alone.
+    """
+
+    write_behind = True
+
+
+    def __init__(self):
+        self._lock = threading.Lock()  # guards the dicts below, never held during db IO
+        self._cart_locks = [threading.RLock() for _ in range(CART_LOCK_STRIPES)]
+        self._carts = {}  # cart id -> CartState
+        self._user_carts = {}  # user id -> cart id
+        self._dirty = set()  # ids of the carts changed since they were last written
+        self._touched = set()  # ids of the carts used since the last periodic flush
+
+
+    @contextmanager
+    def locked_cart(self, cart_id):
+        """Lock a live cart while it's read or changed, loading it (with its items) with one
+        query if it's not in memory.
+
+        Args:
+            cart_id (int): id of the cart.
+
+        Yields:
+            CartState: the cart, or None if it doesn't exist (or was ordered while waiting)
+        """
+        with self._cart_lock(cart_id):
+            yield self._load(cart_id)
+
+
+    def get_cart(self, cart_id):
+        """Get a live cart, loading it (with its items) with one query if it's not in memory.
+
+        Args:
+            cart_id (int): id of the cart.
+
+        Returns:
+            CartState: the cart, or None if it doesn't exist
+        """
+        with self.locked_cart(cart_id) as cart:
+            return cart
+
+
+    def get_cart_id_of_user(self, user_id):
+        """Get the id of a user's cart (from memory, or with one query).
+
+        Args:
+            user_id (int): id of the user.
+
+        Returns:
+            int: the id of the user's cart, or None if the user has no cart
+        """
+        with self._lock:
+            cart_id = self._user_carts.get(user_id)
+        if cart_id is None:
+            cart_id = db.session.execute(
+                select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.id).limit(1)
+            ).scalar()
+        return cart_id
+
+
+    def mark_dirty(self, cart_id):
+        """Record that a cart was changed and needs to be written.
+
+        Args:
+            cart_id (int): id of the cart.
+        """
+        with self._lock:
+            self._dirty.add(cart_id)
+            self._touched.add(cart_id)
+
+
+    def flush(self, cart_ids=None):
+        """Write the items and subtotals of changed carts to the db in one transaction.
+
+        The items of the written carts are written with a fixed number of set-based statements
+        (see `_write`), and their subtotals are set from the current prices with one bulk
+        UPDATE.  New items take the ids the db gave them.  The written carts stay locked until
+        they're committed, so a cart is never written by two flushes at once.
+
+        A periodic (full, no cart_ids) flush skips the carts that are locked (being changed or
+        ordered), which stay dirty for the next one, and drops the carts that weren't used since
+        the previous one.
+
+        Args:
+            cart_ids (list[int], optional): ids of the carts to write. Defaults to all changed carts.
+
+        Returns:
+            int: the number of carts written
+        """
+        with self._lock:
+            pending = set(self._dirty) if cart_ids is None else self._dirty & set(cart_ids)
+            unused = set(self._carts) - self._touched - pending if cart_ids is None else set()
+            if cart_ids is None:
+                self._touched.clear()
+
+        with ExitStack() as locks:
+            # the locks of the carts are taken in the order of the locks, so flushes that wait for
+            # them can't deadlock (a cart locked by this thread, e.g. its checkout, is reentered)
+            snapshot = {}
+            for cart_id in sorted(pending, key=self._cart_lock_index):
+                cart_lock = self._cart_lock(cart_id)
+                if not cart_lock.acquire(blocking=cart_ids is not None):
+                    continue
+                locks.callback(cart_lock.release)
+
+                with self._lock:
+                    cart = self._carts.get(cart_id)
+                    if cart is not None and cart_id in self._dirty:
+                        snapshot[cart_id] = [(item_id, product_id, quantity) for item_id, (product_id, quantity) in cart.items.items()]
+                        self._dirty.discard(cart_id)
+
+            if snapshot:
+                try:
+                    new_ids = self._write(snapshot)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        self._dirty |= snapshot.keys() & self._carts.keys()
+                    raise
+
+                # the new items are known by their ids in the db from now on
+                for cart_id, ids in new_ids.items():
+                    cart = self._carts.get(cart_id)
+                    if cart is not None and ids:
+                        cart.items = {ids.get(item_id, item_id): item for item_id, item in cart.items.items()}
+
+        # drop the unused carts that nobody is using right now
+        for cart_id in unused:
+            cart_lock = self._cart_lock(cart_id)
+            if cart_lock.acquire(blocking=False):
+                try:
+                    with self._lock:
+                        if cart_id not in self._touched and cart_id not in self._dirty:
+                            self._forget(cart_id)
+                finally:
+                    cart_lock.release()
+
+        return len(snapshot)
+
+
+    def flush_user(self, user_id):
+        """Write a user's cart to the db if it has changes (e.g. before it's ordered).
+
+        Args:
+            user_id (int): id of the user.
+        """
+        with self._lock:
+            cart_id = self._user_carts.get(user_id)
+        if cart_id is not None:
+            self.flush([cart_id])
+
+
+    def discard(self, cart_id):
+        """Forget a cart and its unwritten changes (when the cart is deleted or ordered).
+
+        Args:
+            cart_id (int): id of the cart.
+        """
+        with self._cart_lock(cart_id), self._lock:
+            self._forget(cart_id)
+
+
+    def pin_user_cart(self, user_id):
+        """Write a user's cart to the db and keep it locked for checkout, until `unpin` is called
+        (by the same thread).
+
+        While the cart is pinned, other threads wait to use it and periodic flushes skip it,
+        so nothing can be added to it after it's written or written back after it's ordered.
+
+        Args:
+            user_id (int): id of the user.
+
+        Returns:
+            int: the id of the pinned cart, or None if the user has no cart
+        """
+        while True:
+            cart_id = self.get_cart_id_of_user(user_id)
+            if cart_id is None:
+                return None
+
+            cart_lock = self._cart_lock(cart_id)
+            cart_lock.acquire()
+            try:
+                # the cart is gone if it was ordered since it was looked up (look up the user's new one)
+                if self._load(cart_id) is None:
+                    cart_lock.release()
+                    continue
+                self.flush([cart_id])
+            except Exception:
+                cart_lock.release()
+                raise
+            return cart_id
+
+
+    def unpin(self, cart_id, ordered=False):
+        """Unlock a cart pinned for checkout, so the threads waiting for it can use it.
+
+        Args:
+            cart_id (int): id of the cart (None does nothing).
+            ordered (bool, optional): whether the cart was ordered (and deleted), then it's
+                forgotten too. Defaults to False.
+        """
+        if cart_id is None:
+            return
+        if ordered:
+            with self._lock:
+                self._forget(cart_id)
+        self._cart_lock(cart_id).release()
+
+
+    def _cart_lock_index(self, cart_id):
+        """Get the index of the lock of a cart."""
+        return cart_id % CART_LOCK_STRIPES
+
+
+    def _cart_lock(self, cart_id):
+        """Get the lock of a cart."""
+        return self._cart_locks[self._cart_lock_index(cart_id)]
+
+
+    def _load(self, cart_id):
+        """Get a live cart, loading it with one query if it's not in memory (the caller holds
+        the cart's lock, so only the cart's lock is held during the query).
+
+        Args:
+            cart_id (int): id of the cart.
+
+        Returns:
+            CartState: the cart, or None if it doesn't exist
+        """
+        with self._lock:
+            cart = self._carts.get(cart_id)
+            if cart is not None:
+                self._touched.add(cart_id)
+                return cart
+
+        rows = db.session.execute(
+            select(Cart.user_id, CartItem.id, CartItem.product_id, CartItem.quantity)
+            .outerjoin(CartItem, CartItem.cart_id == Cart.id)
+            .where(Cart.id == cart_id)
+            .order_by(CartItem.id)
+        ).all()
+        if not rows:
+            return None
+
+        cart = CartState(cart_id, rows[0].user_id, {
+            row.id: [row.product_id, row.quantity] for row in rows if row.id is not None
+        })
+        with self._lock:
+            self._carts[cart_id] = cart
+            self._user_carts[cart.user_id] = cart_id
+            self._touched.add(cart_id)
+        return cart
+
+
+    def _forget(self, cart_id):
+        """Drop a cart from memory (the caller holds the lock)."""
+        cart = self._carts.pop(cart_id, None)
+        if cart is not None and self._user_carts.get(cart.user_id) == cart_id:
+            del self._user_carts[cart.user_id]
+        self._dirty.discard(cart_id)
+        self._touched.discard(cart_id)
+
+
+    @staticmethod
+    def _write(snapshot):
+        """Write the items of carts to the db and set their subtotals (in the caller's transaction).
+
+        Only the difference is written, and existing rows keep their ids: the rows of items
+        that were removed are deleted with one DELETE, the quantities of items that came from
+        the db are upserted by id, and new items are inserted with one bulk INSERT that returns
+        the ids they got.
+
+        Args:
+            snapshot (dict[int, list[tuple]]): cart id -> the (item_id, product_id, quantity) of its items.
+
+        Returns:
+            dict[int, dict[int, int]]: cart id -> the in-memory id of each new item -> its id in the db
+        """
+        # carts deleted since they were changed are skipped
+        cart_ids = db.session.execute(select(Cart.id).where(Cart.id.in_(snapshot))).scalars().all()
+        if not cart_ids:
+            return {}
+
+        items = [(cart_id, item) for cart_id in cart_ids for item in snapshot[cart_id]]
+        existing = [(cart_id, item) for cart_id, item in items if item[0] > 0]
+        new = [(cart_id, item) for cart_id, item in items if item[0] < 0]
+        prices = dict(db.session.execute(
+            select(Product.id, Product.price).where(Product.id.in_({product_id for _, (_, product_id, _) in items}))
+        ).all())
+
+        db.session.execute(
+            delete(CartItem)
+            .where(CartItem.cart_id.in_(cart_ids), CartItem.id.not_in([item_id for _, (item_id, _, _) in existing]))
+            .execution_options(synchronize_session=False)
+        )
+        if existing:
+            statement = sqlite_insert(CartItem)
+            db.session.execute(
+                statement.on_conflict_do_update(index_elements=[CartItem.id], set_={'quantity': statement.excluded.quantity}),
+                [
+                    {'id': item_id, 'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity}
+                    for cart_id, (item_id, product_id, quantity) in existing
+                ],
+            )
+
+        new_ids = {cart_id: {} for cart_id in cart_ids}
+        if new:
+            inserted_ids = db.session.execute(
+                insert(CartItem).returning(CartItem.id, sort_by_parameter_order=True),
+                [
+                    {'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity}
+                    for cart_id, (_, product_id, quantity) in new
+                ],
+            ).scalars().all()
+            for (cart_id, (item_id, _, _)), inserted_id in zip(new, inserted_ids):
+                new_ids[cart_id][item_id] = inserted_id
+
+        subtotals = dict.fromkeys(cart_ids, 0.0)
+        for cart_id, (_, product_id, quantity) in items:
+            subtotals[cart_id] += quantity * prices.get(product_id, 0.0)
+        db.session.execute(update(Cart), [{'id': cart_id, 'subtotal': round(subtotal, 2)} for cart_id, subtotal in subtotals.items()])
+
+        return new_ids
+
+
+# name of a cart store (the CART_STORE setting) -> its class
+CART_STORES = {
+    'sql': SqlCartStore,
+    'memory': MemoryCartStore,
+}
+
+_store = CART_STORES[Config.CART_STORE]()
+
+
+def get_cart_store():
+    """Get the cart store that the cart services use.
+
+    Returns:
+        SqlCartStore | MemoryCartStore: the cart store
+    """
+    return _store
+
+
+def set_cart_store(store):
+    """Replace the cart store that the cart services use (e.g. in tests).
+
+    Args:
+        store (SqlCartStore | MemoryCartStore): the new cart store
+
+    Returns:
+        SqlCartStore | MemoryCartStore: the previous cart store
+    """
+    global _store
+    previous, _store = _store, store
+    return previous
+
+
+def init_app(app):
+    """Start writing a write-behind cart store to the db periodically and at shutdown.
+
+    Args:
+        app (Flask): the flask app (the flushes run in its app context)
+    """
+    store = get_cart_store()
+    if not store.write_behind or app.config.get('TESTING', False):
+        return
+
+    def flush():
+        with app.app_context():
+            try:
+                store.flush()
+            except Exception as e:
+                # the carts stay dirty and are written by the next flush
+                print(f"Error flushing carts: {e}")
+
+    def run():
+        while True:
+            time.sleep(Config.CART_FLUSH_INTERVAL)
+            flush()
+
+    threading.Thread(target=run, name='cart-flusher', daemon=True).start()
+    atexit.register(flush)
@@ -0,0 +1,151 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from config.config import Config
+from models.idempotency_key import IdempotencyKey, db
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+# (scope, key) -> event set when the request running with the key in this process finishes,
+# so duplicates in the same process wake up at once instead of polling the db
+_running = {}
+_running_lock = threading.Lock()
+
+# how often a duplicate of a request running in another process checks whether it finished (seconds)
+_POLL_INTERVAL = 0.1
+
+
+def claim(scope: str, key: str, request_hash: str, now: Optional[datetime] = None) -> bool:
+    """Claim an idempotency key for a request that is about to run.
+
+    One conditional upsert: the key is claimed if it's new or has expired, and left alone if
+    another request holds it, so two concurrent requests can never both claim it.  The claim is
+    a short lease (IDEMPOTENCY_LEASE_TIMEOUT), so a key whose request never finished (e.g. its
+    worker died) can be claimed by a retry; `complete` extends it to IDEMPOTENCY_KEY_TTL.
+
+    Args:
+        scope (str): the method and path of the request.
+        key (str): the client's Idempotency-Key.
+        request_hash (str): SHA-1 of the request body.
+        now (Optional[datetime]): the current time (UTC). Defaults to now.
+
+    Returns:
+        bool: True if the request claimed the key and must run, False if the key is taken
+    """
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=Config.IDEMPOTENCY_LEASE_TIMEOUT)
+
+    statement = sqlite_insert(IdempotencyKey).values(
+        scope=scope, key=key, request_hash=request_hash, expires_at=expires_at,
+    )
+    claimed = db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+            set_={'request_hash': request_hash, 'status_code': None, 'response_body': None,
+                  'mimetype': None, 'expires_at': expires_at},
+            where=IdempotencyKey.expires_at <= now,
+        )
+    ).rowcount
+    db.session.commit()
+
+    if claimed:
+        with _running_lock:
+            _running[(scope, key)] = threading.Event()
+    return bool(claimed)
+
+
+def complete(scope: str, key: str, status_code: int, response_body: str, mimetype: str, now: Optional[datetime] = None):
+    """Store the response of the request that claimed a key, for its retries (IDEMPOTENCY_KEY_TTL).
+
+    Args:
+        scope (str): the method and path of the request.
+        key (str): the client's Idempotency-Key.
+        status_code (int): status of the response.
+        response_body (str): body of the response.
+        mimetype (str): mimetype of the response.
+        now (Optional[datetime]): the current time (UTC). Defaults to now.
+    """
+    expires_at = (now or datetime.utcnow()) + timedelta(seconds=Config.IDEMPOTENCY_KEY_TTL)
+    db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+        .values(status_code=status_code, response_body=response_body, mimetype=mimetype, expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    _finish(scope, key)
+
+
+def release(scope: str, key: str):
+    """Give up a claimed key without storing a response (the request failed in a way that a
+    retry should run again, e.g. a server error).
+
+    Args:
+        scope (str): the method and path of the request.
+        key (str): the client's Idempotency-Key.
+    """
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key))
+    db.session.commit()
+    _finish(scope, key)
+
+
+def _finish(scope: str, key: str):
+    """Wake up the duplicates waiting in this process for the request with a key."""
+    with _running_lock:
+        event = _running.pop((scope, key), None)
+    if event:
+        event.set()
+
+
+def wait_for_response(scope: str, key: str, timeout: Optional[float] = None):
+    """Wait for the request that claimed a key to finish and get its stored response (one
+    primary key lookup, repeated only while that request is still running).
+
+    Args:
+        scope (str): the method and path of the request.
+        key (str): the client's Idempotency-Key.
+        timeout (Optional[float]): the most seconds to wait. Defaults to IDEMPOTENCY_WAIT_TIMEOUT.
+
+    Returns:
+        Optional[Row]: the request_hash, status_code, response_body and mimetype of the key
+        (a None status_code if the first request is still running after the timeout), or None
+        if the key was released
+    """
+    deadline = time.monotonic() + (Config.IDEMPOTENCY_WAIT_TIMEOUT if timeout is None else timeout)
+    statement = (
+        select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response_body, IdempotencyKey.mimetype)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+    )
+
+    while True:
+        with _running_lock:
+            event = _running.get((scope, key))
+        if event:
+            event.wait(max(deadline - time.monotonic(), 0))
+
+        record = db.session.execute(statement).first()
+        # each lookup starts a new read, so the other request's commit is seen
+        db.session.rollback()
+        if record is None or record.status_code is not None or time.monotonic() >= deadline:
+            return record
+        if not event:
+            time.sleep(_POLL_INTERVAL)
+
+
+def purge_expired_keys(now: Optional[datetime] = None) -> int:
+    """Delete the idempotency keys that have expired, in bulk.
+
+    Args:
+        now (Optional[datetime]): the current time (UTC). Defaults to now.
+
+    Returns:
+        int: the number of keys deleted
+    """
+    purged = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at <= (now or datetime.utcnow()))
+    ).rowcount
+    db.session.commit()
+    return purged
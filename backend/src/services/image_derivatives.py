@@ -0,0 +1,94 @@
+import io
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from config.config import Config
+from services import image_store
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow no derivatives are made and the original image is always served
+    Image = None
+
+
+# derivative name -> bounding box (width, height) the image is scaled down to fit in
+DERIVATIVE_SIZES = {
+    'thumb': (320, 320),
+    'medium': (1024, 1024),
+}
+
+# resizing runs off the request thread
+_executor = ThreadPoolExecutor(max_workers=Config.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix='image-derivatives')
+
+
+def derivatives_enabled() -> bool:
+    """Check if image derivatives can be generated (Pillow is installed).
+
+    Returns:
+        bool: True if derivatives can be generated
+    """
+    return Image is not None
+
+
+def _render(source_path: str, box: tuple[int, int]) -> bytes:
+    """Scale an image down to fit in a bounding box.
+
+    Images with transparency are saved as PNG, everything else as JPEG.
+
+    Args:
+        source_path (str): path of the original image
+        box (tuple[int, int]): the (width, height) to fit the image in
+
+    Returns:
+        bytes: the encoded derivative image
+    """
+    with Image.open(source_path) as image:
+        image.thumbnail(box)
+
+        output = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(output, format='PNG', optimize=True)
+        else:
+            image.convert('RGB').save(output, format='JPEG', quality=85, optimize=True)
+        return output.getvalue()
+
+
+def _generate(source_path: str, targets: dict[str, str]):
+    """Generate derivatives of an image (runs on the worker pool).
+
+    Args:
+        source_path (str): path of the original image
+        targets (dict[str, str]): derivative name -> path to write it to
+    """
+    for size, target_path in targets.items():
+        try:
+            image_store.write_atomic(target_path, _render(source_path, DERIVATIVE_SIZES[size]))
+        except Exception as e:
+            # the original keeps being served for this size
+            print(f"Error generating {size} derivative of {source_path}: {e}")
+
+
+def schedule_derivatives(image_hash: Optional[str]) -> Optional[Future]:
+    """Queue generation of the missing derivatives of a stored image on the worker pool.
+
+    Must be called inside an app context (the paths are resolved with the app's image
+    store before the work is handed to the pool).
+
+    Args:
+        image_hash (Optional[str]): the content hash of the original image
+
+    Returns:
+        Optional[Future]: the future of the queued work, or None if there is nothing to do
+    """
+    if not image_hash or not derivatives_enabled() or not image_store.image_exists(image_hash):
+        return None
+
+    targets = {
+        size: image_store.derivative_path(image_hash, size)
+        for size in DERIVATIVE_SIZES
+        if not os.path.isfile(image_store.derivative_path(image_hash, size))
+    }
+    if not targets:
+        return None
+
+    return _executor.submit(_generate, image_store.image_path(image_hash), targets)
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+from flask import current_app
+from config.config import Config
+
+
+# images are stored once, named by the sha256 of their content
+_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# leading bytes of the image formats that the frontend can upload
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+def _store_root() -> str:
+    """Get the directory of the image store for the current app.
+
+    Returns:
+        str: absolute path of the image store directory
+    """
+    return os.path.abspath(current_app.config.get('IMAGE_STORE_PATH', Config.IMAGE_STORE_PATH))
+
+
+def is_valid_hash(image_hash: str) -> bool:
+    """Check if a string is a well-formed image hash.
+
+    Args:
+        image_hash (str): the hash to check
+
+    Returns:
+        bool: True if the hash is 64 lowercase hex characters
+    """
+    return bool(image_hash) and _HASH_PATTERN.match(image_hash) is not None
+
+
+def image_path(image_hash: str) -> str:
+    """Get the path of an image in the store.
+
+    Images are sharded into subdirectories by the first two characters of the hash
+    so no single directory grows too large.
+
+    Args:
+        image_hash (str): the content hash of the image
+
+    Raises:
+        ValueError: if the hash is malformed (prevents path traversal)
+
+    Returns:
+        str: absolute path of the image file (it may not exist)
+    """
+    if not is_valid_hash(image_hash):
+        raise ValueError("Invalid image hash")
+    return os.path.join(_store_root(), image_hash[:2], image_hash)
+
+
+def derivative_path(image_hash: str, size: str) -> str:
+    """Get the path of a resized rendition (derivative) of an image in the store.
+
+    Args:
+        image_hash (str): the content hash of the original image
+        size (str): the name of the derivative size (e.g. "thumb")
+
+    Raises:
+        ValueError: if the hash is malformed
+
+    Returns:
+        str: absolute path of the derivative file (it may not exist yet)
+    """
+    if not is_valid_hash(image_hash):
+        raise ValueError("Invalid image hash")
+    return os.path.join(_store_root(), 'derivatives', image_hash[:2], f'{image_hash}.{size}')
+
+
+def image_exists(image_hash: str) -> bool:
+    """Check if an image is in the store.
+
+    Args:
+        image_hash (str): the content hash of the image
+
+    Returns:
+        bool: True if the image is stored
+    """
+    return is_valid_hash(image_hash) and os.path.isfile(image_path(image_hash))
+
+
+def write_atomic(path: str, data: bytes):
+    """Write a file by writing a temporary file and renaming it into place, so readers
+    never see a partially written file.
+
+    Args:
+        path (str): the path to write to
+        data (bytes): the file contents
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_image(data: bytes) -> str:
+    """Store image bytes in the store (a no-op if the same image is already stored).
+
+    Args:
+        data (bytes): the image bytes
+
+    Returns:
+        str: the content hash of the image
+    """
+    image_hash = hashlib.sha256(data).hexdigest()
+    path = image_path(image_hash)
+
+    if not os.path.isfile(path):
+        write_atomic(path, data)
+
+    return image_hash
+
+
+def guess_mimetype(path: str) -> Optional[str]:
+    """Guess the mimetype of a stored image from its leading bytes.
+
+    Args:
+        path (str): path of the image file
+
+    Returns:
+        Optional[str]: the mimetype, or None if the format isn't recognized
+    """
+    with open(path, 'rb') as image_file:
+        header = image_file.read(16)
+
+    for signature, mimetype in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mimetype
+
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+
+    return None
+
@@ -1,7 +1,17 @@
 from models.order import Order, db
 from models.cart import Cart
 from models.order_item import OrderItem
-from datetime import datetime
+from models.cart_item import CartItem
+from models.product import Product
+from models.reservation import Reservation
+from models.user_order_stats import UserOrderStats
+from services import product_service, reservation_service
+from services.cart_store import get_cart_store
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
+from datetime import date, datetime
+from services.pagination import DEFAULT_PAGE_SIZE, encode_cursor, decode_cursor, keyset_filter
 
 
 def get_all_orders_by_userid(user_id: int):
@@ -24,6 +34,73 @@ def get_all_orders_by_userid(user_id: int):
         raise
 
 
+def get_orders_page(user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None):
+    """Retrieves a page of a user's orders (newest first) with their items.
+
+    Pages are keyset paginated on (order_date, id), which the (user_id, order_date, id)
+    index answers with a range scan, and the items of the page's orders are loaded with one
+    extra query, so a page costs two queries however long the user's history is.
+
+    Args:
+        user_id (int): id of the user.
+        limit (int, optional): maximum number of orders in the page. Defaults to DEFAULT_PAGE_SIZE.
+        cursor (str, optional): the `next_cursor` of the previous page (None for the first page).
+
+    Raises:
+        ValueError: if the cursor is malformed.
+
+    Returns:
+        tuple[list[Order], str]: the orders in the page and the cursor of the next page
+        (None if this is the last page).
+    """
+    columns = (Order.order_date, Order.id)
+
+    query = (
+        select(Order)
+        .where(Order.user_id == user_id)
+        .options(selectinload(Order.order_items))
+        .order_by(Order.order_date.desc(), Order.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(keyset_filter(columns, decode_cursor(cursor, date, int)))
+
+    # fetch one extra order to know whether there is a next page
+    orders = db.session.execute(query).scalars().all()
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].order_date, orders[-1].id)
+
+    return orders, next_cursor
+
+
+def iter_orders_by_userid(user_id: int, batch_size: int = 200):
+    """Serializes all orders of a user one at a time (for streaming responses).
+
+    Orders are fetched in batches of `batch_size` and the items of each batch are loaded
+    with one extra query, so memory use doesn't grow with the number of orders.
+
+    Args:
+        user_id (int): id of the user.
+        batch_size (int, optional): number of orders fetched from the db at a time. Defaults to 200.
+
+    Yields:
+        dict: the serialized orders (with their items).
+    """
+    orders = db.session.execute(
+        select(Order)
+        .where(Order.user_id == user_id)
+        .options(selectinload(Order.order_items))
+        .order_by(Order.order_date.desc(), Order.id.desc())
+        .execution_options(yield_per=batch_size)
+    ).scalars()
+
+    for order in orders:
+        yield order.to_dict()
+
+
 def get_order_by_id(id: int):
     """Retrieves a single order by its id.
 
@@ -39,6 +116,17 @@ def get_order_by_id(id: int):
 def create_order(user_id: int):
     """Creates a new order for the user by transferring items from their cart to the order.
 
+    Checkout is one transaction with a fixed number of statements however many products are
+    in the cart: the stock of every product is taken with one conditional UPDATE (only
+    products with enough stock are decremented, so concurrent checkouts can't oversell), the
+    order items are inserted with one bulk INSERT, and the cart is cleared with set-based
+    DELETEs.  If any product is short nothing is changed.
+
+    The cart's stock holds are turned into the sale by the same UPDATE: held units are always
+    available to the cart, so only the part of a quantity that isn't held is checked against
+    the unreserved stock, and holds on products that were taken out of the cart are released.
+    The user's order stats are incremented in the same transaction.
+
     Args:
         user_id (int): id of the user for whom the order is created.
 
@@ -49,72 +137,106 @@ def create_order(user_id: int):
         ValueError: if the cart is not found, has no items, or if there is insufficient stock.
         Exception: for any other issues during the process.
     """
+    store = get_cart_store()
+    pinned_cart_id = None
+    ordered = False
     try:
         print("Fetching cart for user_id:", user_id)
-        
+
+        # a cart held by a write-behind cart store is written to the db before it's ordered,
+        # and pinned so it can't change in memory until the checkout ends
+        pinned_cart_id = store.pin_user_cart(user_id)
+
         # get the cart for the given user
-        cart = Cart.query.filter_by(user_id=user_id).first()
+        cart_id = db.session.execute(
+            select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.id).limit(1)
+        ).scalar()
         
         # if the cart isn't found
-        if not cart:
+        if cart_id is None:
             raise ValueError("Cart not found")
 
-        print("Cart found. Subtotal:", cart.subtotal)
+        # the quantity of each product in the cart and the cart's hold on it (for each product row)
+        cart_quantity = (
+            select(func.sum(CartItem.quantity))
+            .where(CartItem.cart_id == cart_id, CartItem.product_id == Product.id)
+            .scalar_subquery()
+        )
+        held = reservation_service.held_quantity(cart_id)
+
+        # take the stock of every product in the cart that has enough of it (unreserved or held by
+        # this cart) and release the cart's holds; this is the first write of the transaction, so
+        # the rest of the checkout sees no concurrent changes
+        decremented_ids = set(db.session.execute(
+            update(Product)
+            .where(Product.id.in_(select(CartItem.product_id).where(CartItem.cart_id == cart_id)))
+            .where(Product.quantity - Product.reserved_quantity + held >= cart_quantity)
+            .values(
+                quantity=Product.quantity - cart_quantity,
+                reserved_quantity=Product.reserved_quantity - held,
+                version=Product.version + 1,
+                updated_at=datetime.utcnow(),
+            )
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+
+        # the lines of the order: each product of the cart with its name and price (and the stock left)
+        lines = db.session.execute(
+            select(Product.id, Product.name, Product.price, Product.quantity.label('stock'),
+                   (Product.quantity - Product.reserved_quantity + held).label('available'),
+                   func.sum(CartItem.quantity).label('quantity'))
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.cart_id == cart_id)
+            .group_by(Product.id)
+            .order_by(func.min(CartItem.id))
+        ).all()
 
-        # ensure cart items are accessible
-        if not cart.items:
+        # ensure the cart has items
+        if not lines:
             raise ValueError("Cart has no items")
-        
-    
+
+        # if the quantity of a product is less than the quantity in the cart (it wasn't decremented)
+        short = [line for line in lines if line.id not in decremented_ids]
+        if short:
+            raise ValueError("; ".join(
+                f"Insufficient stock for product {line.name}. Available: {line.available}, Requested: {line.quantity}"
+                for line in short
+            ))
+
         # create a new order with the given information
         new_order = Order(
             user_id=user_id,
-            total=cart.subtotal,
+            total=round(sum(line.price * line.quantity for line in lines), 2),
             order_date=datetime.utcnow()
         )
-        
-        # add and commit changes to the db
         db.session.add(new_order)
-        db.session.commit()
+        db.session.flush()
 
+        # create the order items (one bulk insert)
+        print(f"Adding {len(lines)} items to order {new_order.id}")
+        db.session.execute(insert(OrderItem), [
+            {'order_id': new_order.id, 'product_name': line.name, 'quantity': line.quantity, 'price': line.price}
+            for line in lines
+        ])
+        for line in lines:
+            if line.stock == 0:
+                print(f"Product {line.name} is now out of stock.")
 
-        # transfer items from cart to order
-        for cart_item in cart.items:
-            # get product from cart_item using the relationship
-            product = cart_item.product
-            
-            # if the product isn't found
-            if not product:
-                raise ValueError(f"Product with ID {cart_item.product_id} not found.")
-
-            # if the product quantity is less than the cart_item quantity
-            if product.quantity < cart_item.quantity:
-                raise ValueError(
-                    f"Insufficient stock for product {product.name}. "
-                    f"Available: {product.quantity}, Requested: {cart_item.quantity}"
-                )
-
-            # create an order item and add to db
-            print(f"Adding item to order: {product.name}, Quantity: {cart_item.quantity}, Price: {product.price}")
-            order_item = OrderItem(
-                order_id=new_order.id,
-                product_name=product.name,
-                quantity=cart_item.quantity,
-                price=product.price
-            )
-            db.session.add(order_item)
-
-            # update product quantity
-            product.quantity -= cart_item.quantity
-            if product.quantity == 0:
-                print(f"Product {product.name} is now out of stock.")
+        # count the order in the user's order stats
+        _add_to_order_stats(user_id, new_order.total)
 
-            # delete the cart item from the db
-            db.session.delete(cart_item)
-
-        # delete the cart from the db and commit the changes
-        db.session.delete(cart)
+        # release the holds on products that were taken out of the cart, then delete the cart, its
+        # items and its (sold) holds from the db and commit the changes
+        reservation_service.release_holds_not_in_cart(cart_id)
+        db.session.execute(delete(Reservation).where(Reservation.cart_id == cart_id))
+        db.session.execute(delete(CartItem).where(CartItem.cart_id == cart_id).execution_options(synchronize_session=False))
+        db.session.execute(delete(Cart).where(Cart.id == cart_id).execution_options(synchronize_session=False))
         db.session.commit()
+        ordered = True
+
+        # the stock of the ordered products changed
+        product_service.invalidate_products([line.id for line in lines], ['quantity'])
         
         # return the new order
         print("Order created successfully")
@@ -123,3 +245,80 @@ def create_order(user_id: int):
         print("Error in create_order:", str(e))
         db.session.rollback() # rollback the db changes
         raise  # reraise the exception for better error handling
+    finally:
+        store.unpin(pinned_cart_id, ordered)
+
+
+def _add_to_order_stats(user_id: int, total: float):
+    """Count a new order in the order stats of its user (in the caller's transaction).
+
+    Args:
+        user_id (int): id of the user who placed the order.
+        total (float): the total of the order.
+    """
+    stats_table = UserOrderStats.__table__
+
+    # one upsert: the first order of a user creates their row, later ones increment it
+    db.session.execute(
+        sqlite_insert(stats_table)
+        .values(user_id=user_id, order_count=1, lifetime_spend=total)
+        .on_conflict_do_update(
+            index_elements=[stats_table.c.user_id],
+            set_={
+                'order_count': stats_table.c.order_count + 1,
+                'lifetime_spend': stats_table.c.lifetime_spend + total,
+            },
+        )
+    )
+
+
+def get_order_stats(user_id: int):
+    """Get the number of orders a user has placed and their lifetime spend (one primary key lookup).
+
+    Args:
+        user_id (int): id of the user.
+
+    Returns:
+        dict: the user_id, order_count and lifetime_spend of the user (zero if they have no orders).
+    """
+    stats = db.session.get(UserOrderStats, user_id)
+    return (stats or UserOrderStats(user_id=user_id, order_count=0, lifetime_spend=0.0)).to_dict()
+
+
+def rebuild_order_stats():
+    """Rebuild the order stats of every user from their orders and order items.
+
+    Used to backfill the stats of existing orders, or to repair them after orders were
+    changed outside of this service.  The spend of each order is summed from its items
+    (price x quantity) rather than taken from `order.total`, which older orders copied from
+    the cart's subtotal.  The stats are replaced in one transaction with one DELETE and one
+    INSERT ... SELECT that groups the items by order and the orders by user.
+
+    Returns:
+        int: number of users with orders.
+    """
+    # the total of each order from its items (rounded like the totals of new orders)
+    order_totals = (
+        select(
+            Order.user_id,
+            func.round(func.coalesce(func.sum(OrderItem.price * OrderItem.quantity), 0.0), 2).label('total'),
+        )
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .group_by(Order.id)
+        .subquery()
+    )
+
+    try:
+        db.session.execute(delete(UserOrderStats))
+        rebuilt = db.session.execute(
+            insert(UserOrderStats).from_select(
+                ['user_id', 'order_count', 'lifetime_spend'],
+                select(order_totals.c.user_id, func.count(), func.sum(order_totals.c.total))
+                .group_by(order_totals.c.user_id),
+            )
+        ).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return rebuilt
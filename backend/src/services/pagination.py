@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, Optional, Sequence
+from sqlalchemy import and_, or_
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def parse_limit(raw_limit: Optional[str], default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    """Parse the `limit` query parameter of a paginated endpoint.
+
+    Args:
+        raw_limit (Optional[str]): the raw value from the query string (None if not given).
+        default (int, optional): page size to use when no limit is given. Defaults to DEFAULT_PAGE_SIZE.
+        maximum (int, optional): largest page size a client may ask for. Defaults to MAX_PAGE_SIZE.
+
+    Raises:
+        ValueError: if the limit is not a positive integer.
+
+    Returns:
+        int: the page size, capped at `maximum`.
+    """
+    if raw_limit is None or raw_limit == '':
+        return default
+
+    try:
+        limit = int(raw_limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    return min(limit, maximum)
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode the sort key of the last row of a page into an opaque cursor token.
+
+    Args:
+        *values: the sort key values (dates and datetimes are stored in ISO 8601 format).
+
+    Returns:
+        str: url-safe cursor token.
+    """
+    serializable = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    raw = json.dumps(serializable, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, *types: type) -> list:
+    """Decode a cursor token created by `encode_cursor`.
+
+    Args:
+        cursor (str): the cursor token from the client.
+        *types: the expected type of each sort key value (int, float, str, date or datetime).
+
+    Raises:
+        ValueError: if the cursor is malformed or doesn't match the expected types.
+
+    Returns:
+        list: the decoded sort key values.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+
+    decoded = []
+    for value, expected_type in zip(values, types):
+        try:
+            if expected_type in (date, datetime):
+                decoded.append(expected_type.fromisoformat(value))
+            else:
+                decoded.append(expected_type(value))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+    return decoded
+
+
+def keyset_filter(columns: Sequence, values: Sequence, descending: bool = True):
+    """Build the WHERE clause that selects the rows after a cursor position.
+
+    For columns (a, b) and descending order this is `a < :a OR (a = :a AND b < :b)`,
+    which an index on (a, b) can answer with a range scan no matter how deep the page is.
+
+    Args:
+        columns (Sequence): the sort key columns, in ORDER BY order.
+        values (Sequence): the sort key values of the last row of the previous page.
+        descending (bool, optional): whether the pages are sorted in descending order. Defaults to True.
+
+    Returns:
+        ColumnElement: the filter expression.
+    """
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        past = column < value if descending else column > value
+        clauses.append(and_(*equal_prefix, past))
+    return or_(*clauses)
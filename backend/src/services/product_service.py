@@ -1,30 +1,861 @@
-from models.product import Product, db
+from models.product import Product, PRODUCT_FTS_DDL, db
 from flask import jsonify
-from typing import Optional
-from datetime import datetime
+from werkzeug.datastructures import MultiDict
+from typing import Iterable, Iterator, NamedTuple, Optional
+import base64
+import binascii
+import csv
+import hashlib
+import html
+import itertools
+import json
+import re
+from datetime import date, datetime
+from sqlalchemy import String, cast, column, func, insert, literal, literal_column, select, table, text, union_all, update
+from sqlalchemy.orm import load_only, undefer
+from services.pagination import DEFAULT_PAGE_SIZE, encode_cursor, decode_cursor, keyset_filter
+from services import image_store
+from services.image_derivatives import schedule_derivatives
+from services.cache import LRUTTLCache
+from services.cart_item_service import CartItemService
+from config.config import Config
 
 
-def get_product_by_id(id: int) -> Optional[Product]:
+# serialized products, keyed by (product id, fields)
+_product_cache = LRUTTLCache(Config.PRODUCT_CACHE_SIZE, Config.PRODUCT_CACHE_TTL)
+# serialized catalog pages, keyed by (limit, cursor, fields, filters)
+_listing_cache = LRUTTLCache(Config.LISTING_CACHE_SIZE, Config.PRODUCT_CACHE_TTL)
+# the featured products of the home page (a single entry)
+_featured_cache = LRUTTLCache(1, Config.FEATURED_SNAPSHOT_TTL)
+
+
+# fields of a product listing when the client doesn't ask for specific ones
+# (the description and full size images are only needed on the product detail page)
+LISTING_FIELDS = [
+    field for field in Product.SERIALIZED_COLUMNS
+    if field not in ('description', 'image_url', 'medium_url')
+]
+
+
+def parse_fields(raw_fields: Optional[str], default: Optional[list[str]] = None) -> Optional[list[str]]:
+    """
+    Parse the `fields` query parameter (a comma separated list of product fields).
+
+    Args:
+        raw_fields (Optional[str]): The raw value from the query string (None if not given).
+        default (Optional[list[str]]): The fields to use when none are given.
+
+    Raises:
+        ValueError: If an unknown field is requested.
+
+    Returns:
+        Optional[list[str]]: The requested fields in the order given (duplicates removed).
+    """
+    if not raw_fields:
+        return default
+
+    fields = list(dict.fromkeys(field.strip() for field in raw_fields.split(',') if field.strip()))
+
+    unknown_fields = [field for field in fields if field not in Product.SERIALIZED_COLUMNS]
+    if unknown_fields:
+        raise ValueError(f"Unknown product fields: {', '.join(unknown_fields)}")
+
+    return fields or default
+
+
+# attributes the catalog can be filtered on, and that facet counts are returned for
+FACET_FIELDS = ('sport', 'brand', 'gender', 'size', 'condition', 'youth_size', 'featured')
+_BOOLEAN_FACETS = ('youth_size', 'featured')
+# numeric filters -> the column and comparison they apply
+RANGE_FILTERS = {
+    'price_min': (Product.price, '>='),
+    'price_max': (Product.price, '<='),
+    'rating_min': (Product.avg_rating, '>='),
+}
+
+# sort orders of the catalog -> the columns of the sort key (all descending) and their types in the cursor
+SORT_ORDERS = {
+    'newest': ((Product.date_listed, date), (Product.id, int)),
+    'top_rated': ((Product.avg_rating, float), (Product.id, int)),
+}
+
+
+def _parse_bool(name: str, raw_value: str) -> bool:
+    """
+    Parse a boolean query parameter.
+
+    Args:
+        name (str): Name of the parameter (for the error message).
+        raw_value (str): The raw value ("true"/"false" or "1"/"0").
+
+    Raises:
+        ValueError: If the value isn't a boolean.
+
+    Returns:
+        bool: The parsed value.
+    """
+    value = raw_value.strip().lower()
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+def parse_filters(args) -> dict:
+    """
+    Parse the catalog filters from the query string.
+
+    Attribute filters may be repeated to match any of several values
+    (e.g. `sport=Soccer&sport=Hockey`).
+
+    Args:
+        args (MultiDict): The request query parameters.
+
+    Raises:
+        ValueError: If a filter value is invalid.
+
+    Returns:
+        dict: Filter name -> list of accepted values, plus `price_min`/`price_max`/`rating_min` if given.
+    """
+    filters = {}
+
+    for field in FACET_FIELDS:
+        values = [value for value in args.getlist(field) if value.strip()]
+        if not values:
+            continue
+        if field in _BOOLEAN_FACETS:
+            values = [_parse_bool(field, value) for value in values]
+        filters[field] = list(dict.fromkeys(values))
+
+    for bound in RANGE_FILTERS:
+        raw_value = args.get(bound)
+        if raw_value:
+            try:
+                filters[bound] = float(raw_value)
+            except ValueError:
+                raise ValueError(f"{bound} must be a number")
+
+    return filters
+
+
+def parse_sort(raw_sort: Optional[str]) -> str:
+    """
+    Parse the `sort` query parameter of the catalog.
+
+    Args:
+        raw_sort (Optional[str]): The raw value from the query string (None if not given).
+
+    Raises:
+        ValueError: If the sort order is unknown.
+
+    Returns:
+        str: The sort order (a key of SORT_ORDERS, "newest" by default).
+    """
+    if not raw_sort:
+        return 'newest'
+    if raw_sort not in SORT_ORDERS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_ORDERS)}")
+    return raw_sort
+
+
+def _filter_clauses(filters: dict, exclude: Optional[str] = None) -> list:
+    """
+    Build the WHERE clauses of the catalog filters.
+
+    Args:
+        filters (dict): Filters from `parse_filters`.
+        exclude (Optional[str]): An attribute whose filter is left out (used for its own facet counts).
+
+    Returns:
+        list: The filter expressions.
+    """
+    clauses = []
+
+    for field in FACET_FIELDS:
+        if field in filters and field != exclude:
+            clauses.append(getattr(Product, field).in_(filters[field]))
+
+    for bound, (bounded_column, comparison) in RANGE_FILTERS.items():
+        if bound in filters:
+            clauses.append(bounded_column >= filters[bound] if comparison == '>=' else bounded_column <= filters[bound])
+
+    return clauses
+
+
+def get_facet_counts(filters: Optional[dict] = None) -> dict[str, list[dict]]:
+    """
+    Count the products per value of every facet attribute, in one grouped query.
+
+    Each attribute is counted with all the other filters applied but not its own, so the
+    counts show how many products each alternative value would give.
+
+    Args:
+        filters (Optional[dict]): Filters from `parse_filters`.
+
+    Returns:
+        dict[str, list[dict]]: Attribute -> list of {'value', 'count'} (most common value first).
+    """
+    filters = filters or {}
+
+    counts_per_facet = [
+        select(
+            literal(field).label('facet'),
+            cast(getattr(Product, field), String).label('value'),
+            func.count().label('count'),
+        )
+        .where(*_filter_clauses(filters, exclude=field))
+        .group_by(getattr(Product, field))
+        for field in FACET_FIELDS
+    ]
+    rows = db.session.execute(union_all(*counts_per_facet)).all()
+
+    facets = {field: [] for field in FACET_FIELDS}
+    for facet, value, count in rows:
+        if facet in _BOOLEAN_FACETS:
+            value = value in ('1', 'true')
+        facets[facet].append({'value': value, 'count': count})
+
+    for values in facets.values():
+        values.sort(key=lambda facet_value: facet_value['count'], reverse=True)
+
+    return facets
+
+
+def _load_only(fields: list[str], *extra_columns):
+    """
+    Build the loader option that only selects the columns needed to serialize `fields`.
+
+    Args:
+        fields (list[str]): The product fields that will be serialized.
+        *extra_columns: Other columns the query needs (e.g. its sort key).
+
+    Returns:
+        Load: The `load_only` option for the query.
+    """
+    columns = {getattr(Product, Product.SERIALIZED_COLUMNS[field]) for field in fields}
+    columns.update(extra_columns)
+    columns.add(Product.id)
+    return load_only(*columns)
+
+
+def get_product_by_id(id: int, fields: Optional[list[str]] = None) -> Optional[Product]:
     """
     Get a product by its ID.
 
     Args:
         id (int): The ID of the product.
+        fields (Optional[list[str]]): Only load the columns of these fields (all columns if None).
 
     Returns:
         Optional[Product]: The product if it exists, otherwise None.
     """
-    return Product.query.filter_by(id=id).first()
+    query = Product.query.filter_by(id=id)
+    if fields is not None:
+        query = query.options(_load_only(fields))
+    return query.first()
 
 
-def get_all_products() -> list[Product]:
+def get_all_products(fields: Optional[list[str]] = None) -> list[Product]:
     """
     Retrieve all products from the database.
 
+    Args:
+        fields (Optional[list[str]]): Only load the columns of these fields (defaults to LISTING_FIELDS).
+
     Returns:
         list[Product]: A list of all Product objects.
     """
-    return Product.query.all()
+    return Product.query.options(_load_only(fields or LISTING_FIELDS)).all()
+
+
+def get_products_page(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[list[str]] = None,
+    filters: Optional[dict] = None,
+    sort: str = 'newest'
+) -> tuple[list[Product], Optional[str]]:
+    """
+    Retrieve one page of products, newest listings (or best rated products) first.
+
+    Pages are ordered by (date_listed, id) (or (avg_rating, id)) and continue from the position
+    encoded in `cursor`, so fetching a page costs the same no matter how deep it is.
+
+    Args:
+        limit (int): Maximum number of products in the page.
+        cursor (Optional[str]): The `next_cursor` of the previous page (None for the first page).
+        fields (Optional[list[str]]): Only load the columns of these fields (defaults to LISTING_FIELDS).
+        filters (Optional[dict]): Only include products matching these filters (from `parse_filters`).
+        sort (str): The sort order (a key of SORT_ORDERS).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    Returns:
+        tuple[list[Product], Optional[str]]: The products in the page and the cursor
+        of the next page (None if this is the last page).
+    """
+    columns = [column for column, _ in SORT_ORDERS[sort]]
+    query = (
+        Product.query
+        .options(_load_only(fields or LISTING_FIELDS, *columns))
+        .filter(*_filter_clauses(filters or {}))
+        .order_by(*(column.desc() for column in columns))
+    )
+
+    if cursor:
+        values = decode_cursor(cursor, *(value_type for _, value_type in SORT_ORDERS[sort]))
+        query = query.filter(keyset_filter(columns, values))
+
+    # fetch one extra row to know whether there is a next page
+    products = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor(*(getattr(last, column.key) for column in columns))
+
+    return products, next_cursor
+
+
+def iter_products(
+    fields: Optional[list[str]] = None,
+    filters: Optional[dict] = None,
+    batch_size: int = 500,
+    sort: str = 'newest'
+) -> Iterator[dict]:
+    """
+    Serialize every product (matching the filters) one at a time, in the catalog's sort order.
+
+    Rows are fetched from the database in batches of `batch_size`, so memory use doesn't
+    grow with the size of the catalog.
+
+    Args:
+        fields (Optional[list[str]]): The fields to serialize (defaults to LISTING_FIELDS).
+        filters (Optional[dict]): Only include products matching these filters (from `parse_filters`).
+        batch_size (int): Number of rows fetched from the database at a time.
+        sort (str): The sort order (a key of SORT_ORDERS).
+
+    Yields:
+        dict: The serialized products.
+    """
+    fields = fields or LISTING_FIELDS
+
+    products = db.session.execute(
+        select(Product)
+        .options(_load_only(fields))
+        .where(*_filter_clauses(filters or {}))
+        .order_by(*(column.desc() for column, _ in SORT_ORDERS[sort]))
+        .execution_options(yield_per=batch_size)
+    ).scalars()
+
+    for product in products:
+        yield product.to_dict(fields)
+
+
+def get_product_validators(product_id: int) -> Optional[tuple[int, datetime]]:
+    """
+    Get the HTTP cache validators of a product with one primary key lookup of two columns.
+
+    Args:
+        product_id (int): The ID of the product.
+
+    Returns:
+        Optional[tuple[int, datetime]]: The (version, updated_at) of the product, or None if it doesn't exist.
+    """
+    row = db.session.execute(
+        select(Product.version, Product.updated_at).where(Product.id == product_id)
+    ).first()
+    return tuple(row) if row else None
+
+
+def get_listing_validators(filters: Optional[dict] = None) -> tuple[Optional[datetime], int]:
+    """
+    Get the HTTP cache validators of the catalog (or of the products matching some filters).
+
+    Every write of a product moves `max(updated_at)` forward and a deletion changes the count,
+    so together they change whenever any page of the listing could change.
+
+    Args:
+        filters (Optional[dict]): Filters from `parse_filters`.
+
+    Returns:
+        tuple[Optional[datetime], int]: The latest `updated_at` (None if there are no products) and the product count.
+    """
+    latest, count = db.session.execute(
+        select(func.max(Product.updated_at), func.count(Product.id)).where(*_filter_clauses(filters or {}))
+    ).one()
+    return latest, count
+
+
+def get_product_dict(product_id: int, fields: Optional[list[str]] = None) -> Optional[dict]:
+    """
+    Get a serialized product through the product cache.
+
+    Args:
+        product_id (int): The ID of the product.
+        fields (Optional[list[str]]): The fields to serialize (all fields if None).
+
+    Returns:
+        Optional[dict]: The serialized product, or None if it doesn't exist.
+    """
+    def load():
+        product = get_product_by_id(product_id, fields)
+        return product.to_dict(fields) if product else None
+
+    return _product_cache.get_or_load((product_id, tuple(fields) if fields else None), load)
+
+
+def get_products_listing(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[list[str]] = None,
+    filters: Optional[dict] = None,
+    sort: str = 'newest'
+) -> dict:
+    """
+    Get a serialized page of the catalog through the listing cache.
+
+    Args:
+        limit (int): Maximum number of products in the page.
+        cursor (Optional[str]): The `next_cursor` of the previous page (None for the first page).
+        fields (Optional[list[str]]): The fields to serialize (defaults to LISTING_FIELDS).
+        filters (Optional[dict]): Only include products matching these filters (from `parse_filters`).
+        sort (str): The sort order (a key of SORT_ORDERS).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    Returns:
+        dict: The serialized `products`, the `next_cursor` and, on the first page, the `facets`
+        (facet counts don't change from page to page so they're only sent with the first one).
+    """
+    fields = fields or LISTING_FIELDS
+    filters = filters or {}
+
+    def load():
+        products, next_cursor = get_products_page(limit, cursor, fields, filters, sort)
+        listing = {
+            'products': [product.to_dict(fields) for product in products],
+            'next_cursor': next_cursor,
+        }
+        if not cursor:
+            listing['facets'] = get_facet_counts(filters)
+        return listing
+
+    key = (limit, cursor, tuple(fields), sort, tuple(sorted((name, str(value)) for name, value in filters.items())))
+    return _listing_cache.get_or_load(key, load)
+
+
+class FeaturedSnapshot(NamedTuple):
+    """A prebuilt response of the featured products endpoint."""
+    version: int  # increases every time the snapshot is rebuilt
+    etag: str  # hash of the body, so it stays the same across rebuilds and restarts if nothing changed
+    body: bytes  # the serialized JSON response
+    product_ids: frozenset  # IDs of the products in the snapshot
+
+
+_featured_versions = itertools.count(1)
+# fields whose change can add a product to, or remove it from, the featured snapshot
+_FEATURED_MEMBERSHIP_FIELDS = {'featured', 'quantity'}
+
+
+def get_featured_snapshot() -> FeaturedSnapshot:
+    """
+    Get the snapshot of the featured products that are in stock (newest first).
+
+    The snapshot is built with one query on the partial featured index and then served from
+    memory until a change to the featured products invalidates it.
+
+    Returns:
+        FeaturedSnapshot: The serialized response and its validators.
+    """
+    def load():
+        products = (
+            Product.query
+            .options(_load_only(LISTING_FIELDS, Product.date_listed))
+            # `featured = 1` (not `IS 1`) so SQLite matches it to the partial index
+            .filter(Product.featured == True, Product.quantity > 0)
+            .order_by(Product.date_listed.desc(), Product.id.desc())
+            .limit(Config.FEATURED_PRODUCTS_LIMIT)
+            .all()
+        )
+        body = json.dumps(
+            {'products': [product.to_dict(LISTING_FIELDS) for product in products]},
+            separators=(',', ':'),
+        ).encode('utf-8')
+        return FeaturedSnapshot(
+            version=next(_featured_versions),
+            etag=hashlib.sha1(body).hexdigest(),
+            body=body,
+            product_ids=frozenset(product.id for product in products),
+        )
+
+    return _featured_cache.get_or_load('featured', load)
+
+
+def _invalidate_featured(product_ids: set, fields: Optional[set]):
+    """
+    Drop the featured snapshot if a change to products can make it stale.
+
+    A change of the featured flag or stock of any product can add it to or remove it from the
+    snapshot; any other change only matters to the products already in it.
+
+    Args:
+        product_ids (set): IDs of the changed products.
+        fields (Optional[set]): The changed fields (None if unknown).
+    """
+    snapshot = _featured_cache.peek('featured')
+    if (
+        snapshot is not None
+        and fields is not None
+        and not fields & _FEATURED_MEMBERSHIP_FIELDS
+        and snapshot.product_ids.isdisjoint(product_ids)
+    ):
+        return
+    # invalidating also stops a snapshot that is being built from the old data from being cached
+    _featured_cache.clear()
+
+
+def invalidate_products(product_ids, fields: Optional[Iterable[str]] = None):
+    """
+    Drop cached data of products after they are written (must be called after the commit).
+
+    Each product's own entries are dropped and, since a change to any product can move it
+    in or out of any page, every cached catalog page is dropped too.  The featured snapshot
+    is only dropped if the change can affect it.
+
+    Args:
+        product_ids (Iterable[int]): IDs of the products that were created, updated or deleted.
+        fields (Optional[Iterable[str]]): The fields that changed (None if unknown, e.g. for
+            created or deleted products).
+    """
+    product_ids = set(product_ids)
+    _product_cache.invalidate_where(lambda key: key[0] in product_ids)
+    _listing_cache.clear()
+    _invalidate_featured(product_ids, set(fields) if fields is not None else None)
+
+
+def clear_caches():
+    """
+    Drop everything from the product caches (e.g. after writes that bypass this service).
+    """
+    _product_cache.clear()
+    _listing_cache.clear()
+    _featured_cache.clear()
+
+
+def cache_stats() -> dict:
+    """
+    Get the counters of the product caches (for tuning their sizes and ttl).
+
+    Returns:
+        dict: Cache name -> its hit/miss/eviction counters and size.
+    """
+    return {
+        'product': _product_cache.stats(),
+        'listing': _listing_cache.stats(),
+        'featured': _featured_cache.stats(),
+    }
+
+
+# the fts5 index of products, see models/product.py (`rank` is its configured bm25 score)
+_product_fts = table('product_fts', column('rowid'), column('rank'))
+_fts_match_column = literal_column('product_fts')
+
+# markers put around matched terms by snippet(), swapped for <mark> tags after the text is escaped
+_SNIPPET_START, _SNIPPET_END = '\x02', '\x03'
+
+
+def _fts_query(raw_query: str) -> str:
+    """
+    Turn user input into an FTS5 query that matches products containing every word
+    (as a prefix, so results show up while the user is still typing).
+
+    Each word is quoted so FTS5 syntax in the input (AND, NEAR, column filters...) is
+    matched literally instead of being interpreted.
+
+    Args:
+        raw_query (str): The search text typed by the user.
+
+    Raises:
+        ValueError: If the search text has no words.
+
+    Returns:
+        str: The FTS5 MATCH expression.
+    """
+    words = re.findall(r'\w+', raw_query or '')
+    if not words:
+        raise ValueError("Search query must contain at least one word")
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_products(
+    raw_query: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[list[str]] = None
+) -> tuple[list[dict], Optional[str]]:
+    """
+    Full-text search of product names, descriptions, brands and sports.
+
+    Results are ranked by BM25 (name matches weigh the most) and each one carries a
+    snippet of the matching text with the matched terms wrapped in <mark> tags.
+
+    Args:
+        raw_query (str): The search text typed by the user.
+        limit (int): Maximum number of results in the page.
+        cursor (Optional[str]): The `next_cursor` of the previous page (None for the first page).
+        fields (Optional[list[str]]): The product fields of each result (defaults to LISTING_FIELDS).
+
+    Raises:
+        ValueError: If the search text has no words or the cursor is malformed.
+
+    Returns:
+        tuple[list[dict], Optional[str]]: The serialized results (with a `snippet`) and the
+        cursor of the next page (None if this is the last page).
+    """
+    fields = fields or LISTING_FIELDS
+    offset = decode_cursor(cursor, int)[0] if cursor else 0
+
+    # rank and cut the page inside the fts index (its own ORDER BY rank is the fast path),
+    # then join only the rows of the page to the product table
+    matches = (
+        select(
+            _product_fts.c.rowid.label('product_id'),
+            _product_fts.c.rank.label('rank'),
+            func.snippet(_fts_match_column, -1, _SNIPPET_START, _SNIPPET_END, '…', 12).label('snippet'),
+        )
+        .where(_fts_match_column.op('MATCH')(_fts_query(raw_query)))
+        .order_by(_product_fts.c.rank)
+        .offset(offset)
+        .limit(limit + 1)
+        .subquery()
+    )
+
+    rows = db.session.execute(
+        select(Product, matches.c.snippet)
+        .join(matches, matches.c.product_id == Product.id)
+        .options(_load_only(fields))
+        .order_by(matches.c.rank)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(offset + limit)
+
+    results = []
+    for product, raw_snippet in rows:
+        product_dict = product.to_dict(fields)
+        product_dict['snippet'] = (
+            html.escape(raw_snippet or '')
+            .replace(_SNIPPET_START, '<mark>')
+            .replace(_SNIPPET_END, '</mark>')
+        )
+        results.append(product_dict)
+
+    return results, next_cursor
+
+
+def rebuild_search_index():
+    """
+    Create the product search index if it's missing (e.g. a database created before
+    search existed) and rebuild its contents from the product table.
+    """
+    for statement in PRODUCT_FTS_DDL:
+        db.session.execute(text(statement))
+    db.session.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+# fields a new product must have (the product table doesn't allow them to be empty)
+REQUIRED_PRODUCT_FIELDS = ('seller_id', 'name', 'price', 'quantity', 'condition', 'gender', 'size', 'brand', 'sport')
+
+
+def _to_bool(value) -> bool:
+    """
+    Interpret a JSON or CSV value as a boolean (missing values are False).
+
+    Args:
+        value: The raw value.
+
+    Raises:
+        ValueError: If the value isn't a boolean.
+
+    Returns:
+        bool: The parsed value.
+    """
+    if value is None or value == '':
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    return _parse_bool('flag', str(value))
+
+
+def parse_product_data(data: dict) -> dict:
+    """
+    Validate the data of a new product and convert it to the arguments of `create_product`.
+
+    These are the rules of the create product endpoint, shared with bulk imports so a
+    product is accepted or rejected the same way whichever way it's added.  Values may be
+    strings (as read from CSV) and are converted to the column types.
+
+    Args:
+        data (dict): The raw product data, with the image as a base64 data url.
+
+    Raises:
+        ValueError: If the image is missing or invalid, a required field is missing
+            or a value has the wrong type.
+
+    Returns:
+        dict: Keyword arguments for `create_product` (except `date_listed`).
+    """
+    image_data = data.get('image')
+    if not image_data:
+        raise ValueError("Image data is missing")
+
+    try:
+        # strip the "data:image/png;base64," part
+        image = base64.b64decode(image_data.split(',')[1], validate=True)
+    except (IndexError, binascii.Error):
+        raise ValueError("Invalid image format")
+
+    if not all(data.get(field) not in (None, '') for field in REQUIRED_PRODUCT_FIELDS):
+        raise ValueError("Missing required fields")
+
+    try:
+        product_data = {
+            'seller_id': int(data['seller_id']),
+            'name': str(data['name']),
+            'description': data.get('description') or None,
+            'price': float(data['price']),
+            'gender': str(data['gender']),
+            'size': str(data['size']),
+            'youth_size': _to_bool(data.get('youth_size')),
+            'featured': _to_bool(data.get('featured')),
+            'brand': str(data['brand']),
+            'sport': str(data['sport']),
+            'quantity': int(data['quantity']),
+            'condition': str(data['condition']),
+            'image': image,
+            'year_product_made': str(data['year_product_made']) if data.get('year_product_made') else None,
+        }
+    except (TypeError, ValueError):
+        raise ValueError("Invalid field value")
+
+    # a zero price or quantity counts as missing (like in the product form)
+    if product_data['price'] == 0 or product_data['quantity'] == 0:
+        raise ValueError("Missing required fields")
+    if product_data['price'] < 0 or product_data['quantity'] < 0:
+        raise ValueError("Invalid field value")
+
+    return product_data
+
+
+def read_import_rows(text_stream, file_format: str) -> Iterator[tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Read the rows of a product import file one at a time (the file is never held in memory).
+
+    Args:
+        text_stream (TextIO): The file contents.
+        file_format (str): "ndjson" (one JSON object per line) or "csv" (with a header row).
+
+    Raises:
+        ValueError: If the format isn't supported.
+
+    Yields:
+        tuple[int, Optional[dict], Optional[str]]: The row number, the row data (None if the
+        row can't be parsed) and the parse error (None if it was parsed).
+    """
+    if file_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(text_stream), start=1):
+            yield row_number, row, None
+
+    elif file_format == 'ndjson':
+        for row_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield row_number, None, "Invalid JSON"
+                continue
+            if isinstance(row, dict):
+                yield row_number, row, None
+            else:
+                yield row_number, None, "Row must be a JSON object"
+
+    else:
+        raise ValueError("Import format must be csv or ndjson")
+
+
+# at most this many row errors are listed in an import report (all of them are counted)
+MAX_REPORTED_IMPORT_ERRORS = 1000
+
+
+def import_products(rows: Iterable[tuple[int, Optional[dict], Optional[str]]], batch_size: int = 1000) -> dict:
+    """
+    Bulk import products, inserting valid rows in batches with one multi-row INSERT and
+    one commit per batch.
+
+    Each row is validated with `parse_product_data`; invalid rows are skipped and reported.
+
+    Args:
+        rows (Iterable[tuple[int, Optional[dict], Optional[str]]]): Rows from `read_import_rows`.
+        batch_size (int): Number of products inserted per statement and commit.
+
+    Returns:
+        dict: The number of `imported` products, the `error_count` and the row `errors`
+        (row number and message, the first MAX_REPORTED_IMPORT_ERRORS of them).
+    """
+    report = {'imported': 0, 'error_count': 0, 'errors': []}
+    date_listed = datetime.now()
+    batch = []
+
+    def add_error(row_number, message):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_IMPORT_ERRORS:
+            report['errors'].append({'row': row_number, 'error': message})
+
+    def flush():
+        db.session.execute(insert(Product), batch)
+        db.session.commit()
+        report['imported'] += len(batch)
+
+        for image_hash in {row['image_hash'] for row in batch}:
+            schedule_derivatives(image_hash)
+        batch.clear()
+
+    for row_number, data, error in rows:
+        if error:
+            add_error(row_number, error)
+            continue
+
+        try:
+            product_data = parse_product_data(data)
+        except ValueError as e:
+            add_error(row_number, str(e))
+            continue
+
+        product_data['image_hash'] = image_store.store_image(product_data.pop('image'))
+        product_data['date_listed'] = date_listed
+        batch.append(product_data)
+
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    if report['imported']:
+        clear_caches()
+
+    return report
 
 
 def create_product(seller_id: int, 
@@ -41,8 +872,7 @@ def create_product(seller_id: int,
     condition: str, 
     image: bytes, 
     date_listed: datetime,
-    year_product_made: Optional[str], 
-    avg_rating: float
+    year_product_made: Optional[str]
 ) -> Optional[Product]:
     """
     Create a new product in the database.
@@ -60,14 +890,16 @@ def create_product(seller_id: int,
         sport (str): Associated sport for the product.
         quantity (int): Quantity of the product available.
         condition (str): Condition of the product.
-        image (bytes): Image of the product.
+        image (bytes): Image of the product (saved in the image store).
         date_listed (datetime): Date the product was listed.
         year_product_made (Optional[str]): Year the product was made.
-        avg_rating (float): Average rating of the product.
 
     Returns:
-        Optional[Product]: The newly created product.
+        Optional[Product]: The newly created product (with no ratings, those are only
+        changed by the review service).
     """
+    image_hash = image_store.store_image(image) if image else None
+
     new_product = Product(
         seller_id=seller_id,
         name=name,
@@ -81,13 +913,17 @@ def create_product(seller_id: int,
         sport=sport,
         quantity=quantity,
         condition=condition,
-        image=image,
+        image_hash=image_hash,
         date_listed=date_listed,
-        year_product_made=year_product_made,
-        avg_rating=avg_rating
+        year_product_made=year_product_made
     )
     db.session.add(new_product)
     db.session.commit()
+    invalidate_products([new_product.id])
+
+    # make the thumbnail and medium renditions in the background
+    schedule_derivatives(image_hash)
+
     return new_product
 
 
@@ -105,15 +941,14 @@ def update_product(
     quantity: Optional[int] = None,
     condition: Optional[str] = None,
     image: Optional[bytes] = None,
-    year_product_made: Optional[str] = None,
-    avg_rating: Optional[float] = None
+    year_product_made: Optional[str] = None
 ) -> Optional[Product]:
     """
     Update an existing product in the database.
 
     Args:
         product_id (int): ID of the product to update.
-        (Other fields are optional updates)
+        (Other fields are optional updates; the rating fields are only changed by the review service)
 
     Returns:
         Optional[Product]: The updated product, or None if not found.
@@ -134,16 +969,28 @@ def update_product(
         'sport': sport,
         'quantity': quantity,
         'condition': condition,
-        'image': image,
-        'year_product_made': year_product_made,
-        'avg_rating': avg_rating
+        'image_hash': image_store.store_image(image) if image else None,
+        'year_product_made': year_product_made
     }
 
-    for field, value in updates.items():
-        if value is not None:
-            setattr(product, field, value)
+    changed_fields = [field for field, value in updates.items() if value is not None]
+    for field in changed_fields:
+        setattr(product, field, updates[field])
+
+    if changed_fields:
+        product.mark_modified()
+
+    if 'price' in changed_fields:
+        # the subtotals of carts holding the product were summed at the old price
+        db.session.flush()
+        CartItemService.recompute_subtotals(CartItemService.carts_containing([product_id]))
 
     db.session.commit()
+    invalidate_products([product_id], changed_fields)
+
+    if updates['image_hash']:
+        schedule_derivatives(updates['image_hash'])
+
     return product
 
 
@@ -163,4 +1010,204 @@ def delete_product(product_id: int) -> str:
 
     db.session.delete(product)
     db.session.commit()
+    invalidate_products([product_id])
     return "Product deleted successfully"
+
+
+# fields that can be changed on many products at once, and how their values are converted
+BULK_UPDATE_FIELDS = {
+    'price': float,
+    'quantity': int,
+    'featured': _to_bool,
+    'condition': str,
+}
+MAX_BULK_UPDATE_IDS = 10000
+# ids per UPDATE statement (keeps each statement under SQLite's bound parameter limit)
+_BULK_UPDATE_CHUNK_SIZE = 500
+
+
+def parse_bulk_update(data: dict) -> tuple[Optional[list[int]], Optional[dict], dict]:
+    """
+    Validate the body of a bulk product update.
+
+    The products are selected either by `ids` or by a `filter` with the same attributes
+    as the catalog filters (e.g. `{"sport": ["Soccer", "Hockey"], "price_max": 20}`).
+
+    Args:
+        data (dict): The request body, with `ids` or `filter` and the `set` field changes.
+
+    Raises:
+        ValueError: If the selection or a field change is missing or invalid.
+
+    Returns:
+        tuple[Optional[list[int]], Optional[dict], dict]: The product ids (or None), the
+        filters (or None) and the field changes.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    raw_changes = data.get('set')
+    if not isinstance(raw_changes, dict) or not raw_changes:
+        raise ValueError("No field changes given")
+
+    unknown = set(raw_changes) - set(BULK_UPDATE_FIELDS)
+    if unknown:
+        raise ValueError(f"Fields can't be bulk updated: {', '.join(sorted(unknown))}")
+
+    try:
+        changes = {field: BULK_UPDATE_FIELDS[field](value) for field, value in raw_changes.items() if value is not None}
+    except (TypeError, ValueError):
+        raise ValueError("Invalid field value")
+    if len(changes) != len(raw_changes):
+        raise ValueError("Invalid field value")
+    if changes.get('price', 0) < 0 or changes.get('quantity', 0) < 0 or changes.get('condition') == '':
+        raise ValueError("Invalid field value")
+
+    if ('ids' in data) == ('filter' in data):
+        raise ValueError("Give either ids or filter")
+
+    if 'ids' in data:
+        try:
+            ids = list(dict.fromkeys(int(product_id) for product_id in data['ids']))
+        except (TypeError, ValueError):
+            raise ValueError("ids must be a list of integers")
+        if not ids:
+            raise ValueError("ids must not be empty")
+        if len(ids) > MAX_BULK_UPDATE_IDS:
+            raise ValueError(f"At most {MAX_BULK_UPDATE_IDS} ids can be updated at once")
+        return ids, None, changes
+
+    raw_filter = data['filter']
+    if not isinstance(raw_filter, dict):
+        raise ValueError("filter must be an object")
+
+    # same format as the query string of the catalog, so the same parser and rules apply
+    args = MultiDict([
+        (name, str(value).lower() if isinstance(value, bool) else str(value))
+        for name, values in raw_filter.items()
+        for value in (values if isinstance(values, list) else [values])
+    ])
+    unknown = set(args) - set(FACET_FIELDS) - set(RANGE_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+    filters = parse_filters(args)
+    if not filters:
+        # an empty filter would update the whole catalog, which is never what a client means
+        raise ValueError("filter must not be empty")
+
+    return None, filters, changes
+
+
+def bulk_update_products(changes: dict, product_ids: Optional[list[int]] = None, filters: Optional[dict] = None) -> tuple[int, list[int]]:
+    """
+    Apply the same field changes to many products with set-based UPDATE statements
+    (one per chunk of ids, or a single one for a filter) in one transaction.
+
+    Every changed product gets a new version, and the caches are invalidated once for the
+    whole update.  When prices change, the subtotals of the carts holding the products are
+    recomputed in the same transaction.  The changeable fields aren't indexed for search, so the search index
+    isn't touched.  A new quantity is never set below the units carts hold of a product (its
+    unreserved stock would go negative), those products are skipped and reported.
+
+    Args:
+        changes (dict): Field -> new value (fields from BULK_UPDATE_FIELDS).
+        product_ids (Optional[list[int]]): IDs of the products to update.
+        filters (Optional[dict]): Filters from `parse_filters` selecting the products to update.
+
+    Returns:
+        tuple[int, list[int]]: The number of products updated and the IDs of the selected
+        products that were skipped because carts hold more than the new quantity.
+    """
+    statement = (
+        update(Product)
+        .values(**changes, version=Product.version + 1, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    held_beyond_quantity = None
+    if 'quantity' in changes:
+        held_beyond_quantity = Product.reserved_quantity > changes['quantity']
+        statement = statement.where(~held_beyond_quantity)
+
+    # carts holding the products are recomputed at the new prices (found before the update,
+    # since a filter on the price may not match the products afterwards)
+    reprice_carts = 'price' in changes
+    cart_ids = set()
+    selections = []
+
+    try:
+        if product_ids is not None:
+            updated = 0
+            for start in range(0, len(product_ids), _BULK_UPDATE_CHUNK_SIZE):
+                chunk = product_ids[start:start + _BULK_UPDATE_CHUNK_SIZE]
+                if reprice_carts:
+                    cart_ids.update(CartItemService.carts_containing(chunk))
+                updated += db.session.execute(statement.where(Product.id.in_(chunk))).rowcount
+                selections.append([Product.id.in_(chunk)])
+        else:
+            if reprice_carts:
+                cart_ids.update(CartItemService.carts_containing(select(Product.id).where(*_filter_clauses(filters))))
+            updated = db.session.execute(statement.where(*_filter_clauses(filters))).rowcount
+            selections.append(_filter_clauses(filters))
+
+        # the skipped products weren't changed, so they still match their selection (and the
+        # update holds the write lock, so no hold changed since)
+        skipped = []
+        if held_beyond_quantity is not None:
+            for clauses in selections:
+                skipped.extend(db.session.execute(
+                    select(Product.id).where(*clauses, held_beyond_quantity).order_by(Product.id)
+                ).scalars())
+
+        if cart_ids:
+            CartItemService.recompute_subtotals(list(cart_ids))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if product_ids is not None:
+        invalidate_products(product_ids, changes)
+    else:
+        clear_caches()
+
+    return updated, skipped
+
+
+def migrate_images_to_store(batch_size: int = 100) -> int:
+    """
+    Move the legacy inline images of products out of the product table and into the image store.
+
+    Products are migrated in batches with one commit per batch, so the migration can be
+    interrupted and re-run safely.
+
+    Args:
+        batch_size (int): Number of products to migrate per commit.
+
+    Returns:
+        int: The number of product images that were moved.
+    """
+    moved = 0
+
+    while True:
+        products = (
+            Product.query
+            .options(undefer(Product.image))
+            .filter(Product.image.isnot(None))
+            .limit(batch_size)
+            .all()
+        )
+        if not products:
+            return moved
+
+        for product in products:
+            product.image_hash = image_store.store_image(product.image)
+            product.image = None
+            product.mark_modified()
+
+        db.session.commit()
+        invalidate_products((product.id for product in products), ['image_hash'])
+
+        for product in products:
+            schedule_derivatives(product.image_hash)
+        moved += len(products)
@@ -0,0 +1,229 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from config.config import Config
+from models.reservation import Reservation, db
+from models.cart import Cart
+from models.cart_item import CartItem
+from models.product import Product
+from services.cart_store import get_cart_store
+from sqlalchemy import and_, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def hold_items(cart_id, quantities, now=None):
+    """Set the holds of a cart on products to the quantities of them in the cart, and extend them
+    (in the caller's transaction).
+
+    Only the change of each hold is added to the product's reserved quantity, with a conditional
+    UPDATE that fails if not enough unreserved stock is left, so two carts can never hold the
+    same units.
+
+    Args:
+        cart_id (int): id of the cart.
+        quantities (dict[int, int]): product id -> quantity of it in the cart (0 releases the hold).
+        now (datetime, optional): the current time (UTC). Defaults to now.
+
+    Raises:
+        ValueError: if a quantity is negative, or a product doesn't have enough unreserved stock
+            (the caller rolls back).
+    """
+    if not quantities:
+        return
+    if any(quantity < 0 for quantity in quantities.values()):
+        raise ValueError("Cart quantities can't be negative.")
+    expires_at = (now or datetime.utcnow()) + timedelta(seconds=Config.RESERVATION_TTL)
+
+    # the cart's current holds on the products
+    held = dict(db.session.execute(
+        select(Reservation.product_id, Reservation.quantity)
+        .where(Reservation.cart_id == cart_id, Reservation.product_id.in_(quantities))
+    ).all())
+
+    for product_id, quantity in quantities.items():
+        change = quantity - held.get(product_id, 0)
+        if not change:
+            continue
+
+        # reserved_quantity isn't part of the product's representation, so its updated_at (the
+        # Last-Modified of its listings and its page) is kept rather than set by onupdate
+        statement = (
+            update(Product)
+            .where(Product.id == product_id)
+            .values(reserved_quantity=Product.reserved_quantity + change, updated_at=Product.updated_at)
+        )
+        if change > 0:
+            statement = statement.where(Product.quantity - Product.reserved_quantity >= change)
+
+        if not db.session.execute(statement.execution_options(synchronize_session=False)).rowcount:
+            available, product_name = db.session.execute(
+                select(Product.quantity - Product.reserved_quantity + held.get(product_id, 0), Product.name)
+                .where(Product.id == product_id)
+            ).one()
+            raise ValueError(f"Only {available} units of {product_name} are available.")
+
+    holds = [
+        {'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity, 'expires_at': expires_at}
+        for product_id, quantity in quantities.items() if quantity > 0
+    ]
+    if holds:
+        statement = sqlite_insert(Reservation)
+        db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[Reservation.cart_id, Reservation.product_id],
+                set_={'quantity': statement.excluded.quantity, 'expires_at': statement.excluded.expires_at},
+            ),
+            holds,
+        )
+
+    released = [product_id for product_id, quantity in quantities.items() if quantity == 0 and product_id in held]
+    if released:
+        db.session.execute(delete(Reservation).where(Reservation.cart_id == cart_id, Reservation.product_id.in_(released)))
+
+
+def hold_user_cart(user_id, now=None):
+    """Hold the stock of everything in a user's cart and extend the holds (e.g. when a payment
+    is started, so the items can't sell out while the user pays).
+
+    Args:
+        user_id (int): id of the user.
+        now (datetime, optional): the current time (UTC). Defaults to now.
+
+    Raises:
+        ValueError: if a product doesn't have enough unreserved stock (nothing is changed).
+
+    Returns:
+        bool: True if the cart's items are held, False if the user has no cart
+    """
+    # a cart held by a write-behind cart store is written first, holds follow the db's items
+    get_cart_store().flush_user(user_id)
+
+    cart_id = db.session.execute(
+        select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.id).limit(1)
+    ).scalar()
+    if cart_id is None:
+        return False
+
+    quantities = dict(db.session.execute(
+        select(CartItem.product_id, func.sum(CartItem.quantity))
+        .where(CartItem.cart_id == cart_id)
+        .group_by(CartItem.product_id)
+    ).all())
+
+    try:
+        hold_items(cart_id, quantities, now)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+
+def held_quantity(cart_id):
+    """SQL expression of a cart's hold on the product of the enclosing product row (0 if none).
+
+    Args:
+        cart_id (int): id of the cart.
+
+    Returns:
+        ScalarSelect: the number of units of the product held by the cart
+    """
+    return (
+        select(func.coalesce(func.sum(Reservation.quantity), 0))
+        .where(Reservation.cart_id == cart_id, Reservation.product_id == Product.id)
+        .scalar_subquery()
+    )
+
+
+def _release(condition):
+    """Release the holds matching a condition with one UPDATE of the products they hold and
+    one DELETE (in the caller's transaction).  Like taking a hold, this keeps the products'
+    updated_at.
+
+    Args:
+        condition (ColumnElement): which reservations to release.
+
+    Returns:
+        int: the number of holds released
+    """
+    released_quantity = (
+        select(func.sum(Reservation.quantity))
+        .where(Reservation.product_id == Product.id, condition)
+        .scalar_subquery()
+    )
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(select(Reservation.product_id).where(condition)))
+        .values(reserved_quantity=Product.reserved_quantity - released_quantity, updated_at=Product.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(delete(Reservation).where(condition)).rowcount
+
+
+def release_cart_holds(cart_id):
+    """Release all the holds of a cart (in the caller's transaction, e.g. when the cart is deleted).
+
+    Args:
+        cart_id (int): id of the cart.
+
+    Returns:
+        int: the number of holds released
+    """
+    return _release(Reservation.cart_id == cart_id)
+
+
+def release_holds_not_in_cart(cart_id):
+    """Release the holds of a cart on products that are no longer in it (in the caller's
+    transaction, e.g. before the cart is ordered).
+
+    Args:
+        cart_id (int): id of the cart.
+
+    Returns:
+        int: the number of holds released
+    """
+    return _release(and_(
+        Reservation.cart_id == cart_id,
+        Reservation.product_id.not_in(select(CartItem.product_id).where(CartItem.cart_id == cart_id)),
+    ))
+
+
+def release_expired_holds(now=None):
+    """Release every hold that has expired, in bulk.
+
+    Args:
+        now (datetime, optional): the current time (UTC). Defaults to now.
+
+    Returns:
+        int: the number of holds released
+    """
+    try:
+        released = _release(Reservation.expires_at <= (now or datetime.utcnow()))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return released
+
+
+def init_app(app):
+    """Start releasing expired holds in the background every RESERVATION_SWEEP_INTERVAL seconds.
+
+    Args:
+        app (Flask): the flask app (the sweeps run in its app context)
+    """
+    if app.config.get('TESTING', False):
+        return
+
+    def run():
+        while True:
+            time.sleep(Config.RESERVATION_SWEEP_INTERVAL)
+            with app.app_context():
+                try:
+                    released = release_expired_holds()
+                    if released:
+                        print(f"Released {released} expired stock holds")
+                except Exception as e:
+                    print(f"Error releasing expired stock holds: {e}")
+
+    threading.Thread(target=run, name='reservation-sweeper', daemon=True).start()
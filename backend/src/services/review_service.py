@@ -1,5 +1,12 @@
 from models.review import Review, db
-from datetime import datetime
+from models.review_summary import ReviewSummary
+from models.product import Product
+from models.user import User
+from datetime import date, datetime
+from sqlalchemy import case, delete, exists, func, insert, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from services import product_service
+from services.pagination import DEFAULT_PAGE_SIZE, encode_cursor, decode_cursor, keyset_filter
 
 
 def add_review(reviewer_id, product_id, rating, explanation):
@@ -12,7 +19,7 @@ def add_review(reviewer_id, product_id, rating, explanation):
         explanation (str): textual explanation of the review.
 
     Returns:
-        Review: newly created review object.
+        Review: newly created review object (None if the product doesn't exist).
     """
     # create a new instance of the Review model with the provided data
     new_review = Review(
@@ -23,60 +30,226 @@ def add_review(reviewer_id, product_id, rating, explanation):
         review_date=datetime.utcnow()
     )
     
-    # ddd the new review to the db and commit
+    # add the new review to the db and update the product's rating in the same transaction
     db.session.add(new_review)
+    updated = db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(
+            rating_count=Product.rating_count + 1,
+            rating_sum=Product.rating_sum + rating,
+            # the right hand sides all read the values from before the update
+            avg_rating=(Product.rating_sum + rating) / (Product.rating_count + 1),
+            version=Product.version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    if not updated:
+        db.session.rollback()
+        return None
+
+    _add_to_summary(product_id, rating)
     db.session.commit()
+    product_service.invalidate_products([product_id], ['avg_rating', 'rating_count'])
     
     # return the new review object
     return new_review
 
 
-def get_reviews_by_product(product_id):
-    """ Retrieve all reviews for a given product, including associated user and seller details.
+# sort orders of the reviews of a product -> the columns of the sort key with their types
+# in the cursor, and whether they're sorted in descending order
+REVIEW_SORT_ORDERS = {
+    'newest': (((Review.review_date, date), (Review.id, int)), True),
+    'highest': (((Review.rating, float), (Review.id, int)), True),
+    'lowest': (((Review.rating, float), (Review.id, int)), False),
+}
+
+
+def get_reviews_by_product(product_id, limit=DEFAULT_PAGE_SIZE, cursor=None, sort='newest'):
+    """ Retrieve a page of the reviews of a given product, with the product and seller details.
+
+    The product and its seller are read once with one joined query, and the page of reviews
+    with their reviewers' names with another, so the cost doesn't depend on the number of reviews.
 
     Args:
         product_id (int): id of the product for which reviews are to be retrieved.
+        limit (int, optional): maximum number of reviews in the page.
+        cursor (str, optional): the `next_cursor` of the previous page (None for the first page).
+        sort (str, optional): "newest" (default), "highest" or "lowest" rating first.
 
     Returns:
-        list[dict]: a list of reviews, each represented as a dict containing:
-            - id (int): id of the review.
-            - rating (float): rating given in the review.
-            - explanation (str): textual explanation of the review.
-            - review_date (str): review date in ISO 8601 format.
-            - reviewer_name (str): name of the user who wrote the review.
-            - seller_id (int): id of the seller of the reviewed product.
-            - seller_name (str): name of the seller.
-            - product_id (int): id of the reviewed product.
-            - product_name (str): name of the reviewed product.
+        dict: None if the product doesn't exist, otherwise a dict containing:
+            - product (dict): id, name, seller_id and seller_name of the product.
+            - reviews (list[dict]): the reviews, each with its id, rating, explanation,
+              review_date (ISO 8601), reviewer_id and reviewer_name.
+            - next_cursor (str): cursor of the next page (None if this is the last page).
 
     Raises:
+        ValueError: if the sort order or the cursor is invalid.
         Exception: if there is an error retrieving reviews from the database.
     """
+    if sort not in REVIEW_SORT_ORDERS:
+        raise ValueError(f"sort must be one of: {', '.join(REVIEW_SORT_ORDERS)}")
+    sort_key, descending = REVIEW_SORT_ORDERS[sort]
+    columns = [column for column, _ in sort_key]
+    cursor_values = decode_cursor(cursor, *(value_type for _, value_type in sort_key)) if cursor else None
+
     try:
-        # retrieve all reviews of the given product
-        reviews = Review.query.filter_by(product_id=product_id).all()
-        
-        # format reviews data with product and seller info
-        reviews_data = [
-            {
-                'id': review.id,
-                'rating': review.rating,
-                'explanation': review.explanation,
-                'review_date': review.review_date.isoformat(),
-                'reviewer_name': review.reviewing_user.name,
-                'seller_id': review.reviewed_product.seller_id,
-                'seller_name': review.reviewed_product.seller.name,
-                'product_id': review.product_id,
-                'product_name': review.reviewed_product.name 
-            }
-            for review in reviews
-        ]
-        # return the list
-        return reviews_data
+        # the product and seller, once for the whole page
+        product = db.session.execute(
+            select(Product.id, Product.name, Product.seller_id, User.name.label('seller_name'))
+            .outerjoin(User, User.id == Product.seller_id)
+            .where(Product.id == product_id)
+        ).first()
+        if product is None:
+            return None
+
+        # the page of reviews with their reviewers (fetch one extra row to know whether there is a next page)
+        query = (
+            select(Review.id, Review.rating, Review.explanation, Review.review_date,
+                   Review.reviewer_id, User.name.label('reviewer_name'))
+            .outerjoin(User, User.id == Review.reviewer_id)
+            .where(Review.product_id == product_id)
+            .order_by(*(column.desc() if descending else column.asc() for column in columns))
+            .limit(limit + 1)
+        )
+        if cursor_values:
+            query = query.where(keyset_filter(columns, cursor_values, descending))
+        rows = db.session.execute(query).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(*(getattr(rows[-1], column.key) for column in columns))
+
+        return {
+            'product': product._asdict(),
+            'reviews': [
+                {
+                    'id': row.id,
+                    'rating': row.rating,
+                    'explanation': row.explanation,
+                    'review_date': row.review_date.isoformat(),
+                    'reviewer_id': row.reviewer_id,
+                    'reviewer_name': row.reviewer_name,
+                }
+                for row in rows
+            ],
+            'next_cursor': next_cursor,
+        }
     except Exception as e:
         raise Exception(f"Error retrieving reviews: {str(e)}")
     
 
+def _add_to_summary(product_id, rating):
+    """Count a new review in the review summary of its product (in the caller's transaction).
+
+    Args:
+        product_id (int): id of the reviewed product.
+        rating (float): the rating of the review.
+    """
+    star_column = ReviewSummary.STAR_COLUMNS[ReviewSummary.star_of(rating)]
+    summary_table = ReviewSummary.__table__
+
+    # one upsert: the first review of a product creates its row, later ones increment it
+    db.session.execute(
+        sqlite_insert(summary_table)
+        .values(product_id=product_id, review_count=1, rating_sum=rating, **{star_column: 1})
+        .on_conflict_do_update(
+            index_elements=[summary_table.c.product_id],
+            set_={
+                'review_count': summary_table.c.review_count + 1,
+                'rating_sum': summary_table.c.rating_sum + rating,
+                star_column: summary_table.c[star_column] + 1,
+            },
+        )
+    )
+
+
+def _remove_from_summary(product_id, rating):
+    """Take a deleted review out of the review summary of its product (in the caller's transaction).
+
+    Args:
+        product_id (int): id of the reviewed product.
+        rating (float): the rating of the review.
+    """
+    star_column = ReviewSummary.STAR_COLUMNS[ReviewSummary.star_of(rating)]
+
+    db.session.execute(
+        update(ReviewSummary)
+        .where(ReviewSummary.product_id == product_id, getattr(ReviewSummary, star_column) > 0)
+        .values(
+            review_count=ReviewSummary.review_count - 1,
+            rating_sum=ReviewSummary.rating_sum - rating,
+            **{star_column: getattr(ReviewSummary, star_column) - 1},
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_review_summary(product_id):
+    """Get the rating summary of a product's reviews (one primary key lookup).
+
+    Args:
+        product_id (int): id of the product.
+
+    Returns:
+        dict: the review count, average rating and histogram of star ratings (all zero if
+        the product has no reviews).
+    """
+    return get_review_summaries([product_id])[0]
+
+
+# most products whose review summaries can be fetched in one request
+MAX_SUMMARY_BATCH_SIZE = 100
+
+
+def parse_product_ids(raw_values):
+    """Parse a list of product ids given as comma separated query parameter values.
+
+    Args:
+        raw_values (list[str]): the values of the (possibly repeated) query parameter.
+
+    Raises:
+        ValueError: if an id isn't an integer, or there are none or too many of them.
+
+    Returns:
+        list[int]: the product ids in the order given (duplicates removed).
+    """
+    try:
+        product_ids = [int(value) for raw_value in raw_values for value in raw_value.split(',') if value.strip()]
+    except ValueError:
+        raise ValueError("product_ids must be comma separated integers")
+
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        raise ValueError("product_ids is required")
+    if len(product_ids) > MAX_SUMMARY_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_SUMMARY_BATCH_SIZE} product_ids can be given")
+    return product_ids
+
+
+def get_review_summaries(product_ids):
+    """Get the rating summaries of many products with one lookup of their rollup rows.
+
+    Args:
+        product_ids (list[int]): ids of the products.
+
+    Returns:
+        list[dict]: the summary of each product in the order given (all zero for products
+        without reviews).
+    """
+    summaries = {
+        summary.product_id: summary
+        for summary in ReviewSummary.query.filter(ReviewSummary.product_id.in_(product_ids))
+    }
+    return [
+        summaries.get(product_id, ReviewSummary(product_id=product_id, review_count=0, rating_sum=0.0)).to_dict()
+        for product_id in product_ids
+    ]
+
+
 def delete_review(review_id):
     """Delete a review from the database.
 
@@ -89,9 +262,99 @@ def delete_review(review_id):
     # retrieve the review by its ID
     review = Review.query.get(review_id)
     
-    # if the review exists, delete it from the database and commit
+    # if the review exists, delete it and take its rating out of the product's rating
     if review:
         db.session.delete(review)
+        db.session.execute(
+            update(Product)
+            # products whose rating was never counted (before `flask repair-ratings`) are left alone
+            .where(Product.id == review.product_id, Product.rating_count > 0)
+            .values(
+                rating_count=Product.rating_count - 1,
+                rating_sum=Product.rating_sum - review.rating,
+                avg_rating=case(
+                    (Product.rating_count > 1, (Product.rating_sum - review.rating) / (Product.rating_count - 1)),
+                    else_=0.0,
+                ),
+                version=Product.version + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        _remove_from_summary(review.product_id, review.rating)
         db.session.commit()
+        product_service.invalidate_products([review.product_id], ['avg_rating', 'rating_count'])
         return True
-    return False
\ No newline at end of file
+    return False
+
+
+def repair_rating_aggregates():
+    """Recompute the rating count, sum and average of every product, and the review
+    summaries, from the reviews.
+
+    Used to backfill the aggregates of existing reviews, or to repair them after reviews
+    were changed outside of this service.  The reviews are counted with one grouped query,
+    and only products whose aggregates are wrong are updated.  The review summaries are
+    rebuilt with one INSERT ... SELECT.
+
+    Returns:
+        int: number of products whose rating was corrected.
+    """
+    totals = (
+        select(
+            Review.product_id,
+            func.count(Review.id).label('rating_count'),
+            func.sum(Review.rating).label('rating_sum'),
+        )
+        .group_by(Review.product_id)
+        .subquery()
+    )
+    average = totals.c.rating_sum / totals.c.rating_count
+
+    # products with reviews (UPDATE ... FROM the grouped totals)
+    repaired = db.session.execute(
+        update(Product)
+        .where(Product.id == totals.c.product_id)
+        .where(or_(
+            Product.rating_count != totals.c.rating_count,
+            Product.rating_sum != totals.c.rating_sum,
+            Product.avg_rating.is_(None),
+            Product.avg_rating != average,
+        ))
+        .values(
+            rating_count=totals.c.rating_count,
+            rating_sum=totals.c.rating_sum,
+            avg_rating=average,
+            version=Product.version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    # products without reviews
+    repaired += db.session.execute(
+        update(Product)
+        .where(~exists().where(Review.product_id == Product.id))
+        .where(or_(Product.rating_count != 0, Product.rating_sum != 0, Product.avg_rating.is_(None), Product.avg_rating != 0))
+        .values(rating_count=0, rating_sum=0.0, avg_rating=0.0, version=Product.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    star = ReviewSummary.star_of_column()
+    db.session.execute(delete(ReviewSummary))
+    db.session.execute(
+        insert(ReviewSummary).from_select(
+            ['product_id', 'review_count', 'rating_sum', *ReviewSummary.STAR_COLUMNS.values()],
+            select(
+                Review.product_id,
+                func.count(Review.id),
+                func.sum(Review.rating),
+                *(func.sum(case((star == stars, 1), else_=0)) for stars in ReviewSummary.STAR_COLUMNS),
+            )
+            .group_by(Review.product_id),
+        )
+    )
+
+    db.session.commit()
+    if repaired:
+        product_service.clear_caches()
+
+    return repaired
\ No newline at end of file
@@ -0,0 +1,85 @@
+import threading
+import time
+import pytest
+from services.cache import LRUTTLCache
+
+
+def test_lru_eviction():
+    """Test that the least recently used entry is evicted past the size bound."""
+    cache = LRUTTLCache(max_size=2, ttl=60)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('b', lambda: 2)
+    cache.get_or_load('a', lambda: 1)  # a is now the most recently used
+    cache.get_or_load('c', lambda: 3)
+
+    assert cache.get_or_load('a', lambda: 'reloaded') == 1
+    assert cache.get_or_load('b', lambda: 'reloaded') == 'reloaded'
+
+    stats = cache.stats()
+    assert stats['evictions'] == 2
+    assert stats['size'] == 2
+
+
+def test_ttl_expiry():
+    """Test that entries are reloaded once their ttl passes."""
+    cache = LRUTTLCache(max_size=10, ttl=0.05)
+    assert cache.get_or_load('a', lambda: 1) == 1
+    time.sleep(0.1)
+    assert cache.get_or_load('a', lambda: 2) == 2
+    assert cache.stats()['expirations'] == 1
+
+
+def test_invalidation():
+    """Test that invalidated keys are reloaded and a load racing a write isn't cached."""
+    cache = LRUTTLCache(max_size=10, ttl=60)
+    cache.get_or_load(('product', 1), lambda: 'old')
+    cache.get_or_load(('product', 2), lambda: 'other')
+
+    cache.invalidate_where(lambda key: key[1] == 1)
+    assert cache.get_or_load(('product', 1), lambda: 'new') == 'new'
+    assert cache.get_or_load(('product', 2), lambda: 'reloaded') == 'other'
+
+    def load_then_write():
+        value = 'stale'
+        cache.invalidate(('product', 3))  # a write lands while the value is loading
+        return value
+
+    assert cache.get_or_load(('product', 3), load_then_write) == 'stale'
+    assert cache.get_or_load(('product', 3), lambda: 'fresh') == 'fresh'
+
+
+def test_concurrent_misses_are_coalesced():
+    """Test that concurrent misses of one key run the loader once."""
+    cache = LRUTTLCache(max_size=10, ttl=60)
+    calls = []
+    release = threading.Event()
+
+    def slow_load():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('key', slow_load))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['value'] * 8
+    assert cache.stats()['coalesced'] == 7
+
+
+def test_loader_errors_are_not_cached():
+    """Test that a failing load raises for every waiter and isn't cached."""
+    cache = LRUTTLCache(max_size=10, ttl=60)
+
+    def failing_load():
+        raise RuntimeError("database is down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('key', failing_load)
+    assert cache.get_or_load('key', lambda: 'value') == 'value'
@@ -6,6 +6,7 @@ from models.user import User
 from models.product import Product
 from models.cart import Cart
 from models.cart_item import CartItem 
+from sqlalchemy import event
 from controllers.cart_controller import cart_bp
 
 
@@ -114,6 +115,29 @@ def test_get_cart(client, setup_database):
     assert data['items'][1]['quantity'] == 2
 
 
+def test_get_cart_one_statement(client, setup_database, app):
+    """Test that reading a cart costs one statement however many items it has."""
+    with app.app_context():
+        for product_id in range(3, 23):
+            db.session.add(Product(id=product_id, name=f"Product {product_id}", seller_id=1, price=1.0,
+                                   gender="Unisex", size="M", condition="New", youth_size=False,
+                                   brand="Brand A", sport="Running", date_listed=datetime.utcnow()))
+            db.session.add(CartItem(cart_id=1, product_id=product_id, quantity=1))
+        db.session.commit()
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        response = client.get('/api/cart/1')
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    assert response.status_code == 200
+    assert len(response.get_json()['items']) == 22
+    assert len(statements) == 1
+
 
 def test_update_cart(client, setup_database):
     """Test updating a cart's subtotal and item quantities."""
@@ -153,6 +177,11 @@ def test_update_cart(client, setup_database):
     assert updated_item is not None, "Updated item not found in cart"
     assert updated_item['quantity'] == valid_quantity, "Item quantity did not update"
 
+    # Step 6: Negative and non-integer quantities are rejected
+    for quantity in (-5, 1.5, "2"):
+        response = client.put('/api/cart/1', json={"product_id": product_id, "quantity": quantity})
+        assert response.status_code == 400, f"Quantity {quantity!r} was accepted"
+
 
 
 
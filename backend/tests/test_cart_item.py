@@ -6,7 +6,14 @@ from models.cart import Cart
 from models.cart_item import CartItem
 from models.product import Product
 from datetime import datetime
+import threading
+from sqlalchemy import event
 from controllers.cart_item_controller import cart_item_bp
+from services.cart_item_service import CartItemService
+from services.cart_store import MemoryCartStore, set_cart_store
+from services import reservation_service
+from services.order_service import create_order
+from services.product_service import update_product
 
 
 @pytest.fixture
@@ -33,6 +40,15 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def memory_store():
+    """Fixture to hold carts in a write-behind memory store during a test."""
+    store = MemoryCartStore()
+    previous = set_cart_store(store)
+    yield store
+    set_cart_store(previous)
+
+
 @pytest.fixture
 def setup_database(app):
     """Fixture to populate the database with mock data for testing."""
@@ -123,5 +139,248 @@ def test_remove_from_cart(client, setup_database):
     assert len(data['items']) == 0
 
 
+def test_subtotal_deltas(client, setup_database, app):
+    """Test that cart changes adjust the subtotal by their value and price changes recompute it."""
+    with app.app_context():
+        CartItemService.add_item_to_cart(1, 1, 2)
+        CartItemService.add_item_to_cart(1, 2, 1)
+        CartItemService.add_item_to_cart(1, 1, 1)
+        assert db.session.get(Cart, 1).subtotal == 225.0
+
+        item = CartItem.query.filter_by(cart_id=1, product_id=2).one()
+        CartItemService.update_item_and_cart(1, item.id, 3)
+        assert db.session.get(Cart, 1).subtotal == 375.0
+
+        # the price of a product in the cart changes
+        update_product(product_id=1, price=40.0)
+        assert db.session.get(Cart, 1).subtotal == 345.0
+
+        CartItemService.remove_item_from_cart(1, item.id)
+        assert db.session.get(Cart, 1).subtotal == 120.0
+
+        assert CartItemService.add_item_to_cart(1, 99, 1) is None
+
+
+def test_cart_change_statements_constant(client, setup_database, app):
+    """Test that changing an item costs the same number of statements however big the cart is."""
+    def statements_to_update_item():
+        item = CartItem.query.filter_by(cart_id=1, product_id=1).one()
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        CartItemService.update_item_and_cart(1, item.id, item.quantity + 1)
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+        return len(statements)
+
+    with app.app_context():
+        CartItemService.add_item_to_cart(1, 1, 1)
+        small_cart = statements_to_update_item()
+
+        for product_id in range(3, 53):
+            db.session.add(Product(id=product_id, name=f"Product {product_id}", seller_id=1, price=1.0,
+                                   gender="Unisex", size="M", condition="New", quantity=10, youth_size=False,
+                                   brand="Brand A", sport="Sport A", date_listed=datetime.utcnow()))
+            db.session.add(CartItem(cart_id=1, product_id=product_id, quantity=1))
+        db.session.commit()
+
+        assert statements_to_update_item() == small_cart
+
+
+def test_batch_cart_operations(client, setup_database, app):
+    """Test applying a batch of cart operations in one request."""
+    client.post('/api/cart/1/add', json={'product_id': 1, 'quantity': 2})
+
+    response = client.patch('/api/cart/1/items', json={'operations': [
+        {'op': 'add', 'product_id': 2, 'quantity': 2},
+        {'op': 'set', 'product_id': 1, 'quantity': 5},
+        {'op': 'add', 'product_id': 2},
+    ]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['subtotal'] == 475.0  # 5 x 50.0 + 3 x 75.0
+    assert [(item['product_id'], item['quantity']) for item in data['items']] == [(1, 5), (2, 3)]
+
+    # product 2 has only 5 in stock, so nothing in the batch is applied
+    response = client.patch('/api/cart/1/items', json={'operations': [
+        {'op': 'remove', 'product_id': 1},
+        {'op': 'add', 'product_id': 2, 'quantity': 3},
+    ]})
+    assert response.status_code == 400
+    assert "Only 5" in response.get_json()['error']
+
+    response = client.patch('/api/cart/1/items', json={'operations': [
+        {'op': 'remove', 'product_id': 1},
+        {'op': 'set', 'product_id': 2, 'quantity': 1},
+    ]})
+    data = response.get_json()
+    assert data['subtotal'] == 75.0
+    assert [(item['product_id'], item['quantity']) for item in data['items']] == [(2, 1)]
+
+    assert client.patch('/api/cart/1/items', json={'operations': [{'op': 'add', 'product_id': 99}]}).status_code == 400
+    assert client.patch('/api/cart/1/items', json={'operations': [{'op': 'bump', 'product_id': 1}]}).status_code == 400
+    assert client.patch('/api/cart/9/items', json={'operations': [{'op': 'add', 'product_id': 1}]}).status_code == 404
+
+
+def test_write_behind_cart_store(client, setup_database, app, memory_store):
+    """Test that a write-behind cart store keeps cart changes off the db until it's flushed."""
+    with app.app_context():
+        writes = []
+
+        def count_write(conn, cursor, statement, *args):
+            if not statement.lstrip().upper().startswith('SELECT'):
+                writes.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_write)
+        client.post('/api/cart/1/add', json={'product_id': 1, 'quantity': 2})
+        client.post('/api/cart/1/add', json={'product_id': 2, 'quantity': 1})
+        response = client.patch('/api/cart/1/items', json={'operations': [{'op': 'set', 'product_id': 2, 'quantity': 3}]})
+        event.remove(db.engine, 'before_cursor_execute', count_write)
+
+        assert writes == []
+        data = response.get_json()
+        assert data['subtotal'] == 325.0  # 2 x 50.0 + 3 x 75.0
+        assert [(item['product_id'], item['quantity']) for item in data['items']] == [(1, 2), (2, 3)]
+        assert CartItem.query.filter_by(cart_id=1).count() == 0
+
+        # removing an item that was never written uses its in-memory id
+        response = client.delete('/api/cart/1/remove', json={'cart_item_id': data['items'][1]['id']})
+        assert response.get_json()['subtotal'] == 100.0
 
+        assert memory_store.flush() == 1
+        assert [(item.product_id, item.quantity) for item in CartItem.query.filter_by(cart_id=1)] == [(1, 2)]
+        assert db.session.get(Cart, 1).subtotal == 100.0
 
+        # checkout writes the cart's latest changes first
+        client.post('/api/cart/1/add', json={'product_id': 2, 'quantity': 1})
+        order = create_order(1)
+        assert order.total == 175.0
+        assert sorted((item.product_name, item.quantity) for item in order.order_items) == [("Product 1", 2), ("Product 2", 1)]
+        assert memory_store.flush() == 0
+
+
+def test_write_behind_flush_keeps_item_ids(setup_database, app, memory_store):
+    """Test flushing carts that mix items from the db with new ones, without reusing or renumbering ids."""
+    with app.app_context():
+        db.session.add(User(id=2, name="Jane Doe", email="jane@example.com", profile_pic_url="", admin=False))
+        db.session.add(Product(id=3, name="Product 3", seller_id=1, price=10.0, gender="Unisex", size="S",
+                               condition="New", quantity=5, youth_size=False, brand="Brand C", sport="Sport C",
+                               date_listed=datetime.utcnow()))
+        db.session.add(Cart(id=2, user_id=2, subtotal=0.0))
+        db.session.add_all([CartItem(id=4, cart_id=1, product_id=1, quantity=1),
+                            CartItem(id=5, cart_id=2, product_id=1, quantity=1)])
+        db.session.commit()
+
+        first, second = memory_store.get_cart(1), memory_store.get_cart(2)
+        first.set_quantity(2, 1)
+        first.set_quantity(3, 2)
+        second.set_quantity(1, 3)
+        memory_store.mark_dirty(1)
+        memory_store.mark_dirty(2)
+
+        assert memory_store.flush() == 2
+
+        rows = {(item.cart_id, item.id): (item.product_id, item.quantity) for item in CartItem.query}
+        assert rows[(1, 4)] == (1, 1) and rows[(2, 5)] == (1, 3)
+        assert len(rows) == 4
+        # the new items are known by the ids of their rows
+        assert {(1, item_id): tuple(item) for item_id, item in first.items.items()} == {
+            key: value for key, value in rows.items() if key[0] == 1
+        }
+        ids = list(first.items)
+
+        # a later flush keeps the ids, and so does reloading the cart after it's evicted
+        first.set_quantity(3, 1)
+        memory_store.mark_dirty(1)
+        assert memory_store.flush() == 1
+        assert sorted(item.id for item in CartItem.query.filter_by(cart_id=1)) == sorted(ids)
+        memory_store.flush()
+        assert memory_store.get_cart(1) is not first
+        assert list(memory_store.get_cart(1).items) == ids
+
+
+def test_write_behind_carts_locked_separately(setup_database, app, memory_store):
+    """Test that a write-behind cart in use only holds up changes to the same cart, and that its
+    changes are checked against the stock other carts don't hold."""
+    with app.app_context():
+        db.session.add(User(id=2, name="Jane Doe", email="jane@example.com", profile_pic_url="", admin=False))
+        db.session.add(Cart(id=2, user_id=2, subtotal=0.0))
+        db.session.commit()
+
+    def add_to_cart(user_id):
+        with app.app_context():
+            CartItemService.add_item_to_cart(user_id, 1, 1)
+
+    with memory_store.locked_cart(1):
+        other_cart = threading.Thread(target=add_to_cart, args=(2,))
+        same_cart = threading.Thread(target=add_to_cart, args=(1,))
+        other_cart.start()
+        other_cart.join(5)
+        same_cart.start()
+        same_cart.join(0.3)
+        assert not other_cart.is_alive()
+        assert same_cart.is_alive()
+    same_cart.join()
+
+    with app.app_context():
+        assert memory_store.get_cart(1).quantities() == {1: 1}
+        assert memory_store.get_cart(2).quantities() == {1: 1}
+
+        # 4 of the 5 units of product 2 are held by another cart
+        reservation_service.hold_items(2, {2: 4})
+        db.session.commit()
+        CartItemService.add_item_to_cart(1, 2, 1)
+        with pytest.raises(ValueError, match="Only 1 units of Product 2 are available."):
+            CartItemService.update_item_and_cart(1, memory_store.get_cart(1).item_of_product(2), 2)
+        with pytest.raises(ValueError, match="Only 1 units of Product 2 are available."):
+            CartItemService.apply_cart_operations(1, [('add', 2, 1)])
+        assert memory_store.get_cart(1).quantities() == {1: 1, 2: 1}
+
+
+def test_write_behind_cart_pinned_during_checkout(tmp_path, memory_store):
+    """Test that an item added to a write-behind cart while it's being ordered isn't lost or ordered."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'carts.db'}"
+    app.config['TESTING'] = True
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, name="John Doe", email="john@example.com", profile_pic_url="", admin=False))
+        for product_id in (1, 2):
+            db.session.add(Product(id=product_id, name=f"Product {product_id}", seller_id=1, price=10.0,
+                                   gender="Unisex", size="M", condition="New", quantity=5, youth_size=False,
+                                   brand="Brand A", sport="Sport A", date_listed=datetime.utcnow()))
+        db.session.add(Cart(id=1, user_id=1, subtotal=0.0))
+        db.session.commit()
+        CartItemService.add_item_to_cart(1, 1, 1)
+
+    def add_during_checkout():
+        with app.app_context():
+            CartItemService.add_item_to_cart(1, 2, 1)
+
+    adder = threading.Thread(target=add_during_checkout)
+    waited = []
+
+    def start_adder(conn, cursor, statement, *args):
+        # the checkout has written the cart and is taking the stock
+        if statement.startswith('UPDATE product') and not adder.is_alive() and not waited:
+            adder.start()
+            adder.join(0.3)
+            waited.append(adder.is_alive())
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', start_adder)
+        order = create_order(1)
+        event.remove(db.engine, 'before_cursor_execute', start_adder)
+        adder.join()
+
+        # the add waited for the checkout, then went to a new cart
+        assert waited == [True]
+        assert [item.product_name for item in order.order_items] == ["Product 1"]
+        memory_store.flush()
+        cart = Cart.query.filter_by(user_id=1).one()
+        assert [(item.product_id, item.quantity) for item in CartItem.query.filter_by(cart_id=cart.id)] == [(2, 1)]
+        db.drop_all()
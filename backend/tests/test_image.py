@@ -0,0 +1,134 @@
+import pytest
+import io
+import hashlib
+from flask import Flask
+from datetime import datetime
+from models import db
+from models.product import Product
+from models.user import User
+from controllers.image_controller import image_bp
+from services import image_store
+from services.image_derivatives import schedule_derivatives
+from services.product_service import migrate_images_to_store
+
+
+PNG_BYTES = b'\x89PNG\r\n\x1a\n' + b'fake image data' * 10
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Fixture to create a Flask application with an image store in a temporary directory."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TESTING'] = True
+    app.config['IMAGE_STORE_PATH'] = str(tmp_path / 'image_store')
+
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        app.register_blueprint(image_bp)
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    """Fixture to create a test client for the app."""
+    return app.test_client()
+
+
+def test_store_image_is_content_addressed(app):
+    """Test that storing the same bytes twice gives the same hash and one file."""
+    first_hash = image_store.store_image(PNG_BYTES)
+    second_hash = image_store.store_image(PNG_BYTES)
+
+    assert first_hash == second_hash == hashlib.sha256(PNG_BYTES).hexdigest()
+    assert image_store.image_exists(first_hash)
+
+    with pytest.raises(ValueError):
+        image_store.image_path('../../etc/passwd')
+
+
+def test_get_image(client, app):
+    """Test serving an image with caching headers, conditional and range requests."""
+    image_hash = image_store.store_image(PNG_BYTES)
+
+    response = client.get(f'/images/{image_hash}')
+    assert response.status_code == 200
+    assert response.data == PNG_BYTES
+    assert response.mimetype == 'image/png'
+    assert response.headers['ETag'] == f'"{image_hash}"'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age > 0
+
+    not_modified = client.get(f'/images/{image_hash}', headers={'If-None-Match': f'"{image_hash}"'})
+    assert not_modified.status_code == 304
+
+    partial = client.get(f'/images/{image_hash}', headers={'Range': 'bytes=0-7'})
+    assert partial.status_code == 206
+    assert partial.data == PNG_BYTES[:8]
+
+    missing = client.get(f'/images/{"0" * 64}')
+    assert missing.status_code == 404
+
+
+def test_migrate_images_to_store(app):
+    """Test moving inline product images into the image store."""
+    db.session.add(User(id=1, name="John Doe", email="john@example.com",
+                        profile_pic_url="http://example.com/profile.jpg", admin=False))
+    for i in range(1, 4):
+        db.session.add(Product(
+            id=i,
+            seller_id=1,
+            name=f"Product {i}",
+            price=10.0,
+            gender="Unisex",
+            size="M",
+            youth_size=False,
+            brand="Nike",
+            sport="Running",
+            condition="New",
+            image=PNG_BYTES,
+            date_listed=datetime.utcnow(),
+        ))
+    db.session.commit()
+
+    assert migrate_images_to_store(batch_size=2) == 3
+
+    for product in Product.query.all():
+        assert product.image is None
+        assert product.image_hash == hashlib.sha256(PNG_BYTES).hexdigest()
+        assert product.to_dict()['image_url'] == f'/images/{product.image_hash}'
+
+    # running it again has nothing left to move
+    assert migrate_images_to_store() == 0
+
+
+def test_image_derivatives(client, app):
+    """Test that the original is served until the derivatives are generated, then the thumbnail."""
+    Image = pytest.importorskip('PIL.Image')
+
+    output = io.BytesIO()
+    Image.new('RGB', (2000, 1000), 'red').save(output, format='PNG')
+    image_hash = image_store.store_image(output.getvalue())
+
+    # the derivative isn't ready yet so the original is served, without long term caching
+    fallback = client.get(f'/images/{image_hash}/thumb')
+    assert fallback.status_code == 200
+    assert fallback.data == output.getvalue()
+    assert fallback.cache_control.no_cache
+
+    schedule_derivatives(image_hash).result(timeout=30)
+
+    thumbnail = client.get(f'/images/{image_hash}/thumb')
+    assert thumbnail.status_code == 200
+    assert thumbnail.cache_control.immutable
+    assert Image.open(io.BytesIO(thumbnail.data)).size == (320, 160)
+
+    # nothing left to generate
+    assert schedule_derivatives(image_hash) is None
+
+    assert client.get(f'/images/{image_hash}/huge').status_code == 404
@@ -7,9 +7,17 @@ from models.cart import Cart
 from models.order_item import OrderItem
 from models.cart_item import CartItem
 from models.product import Product
-from datetime import datetime
-from services.order_service import create_order, get_all_orders_by_userid
+from models.user_order_stats import UserOrderStats
+from datetime import datetime, timedelta
+from sqlalchemy import event
+import threading
+from services.order_service import create_order, get_all_orders_by_userid, get_order_stats, rebuild_order_stats
 from controllers.order_controller import order_bp
+from controllers.payment_controller import payment_bp
+from config.config import Config
+from services import idempotency_service
+from types import SimpleNamespace
+import stripe
 
 
 @pytest.fixture
@@ -173,3 +181,267 @@ def test_create_order(app, client, setup_database):
         assert cart is None, "Cart should be deleted after order creation"
 
 
+
+
+def test_paginated_user_order_history(app, client, setup_database):
+    """Test paging through a user's order history, newest first, at two statements per page."""
+    with app.app_context():
+        for day in range(1, 46):
+            order = Order(user_id=2, total=float(day), order_date=datetime(2024, 1, 1) + timedelta(days=day))
+            order.order_items.append(OrderItem(product_name="Product 1", quantity=1, price=float(day)))
+            db.session.add(order)
+        db.session.commit()
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        totals = []
+        cursor = None
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        for _ in range(3):
+            response = client.get('/api/orders/user/2' + (f'?cursor={cursor}' if cursor else ''))
+            data = response.get_json()
+            totals.extend(order['total'] for order in data['orders'])
+            assert all(len(order['items']) == 1 for order in data['orders'])
+            cursor = data['next_cursor']
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    assert totals == [float(day) for day in range(45, 0, -1)]
+    assert cursor is None
+    assert len(statements) == 6
+
+    assert client.get('/api/orders/user/2?cursor=bogus').status_code == 400
+
+
+def test_stream_user_order_history(app, client, setup_database):
+    """Test streaming a user's order history as a chunked response."""
+    response = client.get('/api/orders/user/1?stream=true')
+    assert response.status_code == 200
+    assert response.is_streamed
+
+    data = response.get_json()
+    assert len(data['orders']) == 1
+    assert data['orders'][0]['total'] == 125.0
+    assert len(data['orders'][0]['items']) == 2
+
+    empty = client.get('/api/orders/user/2?stream=true')
+    assert empty.get_json() == {'orders': []}
+
+
+def test_create_order_statements_constant(app, setup_database):
+    """Test that checkout costs the same number of statements however many products are in the cart."""
+    def statements_to_order(user_id):
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        create_order(user_id)
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+        return len(statements)
+
+    with app.app_context():
+        small_cart = statements_to_order(1)
+
+        db.session.add(Cart(id=2, user_id=2, subtotal=0.0))
+        for product_id in range(3, 33):
+            db.session.add(Product(id=product_id, name=f"Product {product_id}", seller_id=1, price=1.0,
+                                   gender="Unisex", size="M", condition="New", quantity=10, youth_size=False,
+                                   brand="Brand A", sport="Sport A", date_listed=datetime.utcnow()))
+            db.session.add(CartItem(cart_id=2, product_id=product_id, quantity=2))
+        db.session.commit()
+
+        assert statements_to_order(2) == small_cart
+        assert Product.query.filter(Product.id >= 3, Product.quantity == 8).count() == 30
+
+
+def test_order_stats_maintained_and_rebuilt(app, setup_database):
+    """Test that checkout increments the user's order stats and that they can be rebuilt from the orders."""
+    with app.app_context():
+        # the order made by the fixture predates the stats
+        assert get_order_stats(1) == {'user_id': 1, 'order_count': 0, 'lifetime_spend': 0.0}
+
+        create_order(1)
+        assert get_order_stats(1) == {'user_id': 1, 'order_count': 1, 'lifetime_spend': 125.0}
+
+        db.session.add(Cart(id=2, user_id=1, subtotal=0.0))
+        db.session.add(CartItem(cart_id=2, product_id=1, quantity=3))
+        db.session.commit()
+        create_order(1)
+        assert get_order_stats(1) == {'user_id': 1, 'order_count': 2, 'lifetime_spend': 275.0}
+
+        # a failed checkout isn't counted
+        with pytest.raises(ValueError):
+            create_order(1)
+        assert get_order_stats(1)['order_count'] == 2
+
+        # rebuilding counts every order, including the one made before the stats existed, and
+        # sums the spend from the items (an old order's total was the cart's possibly stale subtotal)
+        db.session.add(UserOrderStats(user_id=2, order_count=4, lifetime_spend=1.0))
+        db.session.get(Order, 1).total = 999.0
+        db.session.commit()
+        assert rebuild_order_stats() == 1
+        assert get_order_stats(1) == {'user_id': 1, 'order_count': 3, 'lifetime_spend': 400.0}
+        assert get_order_stats(2) == {'user_id': 2, 'order_count': 0, 'lifetime_spend': 0.0}
+
+
+def test_create_order_insufficient_stock(app, setup_database):
+    """Test that an order with a product that is short changes nothing."""
+    with app.app_context():
+        CartItem.query.filter_by(cart_id=1, product_id=2).one().quantity = 6
+        db.session.commit()
+
+        with pytest.raises(ValueError, match="Insufficient stock for product Product 2. Available: 5, Requested: 6"):
+            create_order(1)
+
+        assert db.session.get(Product, 1).quantity == 10
+        assert Order.query.count() == 1
+        assert CartItem.query.filter_by(cart_id=1).count() == 2
+
+
+def test_concurrent_orders_never_oversell(tmp_path):
+    """Test that concurrent checkouts of the last units of a product never sell more than the stock."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'orders.db'}"
+    app.config['TESTING'] = True
+    db.init_app(app)
+
+    buyers = 20
+    with app.app_context():
+        db.create_all()
+        db.session.add(Product(id=1, name="Last Units", seller_id=1, price=10.0, gender="Unisex", size="M",
+                               condition="New", quantity=5, youth_size=False, brand="Brand A", sport="Sport A",
+                               date_listed=datetime.utcnow()))
+        for user_id in range(1, buyers + 1):
+            db.session.add(User(id=user_id, name=f"User {user_id}", email=f"user{user_id}@example.com",
+                                profile_pic_url="http://example.com/profile.jpg", admin=False))
+            db.session.add(Cart(id=user_id, user_id=user_id, subtotal=10.0))
+            db.session.add(CartItem(cart_id=user_id, product_id=1, quantity=1))
+        db.session.commit()
+
+    start = threading.Barrier(buyers)
+    results = []
+
+    def checkout(user_id):
+        with app.app_context():
+            start.wait()
+            try:
+                create_order(user_id)
+                results.append('ordered')
+            except ValueError:
+                results.append('out of stock')
+            except Exception as e:
+                results.append(e)
+
+    threads = [threading.Thread(target=checkout, args=(user_id,)) for user_id in range(1, buyers + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(map(str, results)) == ['ordered'] * 5 + ['out of stock'] * 15
+    with app.app_context():
+        assert db.session.get(Product, 1).quantity == 0
+        assert Order.query.count() == 5
+        assert OrderItem.query.count() == 5
+        db.drop_all()
+
+
+def test_create_order_idempotency_key(app, client, setup_database):
+    """Test that retrying an order with the same Idempotency-Key returns the first order."""
+    headers = {'Idempotency-Key': 'checkout-1'}
+    first = client.post('/api/orders/create/1', headers=headers)
+    retry = client.post('/api/orders/create/1', headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    with app.app_context():
+        assert Order.query.filter_by(user_id=1).count() == 2  # the fixture's order and this one
+
+    # the same key with another body is rejected, a new key runs the checkout again
+    assert client.post('/api/orders/create/1', headers=headers, json={'other': True}).status_code == 422
+    assert client.post('/api/orders/create/1', headers={'Idempotency-Key': 'checkout-2'}).status_code == 400
+
+
+def test_idempotency_key_lease(app, setup_database):
+    """Test that a key whose request never finished is freed after a short lease, and a finished one is kept."""
+    with app.app_context():
+        now = datetime.utcnow()
+        lease = timedelta(seconds=Config.IDEMPOTENCY_LEASE_TIMEOUT)
+        assert idempotency_service.claim('POST /pay', 'dead-worker', 'hash', now)
+        assert not idempotency_service.claim('POST /pay', 'dead-worker', 'hash', now + lease / 2)
+        # the first request never completed, so a retry can run once the lease ends
+        assert idempotency_service.claim('POST /pay', 'dead-worker', 'hash', now + lease)
+
+        assert idempotency_service.claim('POST /pay', 'finished', 'hash', now)
+        idempotency_service.complete('POST /pay', 'finished', 200, '{}', 'application/json', now)
+        assert not idempotency_service.claim('POST /pay', 'finished', 'hash', now + lease * 2)
+
+
+def test_payment_transient_error_not_replayed(app, client, monkeypatch):
+    """Test that a payment that failed because Stripe couldn't be reached runs again on retry."""
+    app.register_blueprint(payment_bp)
+    attempts = []
+
+    def create_payment_intent(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise stripe.APIConnectionError("Network error")
+        return SimpleNamespace(client_secret='secret')
+
+    monkeypatch.setattr(stripe.PaymentIntent, 'create', create_payment_intent)
+    headers = {'Idempotency-Key': 'payment-1'}
+    assert client.post('/create-payment-intent', headers=headers, json={'items': []}).status_code == 502
+
+    retry = client.post('/create-payment-intent', headers=headers, json={'items': []})
+    assert retry.status_code == 200
+    assert retry.get_json() == {'clientSecret': 'secret'}
+    assert len(attempts) == 2
+    # Stripe deduplicates the attempts by the same key
+    assert [attempt['idempotency_key'] for attempt in attempts] == ['payment-1', 'payment-1']
+
+
+def test_concurrent_idempotent_orders(tmp_path):
+    """Test that concurrent duplicates of an order wait for the first one instead of racing it."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'orders.db'}"
+    app.config['TESTING'] = True
+    db.init_app(app)
+    app.register_blueprint(order_bp, url_prefix="/api")
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, name="John Doe", email="john@example.com",
+                            profile_pic_url="http://example.com/profile.jpg", admin=False))
+        db.session.add(Product(id=1, name="Product 1", seller_id=1, price=10.0, gender="Unisex", size="M",
+                               condition="New", quantity=5, youth_size=False, brand="Brand A", sport="Sport A",
+                               date_listed=datetime.utcnow()))
+        db.session.add(Cart(id=1, user_id=1, subtotal=10.0))
+        db.session.add(CartItem(cart_id=1, product_id=1, quantity=1))
+        db.session.commit()
+
+    retries = 5
+    start = threading.Barrier(retries)
+    responses = []
+
+    def checkout():
+        client = app.test_client()
+        start.wait()
+        response = client.post('/api/orders/create/1', headers={'Idempotency-Key': 'checkout-1'})
+        responses.append((response.status_code, response.get_json()['order']['id']))
+
+    threads = [threading.Thread(target=checkout) for _ in range(retries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(responses) == retries
+    assert len(set(responses)) == 1 and responses[0][0] == 201
+    with app.app_context():
+        assert Order.query.count() == 1
+        db.drop_all()
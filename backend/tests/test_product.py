@@ -1,12 +1,28 @@
 import pytest
+import json
 from flask import Flask
+from sqlalchemy import inspect
+from werkzeug.datastructures import MultiDict
 from datetime import datetime
 from models import db
 from models.product import Product
 from models.user import User
+from models.schema import upgrade_schema
+from services import reservation_service
+from controllers.product_controller import product_bp
 from services.product_service import (
     get_product_by_id,
+    get_product_dict,
+    clear_caches,
     get_all_products,
+    get_products_page,
+    parse_fields,
+    parse_filters,
+    get_facet_counts,
+    get_featured_snapshot,
+    search_products,
+    rebuild_search_index,
+    LISTING_FIELDS,
     create_product,
     update_product,
     delete_product,
@@ -22,6 +38,8 @@ def app():
     app.config['TESTING'] = True
 
     db.init_app(app)
+    app.register_blueprint(product_bp)
+    clear_caches()
 
     with app.app_context():
         db.create_all()
@@ -137,7 +155,6 @@ def test_create_product(app, client, setup_database):
             image=None,
             date_listed=datetime.utcnow(),
             year_product_made="2023",
-            avg_rating=0.0,
         )
 
         assert new_product is not None
@@ -164,6 +181,15 @@ def test_update_product(app, client, setup_database):
         assert non_existent_update is None
 
 
+def test_update_product_ignores_rating(app, client, setup_database):
+    """Test that the rating of a product can't be set through the update endpoint."""
+    response = client.put('/product/2', json={'name': "Renamed", 'avg_rating': 5.0})
+    assert response.status_code == 200
+    assert response.get_json()['product']['avg_rating'] == 4.0
+    assert response.get_json()['product']['name'] == "Renamed"
+
+
+
 def test_delete_product(app, client, setup_database):
     """Test deleting a product."""
     with app.app_context():
@@ -175,3 +201,406 @@ def test_delete_product(app, client, setup_database):
 
         delete_non_existent = delete_product(999)
         assert delete_non_existent == "Product with this ID not found"
+
+
+def test_get_products_page(app, client, setup_database):
+    """Test walking the catalog page by page with the keyset cursor."""
+    with app.app_context():
+        for i in range(3, 8):
+            db.session.add(Product(
+                id=i,
+                seller_id=1,
+                name=f"Paged Product {i}",
+                price=10.0 * i,
+                gender="Unisex",
+                size="M",
+                youth_size=False,
+                brand="Nike",
+                sport="Running",
+                quantity=1,
+                condition="New",
+                date_listed=datetime(2024, 1, i),
+            ))
+        db.session.commit()
+
+        seen = []
+        products, cursor = get_products_page(limit=3)
+        seen.extend(product.id for product in products)
+        while cursor:
+            products, cursor = get_products_page(limit=3, cursor=cursor)
+            assert len(products) <= 3
+            seen.extend(product.id for product in products)
+
+        # newest first, every product exactly once
+        assert len(seen) == 7
+        assert len(set(seen)) == 7
+        assert seen[-5:] == [7, 6, 5, 4, 3]
+
+        with pytest.raises(ValueError):
+            get_products_page(limit=3, cursor="not-a-cursor")
+
+
+def test_sparse_fieldsets(app, client, setup_database):
+    """Test that only the columns of the requested fields are loaded and serialized."""
+    with app.app_context():
+        fields = parse_fields("name,price")
+        product = get_product_by_id(1, fields)
+
+        assert product.to_dict(fields) == {'name': "Sample Product 1", 'price': 100.0}
+        assert 'description' in inspect(product).unloaded
+        assert 'image' in inspect(product).unloaded
+
+        # listings leave out the description unless it's asked for
+        products, _ = get_products_page(limit=10)
+        assert all('description' in inspect(p).unloaded for p in products)
+        assert 'description' not in products[0].to_dict(LISTING_FIELDS)
+
+        assert parse_fields(None, LISTING_FIELDS) == LISTING_FIELDS
+        with pytest.raises(ValueError):
+            parse_fields("name,password")
+
+
+def test_filters_and_facets(app, client, setup_database):
+    """Test filtering the catalog and counting the products per facet value."""
+    with app.app_context():
+        filters = parse_filters(MultiDict([('brand', 'Nike'), ('brand', 'Puma'), ('featured', 'true')]))
+        assert filters == {'brand': ['Nike', 'Puma'], 'featured': [True]}
+
+        products, _ = get_products_page(limit=10, filters=filters)
+        assert [product.id for product in products] == [1]
+
+        products, _ = get_products_page(limit=10, filters=parse_filters(MultiDict({'price_min': '150'})))
+        assert [product.id for product in products] == [2]
+
+        facets = get_facet_counts({'brand': ['Nike']})
+        # a facet ignores its own filter so the other brands stay selectable
+        assert {facet['value']: facet['count'] for facet in facets['brand']} == {'Nike': 1, 'Adidas': 1}
+        assert facets['sport'] == [{'value': 'Running', 'count': 1}]
+        assert facets['youth_size'] == [{'value': False, 'count': 1}]
+
+        with pytest.raises(ValueError):
+            parse_filters(MultiDict({'featured': 'maybe'}))
+        with pytest.raises(ValueError):
+            parse_filters(MultiDict({'price_max': 'cheap'}))
+
+
+def test_search_products(app, client, setup_database):
+    """Test that full-text search is ranked, highlighted and kept in sync with product writes."""
+    with app.app_context():
+        results, next_cursor = search_products("nike")
+        assert [result['id'] for result in results] == [1]
+        assert next_cursor is None
+
+        # prefix matching and every word must match
+        results, _ = search_products("grea prod")
+        assert {result['id'] for result in results} == {1, 2}
+        assert '<mark>' in results[0]['snippet']
+
+        update_product(product_id=2, name="Hockey <Stick>")
+        results, _ = search_products("stick")
+        assert [result['id'] for result in results] == [2]
+        assert '&lt;' in results[0]['snippet']
+
+        delete_product(2)
+        assert search_products("stick")[0] == []
+
+        # rebuilding leaves the index equivalent
+        rebuild_search_index()
+        assert [result['id'] for result in search_products("nike")[0]] == [1]
+
+        results, next_cursor = search_products("product", limit=1)
+        assert len(results) == 1 and next_cursor is None
+
+        with pytest.raises(ValueError):
+            search_products("  !! ")
+
+
+def test_product_cache_invalidation(app, client, setup_database):
+    """Test that cached products are dropped when the product is written."""
+    with app.app_context():
+        assert get_product_dict(1, ['name'])['name'] == "Sample Product 1"
+
+        # a write that bypasses the service isn't seen until the entry is invalidated
+        db.session.execute(db.update(Product).where(Product.id == 1).values(name="Renamed Directly"))
+        db.session.commit()
+        assert get_product_dict(1, ['name'])['name'] == "Sample Product 1"
+
+        update_product(product_id=1, price=99.0)
+        assert get_product_dict(1, ['name'])['name'] == "Renamed Directly"
+        assert get_product_dict(1)['price'] == 99.0
+
+
+def test_conditional_get(app, client, setup_database):
+    """Test that unchanged products are revalidated with 304 and changed ones are sent again."""
+    response = client.get('/product/1')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    assert client.get('/product/1', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/product/1', headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+
+    listing = client.get('/products')
+    assert listing.status_code == 200
+    listing_etag = listing.headers['ETag']
+    assert client.get('/products', headers={'If-None-Match': listing_etag}).status_code == 304
+    # another page or filter is another representation
+    assert client.get('/products?limit=1', headers={'If-None-Match': listing_etag}).status_code == 200
+
+    with app.app_context():
+        update_product(product_id=1, price=80.0)
+
+    changed = client.get('/product/1', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()['product']['price'] == 80.0
+    assert changed.headers['ETag'] != etag
+
+    assert client.get('/products', headers={'If-None-Match': listing_etag}).status_code == 200
+
+    # the facets of a filtered first page count products outside the filter too
+    filtered_etag = client.get('/products?brand=Nike').headers['ETag']
+    assert client.get('/products?brand=Nike', headers={'If-None-Match': filtered_etag}).status_code == 304
+    with app.app_context():
+        update_product(product_id=2, brand="Puma")
+    refetched = client.get('/products?brand=Nike', headers={'If-None-Match': filtered_etag})
+    assert refetched.status_code == 200
+    assert {facet['value'] for facet in refetched.get_json()['facets']['brand']} == {'Nike', 'Puma'}
+
+    # holding and releasing stock doesn't change the products' representations
+    etag = client.get('/product/1').headers['ETag']
+    listing_etag = client.get('/products').headers['ETag']
+    with app.app_context():
+        reservation_service.hold_items(1, {1: 1})
+        db.session.commit()
+        reservation_service.release_cart_holds(1)
+        db.session.commit()
+    assert client.get('/product/1', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/products', headers={'If-None-Match': listing_etag}).status_code == 304
+
+
+def test_stream_products(app, client, setup_database):
+    """Test streaming the whole (filtered) catalog."""
+    response = client.get('/products?stream=true&fields=id,name')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.get_json() == {'products': [
+        {'id': 2, 'name': "Sample Product 2"},
+        {'id': 1, 'name': "Sample Product 1"},
+    ]}
+
+    filtered = client.get('/products?stream=1&brand=Nike&fields=id')
+    assert filtered.get_json() == {'products': [{'id': 1}]}
+
+
+def test_import_products(app, client, setup_database, tmp_path):
+    """Test bulk importing products from NDJSON and CSV with a per row error report."""
+    app.config['IMAGE_STORE_PATH'] = str(tmp_path)
+    image = "data:image/png;base64,iVBORw0KGgo="
+    row = {
+        'seller_id': 1, 'name': "Imported", 'price': 25.0, 'gender': "Unisex", 'size': "M",
+        'brand': "Bauer", 'sport': "Hockey", 'quantity': 3, 'condition': "New", 'image': image,
+    }
+    ndjson = "\n".join([
+        json.dumps(row),
+        json.dumps({**row, 'name': "Imported 2", 'featured': True, 'avg_rating': 5.0}),
+        "{not json",
+        json.dumps({**row, 'image': None}),
+        json.dumps({**row, 'price': "free"}),
+        "",
+        json.dumps({**row, 'name': "Imported 3"}),
+    ])
+
+    response = client.post('/products/import?batch_size=2', data=ndjson, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report['imported'] == 3
+    assert report['errors'] == [
+        {'row': 3, 'error': "Invalid JSON"},
+        {'row': 4, 'error': "Image data is missing"},
+        {'row': 5, 'error': "Invalid field value"},
+    ]
+
+    csv_body = (
+        "seller_id,name,price,gender,size,brand,sport,quantity,condition,youth_size,image\n"
+        f"2,CSV Skates,80,Male,9,CCM,Hockey,2,Used,true,\"{image}\"\n"
+        f"2,,80,Male,9,CCM,Hockey,2,Used,false,\"{image}\"\n"
+    )
+    response = client.post('/products/import', data=csv_body, content_type='text/csv')
+    report = response.get_json()
+    assert report['imported'] == 1
+    assert report['errors'] == [{'row': 2, 'error': "Missing required fields"}]
+
+    with app.app_context():
+        skates = Product.query.filter_by(name="CSV Skates").one()
+        assert skates.youth_size is True
+        assert skates.price == 80.0
+        assert skates.image_hash is not None
+        # ratings only come from reviews
+        assert Product.query.filter_by(name="Imported 2").one().avg_rating == 0.0
+        assert Product.query.count() == 6
+        assert [result['id'] for result in search_products("skates")[0]] == [skates.id]
+
+
+def test_bulk_update_products(app, client, setup_database):
+    """Test updating many products at once by ids and by filter."""
+    with app.app_context():
+        assert get_product_dict(1)['price'] == 100.0
+
+    response = client.patch('/products', json={'ids': [1, 2, 99], 'set': {'price': 15.5, 'featured': False}})
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 2
+
+    with app.app_context():
+        # the cached product was invalidated
+        assert get_product_dict(1)['price'] == 15.5
+        assert get_product_dict(2)['featured'] is False
+        assert db.session.get(Product, 1).version == 2
+
+    response = client.patch('/products', json={'filter': {'sport': ['Football'], 'youth_size': True}, 'set': {'quantity': 0}})
+    assert response.get_json()['updated'] == 1
+
+    with app.app_context():
+        assert get_product_dict(2)['quantity'] == 0
+        assert get_product_dict(1)['quantity'] == 10
+
+    # stock can't be set below the units held by carts
+    with app.app_context():
+        reservation_service.hold_items(1, {1: 4})
+        db.session.commit()
+    response = client.patch('/products', json={'ids': [1, 2], 'set': {'quantity': 3}})
+    assert (response.get_json()['updated'], response.get_json()['skipped']) == (1, [1])
+    response = client.patch('/products', json={'filter': {'brand': 'Nike'}, 'set': {'quantity': 2}})
+    assert (response.get_json()['updated'], response.get_json()['skipped']) == (0, [1])
+    response = client.patch('/products', json={'filter': {'brand': 'Nike'}, 'set': {'quantity': 4}})
+    assert (response.get_json()['updated'], response.get_json()['skipped']) == (1, [])
+
+    with app.app_context():
+        assert get_product_dict(1)['quantity'] == 4
+        assert get_product_dict(2)['quantity'] == 3
+
+    bad_requests = [
+        {'ids': [1], 'set': {'name': "Renamed"}},
+        {'ids': [1], 'set': {'price': -1}},
+        {'ids': [1], 'filter': {'sport': 'Football'}, 'set': {'price': 1}},
+        {'filter': {}, 'set': {'price': 1}},
+        {'filter': {'color': 'red'}, 'set': {'price': 1}},
+        {'ids': [1], 'set': {}},
+    ]
+    for body in bad_requests:
+        assert client.patch('/products', json=body).status_code == 400
+
+
+def test_featured_products(app, client, setup_database):
+    """Test the featured products snapshot and when it's rebuilt."""
+    response = client.get('/products/featured')
+    assert response.status_code == 200
+    assert [product['id'] for product in response.get_json()['products']] == [1]
+    assert 'description' not in response.get_json()['products'][0]
+
+    assert client.get('/products/featured', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    with app.app_context():
+        version = get_featured_snapshot().version
+
+        # changes that can't affect the featured products keep the snapshot
+        update_product(product_id=2, price=150.0)
+        assert get_featured_snapshot().version == version
+
+        # a price change of a featured product rebuilds it
+        update_product(product_id=1, price=90.0)
+        assert get_featured_snapshot().version > version
+
+    client.patch('/products', json={'ids': [2], 'set': {'featured': True}})
+    response = client.get('/products/featured', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    assert [product['id'] for product in response.get_json()['products']] == [2, 1]
+
+    # sold out products aren't featured
+    client.patch('/products', json={'ids': [1], 'set': {'quantity': 0}})
+    assert [product['id'] for product in client.get('/products/featured').get_json()['products']] == [2]
+
+
+def test_top_rated_sort(app, client, setup_database):
+    """Test sorting the catalog by average rating and filtering on a minimum rating."""
+    first_page = client.get('/products?sort=top_rated&limit=1').get_json()
+    assert [product['id'] for product in first_page['products']] == [1]
+
+    second_page = client.get(f"/products?sort=top_rated&limit=1&cursor={first_page['next_cursor']}").get_json()
+    assert [product['id'] for product in second_page['products']] == [2]
+    assert second_page['next_cursor'] is None
+
+    filtered = client.get('/products?rating_min=4.2').get_json()
+    assert [product['id'] for product in filtered['products']] == [1]
+
+    assert client.get('/products?sort=cheapest').status_code == 400
+
+
+# the product table as databases created before the schema upgrades have it
+LEGACY_PRODUCT_DDL = """CREATE TABLE product (
+    id INTEGER NOT NULL PRIMARY KEY,
+    seller_id INTEGER NOT NULL REFERENCES user (id),
+    name VARCHAR(50) NOT NULL,
+    description VARCHAR(300),
+    price FLOAT NOT NULL,
+    gender VARCHAR(30) NOT NULL,
+    size VARCHAR(30) NOT NULL,
+    youth_size BOOLEAN NOT NULL,
+    featured BOOLEAN NOT NULL,
+    brand VARCHAR(30) NOT NULL,
+    sport VARCHAR(30) NOT NULL,
+    quantity INTEGER NOT NULL,
+    condition VARCHAR(30) NOT NULL,
+    image BLOB,
+    date_listed DATE NOT NULL,
+    year_product_made VARCHAR(4),
+    avg_rating FLOAT
+)"""
+
+
+def test_upgrade_legacy_schema():
+    """Test that the columns, indexes and search index added to the product table are added to an existing database."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['TESTING'] = True
+    db.init_app(app)
+
+    with app.app_context():
+        db.session.execute(db.text(LEGACY_PRODUCT_DDL))
+        db.session.execute(db.text(
+            "INSERT INTO product VALUES (1, 1, 'Old Product', NULL, 10.0, 'Unisex', 'M', 0, 0, "
+            "'Nike', 'Running', 3, 'New', NULL, '2024-01-01', NULL, 0.0)"
+        ))
+        db.session.commit()
+        db.create_all()
+        for rating in (3.0, 5.0):
+            db.session.execute(db.text(
+                "INSERT INTO review (reviewer_id, product_id, rating, explanation, review_date) "
+                "VALUES (1, 1, :rating, '', '2024-01-02 00:00:00.000000')"
+            ), {'rating': rating})
+        db.session.commit()
+
+        assert {'product.image_hash', 'product.version', 'product.updated_at',
+                'product.rating_count', 'product.rating_sum', 'product.reserved_quantity',
+                'product_fts'} <= set(upgrade_schema())
+        # nothing left to upgrade
+        assert upgrade_schema() == []
+
+        inspector = inspect(db.engine)
+        assert {'image_hash', 'version', 'updated_at'} <= {column['name'] for column in inspector.get_columns('product')}
+        assert {'ix_product_image_hash', 'ix_product_updated_at'} <= {index['name'] for index in inspector.get_indexes('product')}
+
+        version, updated_at = db.session.execute(db.text("SELECT version, updated_at FROM product")).one()
+        assert version == 1
+        assert updated_at.startswith(str(datetime.utcnow().year))
+        # the ratings of existing products are counted from their reviews
+        assert db.session.execute(db.text("SELECT rating_count, rating_sum, avg_rating FROM product")).one() == (2, 8.0, 4.0)
+
+        # every column of the model exists, so products can be read again
+        assert {column.name for column in Product.__table__.columns} <= {column['name'] for column in inspector.get_columns('product')}
+        product = db.session.get(Product, 1)
+        assert (product.name, product.reserved_quantity, product.version) == ("Old Product", 0, 1)
+
+        # the existing products can be searched
+        results, _ = search_products("old", 10, None, ['id', 'name'])
+        assert [result['id'] for result in results] == [1]
+        db.drop_all()
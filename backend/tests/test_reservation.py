@@ -0,0 +1,177 @@
+import pytest
+from flask import Flask
+from datetime import datetime, timedelta
+from models import db
+from models.user import User
+from models.product import Product
+from models.cart import Cart
+from models.cart_item import CartItem
+from models.reservation import Reservation
+from services import reservation_service
+from services.cart_item_service import CartItemService
+from services.cart_service import CartService
+from services.cart_store import MemoryCartStore, set_cart_store
+from services.order_service import create_order
+
+
+@pytest.fixture
+def app():
+    """Fixture to create a Flask application for testing."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TESTING'] = True
+
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def setup_database(app):
+    """Fixture to populate the database with two users and a product with 3 units in stock."""
+    with app.app_context():
+        for user_id in (1, 2):
+            db.session.add(User(id=user_id, name=f"User {user_id}", email=f"user{user_id}@example.com",
+                                profile_pic_url="http://example.com/profile.jpg", admin=False))
+        db.session.add(Product(id=1, name="Product 1", seller_id=1, price=20.0, gender="Unisex", size="M",
+                               condition="New", quantity=3, youth_size=False, brand="Brand A", sport="Sport A",
+                               date_listed=datetime.utcnow()))
+        db.session.commit()
+
+
+def test_cart_holds_stock(app, setup_database):
+    """Test that adding to a cart holds stock that other carts can't take until the hold expires."""
+    with app.app_context():
+        CartItemService.add_item_to_cart(1, 1, 2)
+        assert db.session.get(Product, 1).reserved_quantity == 2
+
+        with pytest.raises(ValueError, match="Only 1 units of Product 1 are available."):
+            CartItemService.add_item_to_cart(2, 1, 2)
+        assert db.session.get(Product, 1).reserved_quantity == 2
+
+        # nothing expires yet
+        assert reservation_service.release_expired_holds() == 0
+
+        later = datetime.utcnow() + timedelta(days=1)
+        assert reservation_service.release_expired_holds(now=later) == 1
+        db.session.expire_all()
+        assert db.session.get(Product, 1).reserved_quantity == 0
+        assert Reservation.query.count() == 0
+
+        CartItemService.add_item_to_cart(2, 1, 2)
+        assert db.session.get(Product, 1).reserved_quantity == 2
+
+
+def test_cart_changes_adjust_holds(app, setup_database):
+    """Test that changing and removing cart items changes the cart's hold."""
+    with app.app_context():
+        cart = CartItemService.add_item_to_cart(1, 1, 1)
+        item = CartItem.query.filter_by(cart_id=cart.id).one()
+
+        CartItemService.update_item_and_cart(cart.id, item.id, 3)
+        assert db.session.get(Product, 1).reserved_quantity == 3
+
+        CartItemService.apply_cart_operations(cart.id, [('set', 1, 2)])
+        assert db.session.get(Product, 1).reserved_quantity == 2
+
+        CartItemService.remove_item_from_cart(cart.id, item.id)
+        assert db.session.get(Product, 1).reserved_quantity == 0
+        assert Reservation.query.count() == 0
+
+        CartItemService.add_item_to_cart(1, 1, 1)
+        CartItem.query.filter_by(cart_id=cart.id).delete()
+        assert CartService.delete_cart(cart.id)
+        assert db.session.get(Product, 1).reserved_quantity == 0
+
+
+def test_negative_quantities_rejected(app, setup_database):
+    """Test that a negative cart quantity can't release stock held for other carts."""
+    with app.app_context():
+        cart = CartItemService.add_item_to_cart(1, 1, 1)
+        item = CartItem.query.filter_by(cart_id=cart.id).one()
+
+        with pytest.raises(ValueError):
+            CartItemService.update_item_and_cart(cart.id, item.id, -5)
+        with pytest.raises(ValueError):
+            CartItemService.add_item_to_cart(1, 1, -5)
+        with pytest.raises(ValueError):
+            reservation_service.hold_items(cart.id, {1: -5})
+        db.session.rollback()
+
+        assert db.session.get(Product, 1).reserved_quantity == 1
+        assert (item.quantity, Reservation.query.one().quantity) == (1, 1)
+
+
+def test_order_sells_held_stock(app, setup_database):
+    """Test that checkout turns a cart's holds into the sale and respects other carts' holds."""
+    with app.app_context():
+        CartItemService.add_item_to_cart(1, 1, 2)
+
+        # a cart whose items were never held can only buy unreserved stock
+        db.session.add(Cart(id=2, user_id=2, subtotal=40.0))
+        db.session.add(CartItem(cart_id=2, product_id=1, quantity=2))
+        db.session.commit()
+        with pytest.raises(ValueError, match="Available: 1, Requested: 2"):
+            create_order(2)
+
+        order = create_order(1)
+        assert order.total == 40.0
+        product = db.session.get(Product, 1)
+        assert (product.quantity, product.reserved_quantity) == (1, 0)
+        assert Reservation.query.count() == 0
+
+
+def test_holds_on_removed_products_released(app, setup_database):
+    """Test that holds on products taken out of a cart are released, not leaked, by checkout
+    and by a write-behind cart store."""
+    with app.app_context():
+        db.session.add(Product(id=2, name="Product 2", seller_id=1, price=10.0, gender="Unisex", size="M",
+                               condition="New", quantity=5, youth_size=False, brand="Brand B", sport="Sport B",
+                               date_listed=datetime.utcnow()))
+        db.session.commit()
+        cart = CartItemService.add_item_to_cart(1, 1, 1)
+
+        # a hold the cart has no item for (e.g. left by a write-behind cart)
+        reservation_service.hold_items(cart.id, {2: 1})
+        db.session.commit()
+
+        create_order(1)
+        db.session.expire_all()
+        assert db.session.get(Product, 2).reserved_quantity == 0
+        assert Reservation.query.count() == 0
+
+        previous = set_cart_store(MemoryCartStore())
+        try:
+            cart = CartItemService.add_item_to_cart(1, 1, 1)
+            CartItemService.add_item_to_cart(1, 2, 1)
+            assert reservation_service.hold_user_cart(1)
+            assert db.session.get(Product, 2).reserved_quantity == 1
+
+            CartItemService.remove_item_from_cart(cart.id, cart.item_of_product(2))
+            db.session.expire_all()
+            assert db.session.get(Product, 2).reserved_quantity == 0
+
+            create_order(1)
+            db.session.expire_all()
+            assert [(product.quantity, product.reserved_quantity) for product in Product.query.order_by(Product.id)] == [(1, 0), (5, 0)]
+            assert Reservation.query.count() == 0
+        finally:
+            set_cart_store(previous)
+
+
+def test_hold_user_cart_extends_holds(app, setup_database):
+    """Test that starting a payment holds everything in the cart and extends the holds."""
+    with app.app_context():
+        CartItemService.add_item_to_cart(1, 1, 1)
+        expires_at = Reservation.query.one().expires_at
+
+        assert reservation_service.hold_user_cart(1, now=datetime.utcnow() + timedelta(minutes=5))
+        assert Reservation.query.one().expires_at > expires_at
+        assert db.session.get(Product, 1).reserved_quantity == 1
+
+        assert not reservation_service.hold_user_cart(2)
@@ -1,7 +1,16 @@
 import pytest
 from flask import Flask
+from datetime import datetime
 from unittest.mock import patch, MagicMock
+from sqlalchemy import event
+from models import db
+from models.product import Product
+from models.review import Review
+from models.review_summary import ReviewSummary
+from models.user import User
 from controllers.review_controller import review_blueprint
+from services import review_service
+from services.product_service import clear_caches
 
 
 @pytest.fixture
@@ -22,6 +31,32 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def db_app():
+    """Fixture to create a Flask application with a database of two products."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TESTING'] = True
+
+    db.init_app(app)
+    app.register_blueprint(review_blueprint)
+    clear_caches()
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, name="John Doe", email="john@example.com",
+                            profile_pic_url="http://example.com/profile.jpg", admin=False))
+        for product_id in (1, 2):
+            db.session.add(Product(id=product_id, seller_id=1, name=f"Product {product_id}", price=10.0,
+                                   gender="Unisex", size="M", youth_size=False, brand="Nike",
+                                   sport="Running", condition="New", date_listed=datetime.utcnow()))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
 def test_create_review(client):
     """Test creating a new review."""
     payload = {
@@ -52,20 +87,24 @@ def test_retrieve_reviews(client):
 
     # Patch the location where `get_reviews_by_product` is imported in `review_controller`
     with patch("controllers.review_controller.get_reviews_by_product") as mock_get_reviews:
-        mock_get_reviews.return_value = [
-            {
-                'review_id': 1,
-                'reviewer_id': 2,
-                'rating': 4.5,
-                'explanation': 'Great product!',
-            },
-            {
-                'review_id': 2,
-                'reviewer_id': 3,
-                'rating': 3.0,
-                'explanation': 'Good but could be better.',
-            },
-        ]
+        mock_get_reviews.return_value = {
+            'product': {'id': product_id, 'name': 'Skates', 'seller_id': 5, 'seller_name': 'Jane Doe'},
+            'reviews': [
+                {
+                    'id': 1,
+                    'reviewer_id': 2,
+                    'rating': 4.5,
+                    'explanation': 'Great product!',
+                },
+                {
+                    'id': 2,
+                    'reviewer_id': 3,
+                    'rating': 3.0,
+                    'explanation': 'Good but could be better.',
+                },
+            ],
+            'next_cursor': None,
+        }
 
         response = client.get(f'/reviews/product/{product_id}')
 
@@ -73,8 +112,9 @@ def test_retrieve_reviews(client):
     assert response.status_code == 200, f"Error: {response.get_json()}"
     data = response.get_json()
     assert len(data['reviews']) == 2
-    assert data['reviews'][0]['review_id'] == 1
+    assert data['reviews'][0]['id'] == 1
     assert data['reviews'][1]['rating'] == 3.0
+    assert data['product']['seller_name'] == 'Jane Doe'
 
 
 def test_delete_review(client):
@@ -91,3 +131,122 @@ def test_delete_review(client):
     assert response.status_code == 200, f"Error: {response.get_json()}"
     data = response.get_json()
     assert data['message'] == 'Review deleted successfully'
+
+
+def test_rating_aggregates(db_app):
+    """Test that adding and deleting reviews keeps the product's rating up to date."""
+    first = review_service.add_review(2, 1, 5.0, "Great")
+    review_service.add_review(3, 1, 4.0, "Good")
+    review_service.add_review(3, 1, 3.0, "Okay")
+
+    product = db.session.get(Product, 1)
+    assert (product.rating_count, product.rating_sum, product.avg_rating) == (3, 12.0, 4.0)
+    assert product.version == 4
+
+    assert review_service.delete_review(first.id)
+    product = db.session.get(Product, 1)
+    assert (product.rating_count, product.rating_sum, product.avg_rating) == (2, 7.0, 3.5)
+
+    # reviews of missing products aren't created
+    assert review_service.add_review(2, 99, 5.0, "Ghost") is None
+    assert Review.query.filter_by(product_id=99).count() == 0
+
+
+def test_repair_rating_aggregates(db_app):
+    """Test recomputing the ratings of products from their reviews."""
+    # reviews written before the aggregates existed
+    for rating in (2.0, 4.0):
+        db.session.add(Review(reviewer_id=1, product_id=2, rating=rating, explanation="", review_date=datetime.utcnow()))
+    db.session.execute(db.update(Product).where(Product.id == 1).values(rating_count=5, avg_rating=None))
+    db.session.commit()
+
+    assert review_service.repair_rating_aggregates() == 2
+
+    assert [(product.rating_count, product.avg_rating) for product in Product.query.order_by(Product.id)] == [(0, 0.0), (2, 3.0)]
+
+    # nothing left to repair
+    assert review_service.repair_rating_aggregates() == 0
+
+
+def test_reviews_page(db_app):
+    """Test paging through a product's reviews in each sort order with a fixed number of queries."""
+    client = db_app.test_client()
+    for reviewer_id, rating in ((2, 3.0), (3, 5.0), (4, 1.0), (5, 4.0)):
+        db.session.add(User(id=reviewer_id, name=f"Reviewer {reviewer_id}", email=f"r{reviewer_id}@example.com",
+                            profile_pic_url="", admin=False))
+        review_service.add_review(reviewer_id, 1, rating, "text")
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    response = client.get('/reviews/product/1?limit=3')
+    event.remove(db.engine, 'before_cursor_execute', count_statement)
+    assert len(statements) == 2
+
+    data = response.get_json()
+    assert data['product'] == {'id': 1, 'name': "Product 1", 'seller_id': 1, 'seller_name': "John Doe"}
+    assert [review['reviewer_name'] for review in data['reviews']] == ["Reviewer 5", "Reviewer 4", "Reviewer 3"]
+
+    rest = client.get(f"/reviews/product/1?limit=3&cursor={data['next_cursor']}").get_json()
+    assert [review['reviewer_id'] for review in rest['reviews']] == [2]
+    assert rest['next_cursor'] is None
+
+    highest = client.get('/reviews/product/1?sort=highest').get_json()
+    assert [review['rating'] for review in highest['reviews']] == [5.0, 4.0, 3.0, 1.0]
+
+    lowest = client.get('/reviews/product/1?sort=lowest&limit=2').get_json()
+    lowest_rest = client.get(f"/reviews/product/1?sort=lowest&cursor={lowest['next_cursor']}").get_json()
+    assert [review['rating'] for review in lowest['reviews'] + lowest_rest['reviews']] == [1.0, 3.0, 4.0, 5.0]
+
+    assert client.get('/reviews/product/2').get_json()['message'] == 'No reviews yet for this product'
+    assert client.get('/reviews/product/99').status_code == 404
+    assert client.get('/reviews/product/1?sort=best').status_code == 400
+
+
+def test_review_summary(db_app):
+    """Test the rating summary kept up to date as reviews are added and deleted."""
+    client = db_app.test_client()
+    for rating in (5.0, 4.5, 4.0, 1.0):
+        review_service.add_review(1, 1, rating, "text")
+    review = review_service.add_review(1, 1, 2.0, "text")
+    review_service.delete_review(review.id)
+
+    summary = client.get('/reviews/product/1/summary').get_json()['summary']
+    assert summary == {
+        'product_id': 1,
+        'count': 4,
+        'average': 3.62,
+        'histogram': {'1': 1, '2': 0, '3': 0, '4': 1, '5': 2},
+    }
+
+    # products without reviews have an empty summary
+    empty = client.get('/reviews/product/2/summary').get_json()['summary']
+    assert empty['count'] == 0 and empty['average'] == 0.0 and set(empty['histogram'].values()) == {0}
+
+    # the summaries can be rebuilt from the reviews
+    db.session.execute(db.delete(ReviewSummary))
+    db.session.commit()
+    review_service.repair_rating_aggregates()
+    assert client.get('/reviews/product/1/summary').get_json()['summary'] == summary
+
+
+def test_review_summaries_batch(db_app):
+    """Test getting the review summaries of many products in one request."""
+    client = db_app.test_client()
+    review_service.add_review(1, 2, 4.0, "text")
+    review_service.add_review(1, 2, 5.0, "text")
+
+    response = client.get('/reviews/summary?product_ids=2,1,99')
+    assert response.status_code == 200
+    summaries = response.get_json()['summaries']
+    assert [(summary['product_id'], summary['count'], summary['average']) for summary in summaries] == [
+        (2, 2, 4.5), (1, 0, 0.0), (99, 0, 0.0),
+    ]
+
+    assert client.get('/reviews/summary').status_code == 400
+    assert client.get('/reviews/summary?product_ids=1,x').status_code == 400
+    too_many = ','.join(str(product_id) for product_id in range(1, review_service.MAX_SUMMARY_BATCH_SIZE + 2))
+    assert client.get(f'/reviews/summary?product_ids={too_many}').status_code == 400
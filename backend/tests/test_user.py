@@ -2,6 +2,8 @@ import pytest
 from flask import Flask
 from models import db
 from models.user import User
+from models.user_order_stats import UserOrderStats
+from sqlalchemy import event
 from controllers.user_controller import user_blueprint
 
 
@@ -85,3 +87,33 @@ def test_get_user_by_email(client, sample_user):
     assert data['email'] == sample_user.email
     assert data['name'] == sample_user.name
     assert data['profile_pic_url'] == sample_user.profile_pic_url
+
+
+def test_get_user_order_stats(app, client, sample_user):
+    """Test fetching a user's order count and lifetime spend in one query."""
+    url = f'/users/{sample_user.id}/order-stats'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'user_id': sample_user.id, 'order_count': 0, 'lifetime_spend': 0.0,
+    }
+
+    with app.app_context():
+        db.session.add(UserOrderStats(
+            user_id=sample_user.id, order_count=3, lifetime_spend=210.5,
+        ))
+        db.session.commit()
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        response = client.get(url)
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    assert response.get_json() == {
+        'user_id': sample_user.id, 'order_count': 3, 'lifetime_spend': 210.5,
+    }
+    assert len(statements) == 1
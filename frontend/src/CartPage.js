@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate, useLocation } from 'react-router-dom';
 import { FRONTEND_BASE_URL, BACKEND_BASE_URL } from './constants';
 import { checkLoginStatus, get_user_info, redirectTo } from './services/authService';
@@ -48,6 +48,7 @@ function CartPage({ cart }) {
           if (response.ok) {
             const cartData = await response.json();
             console.log(cartData);
+            savedCart.current = cartData.items;
             setLocalCart(cartData.items);
             setCardId(cartData.id)
           } else {
@@ -67,26 +68,38 @@ function CartPage({ cart }) {
     subtotal = localCart.reduce((acc, item) => acc + parseFloat(item.product_price || 0) * item.quantity, 0);
   }
 
-  // Function to update quantity
-  const updateQuantityInDB = async (itemId, newQuantity) => {
+  // Quantity edits are saved together once the user stops clicking, in one request
+  const pendingQuantities = useRef({});
+  const flushTimer = useRef(null);
+  const savedCart = useRef([]);
+
+  const flushQuantities = async () => {
+    const operations = Object.entries(pendingQuantities.current).map(([productId, quantity]) => ({
+      op: 'set',
+      product_id: Number(productId),
+      quantity,
+    }));
+    pendingQuantities.current = {};
+    if (operations.length === 0) {
+      return;
+    }
+
     try {
-      const response = await fetch(`${BACKEND_BASE_URL}/cart/${cartId}`, {
-        method: 'PUT',
+      const response = await fetch(`${BACKEND_BASE_URL}/cart/${cartId}/items`, {
+        method: 'PATCH',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
-          product_id: itemId,
-          quantity: newQuantity,
-          subtotal: subtotal
-        }),
+        body: JSON.stringify({ operations }),
       });
       if (response.ok) {
         const updatedCart = await response.json();
         console.log(updatedCart);
+        savedCart.current = updatedCart.items;
         setLocalCart(updatedCart.items);
       } else {
         console.error('Failed to update quantity:', response.statusText);
+        setLocalCart(savedCart.current);
         alert("Cannot increase quantity since there isn't enough of the product, to add more to cart");
       }
     } catch (error) {
@@ -97,7 +110,14 @@ function CartPage({ cart }) {
   const handleQuantityChange = (itemId, change) => {
     const item = localCart.find(item => item.product_id === itemId);
     const newQuantity = Math.max(item.quantity + change, 1); 
-    updateQuantityInDB(itemId, newQuantity);
+
+    // show the new quantity now and save it with the other edits
+    setLocalCart(localCart.map(cartItem => (
+      cartItem.product_id === itemId ? { ...cartItem, quantity: newQuantity } : cartItem
+    )));
+    pendingQuantities.current[itemId] = newQuantity;
+    clearTimeout(flushTimer.current);
+    flushTimer.current = setTimeout(flushQuantities, 500);
   };
 
   // Function to remove item from cart
@@ -115,6 +135,7 @@ function CartPage({ cart }) {
       if (response.ok) {
         const updatedCart = await response.json();
         console.log(updatedCart);
+        savedCart.current = updatedCart.items;
         setLocalCart(updatedCart.items);
         alert('Product(s) removed from cart successfully');
       } else {
@@ -193,7 +214,7 @@ function CartPage({ cart }) {
 
               <div style={{ display: 'flex', alignItems: 'center', marginLeft: '10px', marginRight: '5%' }}>
                 <button 
-                  onClick={() => handleRemoveItem(item.product_id)} 
+                  onClick={() => handleRemoveItem(item.id)} 
                   style={{ background: 'red', color: 'white', padding: '10px 15px 10px 15px', borderRadius: '50%', cursor: 'pointer', fontSize: 'x-large' }}
                 >
                   X
@@ -1,10 +1,65 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
+import { Link } from 'react-router-dom';
+import { BACKEND_BASE_URL } from './constants';
 
 function HomePage() {
+  const [featuredProducts, setFeaturedProducts] = useState([]);
+
+  useEffect(() => {
+    const fetchFeaturedProducts = async () => {
+      try {
+        const response = await fetch(`${BACKEND_BASE_URL}/products/featured`);
+        if (!response.ok) {
+          throw new Error('Failed to fetch featured products');
+        }
+
+        const data = await response.json();
+        setFeaturedProducts(data.products);
+      } catch (err) {
+        console.error(err.message);
+      }
+    };
+
+    fetchFeaturedProducts();
+  }, []); // Run once when the component mounts
+
   return (
     <div>
       <h2>Explore our range of sports equipment to find what suits your needs!</h2>
-      {}
+      {featuredProducts.length > 0 && (
+        <div style={{ maxWidth: '800px', margin: '20px auto' }}>
+          <h3>Featured</h3>
+          {featuredProducts.map((prod) => (
+            <div
+              key={prod.id}
+              style={{
+                border: '1px solid #ddd',
+                padding: '15px',
+                marginBottom: '15px',
+                borderRadius: '8px',
+                backgroundColor: '#fffacd', // Light gold like featured products in the product list
+              }}
+            >
+              <p>
+                <strong>{prod.name}</strong>
+              </p>
+              <p style={{fontStyle: 'italic', fontWeight: 'bold'}}>
+                ${prod.price.toFixed(2)}
+              </p>
+              {prod.thumbnail_url && (
+                <img
+                  src={`${BACKEND_BASE_URL}${prod.thumbnail_url}`}
+                  alt={prod.name}
+                  style={{ maxHeight: '150px', objectFit: 'scale-down' }}
+                />
+              )}
+              <p>
+                <Link to={`/product/${prod.id}`}>View Details</Link>
+              </p>
+            </div>
+          ))}
+        </div>
+      )}
     </div>
   );
 }
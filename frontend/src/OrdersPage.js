@@ -5,26 +5,32 @@ import { BACKEND_BASE_URL } from './constants';
 export default function OrdersPage() {
   const { userId } = useParams();  // Get the userId from the URL
   const [orders, setOrders] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null); // cursor of the next page of orders (null when there are no more)
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
-  useEffect(() => {
-    const fetchOrders = async () => {
-      try {
-        const response = await fetch(`${BACKEND_BASE_URL}/orders/user/${userId}`);
-        if (!response.ok) {
-          throw new Error('Failed to fetch orders');
-        }
-        const data = await response.json();
-        setOrders(data.orders);  // Assuming the response has an "orders" array
-        console.log(data);
-        setLoading(false);
-      } catch (error) {
-        setError(error.message);
-        setLoading(false);
+  const fetchOrders = async (cursor = null) => {
+    try {
+      const url = cursor
+        ? `${BACKEND_BASE_URL}/orders/user/${userId}?cursor=${encodeURIComponent(cursor)}`
+        : `${BACKEND_BASE_URL}/orders/user/${userId}`;
+      const response = await fetch(url);
+      if (!response.ok) {
+        throw new Error('Failed to fetch orders');
       }
-    };
+      const data = await response.json();
+      // append the page to the orders that are already loaded
+      setOrders((prevOrders) => (cursor ? [...prevOrders, ...data.orders] : data.orders));
+      setNextCursor(data.next_cursor);
+      console.log(data);
+      setLoading(false);
+    } catch (error) {
+      setError(error.message);
+      setLoading(false);
+    }
+  };
 
+  useEffect(() => {
     fetchOrders();
   }, [userId]);
 
@@ -61,6 +67,21 @@ export default function OrdersPage() {
           </div>
         ))
       )}
+      {nextCursor && (
+        <button
+          onClick={() => fetchOrders(nextCursor)}
+          style={{
+            padding: '10px 15px',
+            backgroundColor: '#6c757d',
+            color: '#fff',
+            border: 'none',
+            borderRadius: '5px',
+            cursor: 'pointer',
+          }}
+        >
+          Load More
+        </button>
+      )}
     </div>
     </div>
   );
@@ -1,30 +1,37 @@
 import { Elements } from "@stripe/react-stripe-js";
 import { loadStripe } from "@stripe/stripe-js";
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 
 import CheckoutForm from "./CheckoutForm";
 import "./PaymentPage.css";
 import { BACKEND_BASE_URL } from "./constants";
+import { get_user_info } from "./services/authService";
 
 
 export default function PaymentPage() {
 
     const [clientSecret, setClientSecret] = useState(null);
     const [loading, setLoading] = useState(true);
+    // the same key is sent if the request is repeated, so only one PaymentIntent is created
+    const idempotencyKey = useRef(crypto.randomUUID());
     // Parse publishable key here
     const stripePromise = loadStripe(process.env.REACT_APP_STRIPE_PUBLISHABLE_KEY);
 
     useEffect(() => {
         const loadData = async () => {
         try {
+            // the buyer's cart is held while they pay
+            const userInfo = await get_user_info();
             const response = await fetch(`${BACKEND_BASE_URL}/create-payment-intent`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey.current,
             },
             body: JSON.stringify({
                 items: [{ id: "Premium" }],
                 customer: "user_uuid", 
+                user_id: userInfo ? userInfo.id : null,
             }),
             });
 
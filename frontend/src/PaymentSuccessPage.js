@@ -32,8 +32,12 @@ export default function PaymentSuccessPage() {
     if (userData) {
       const createOrder = async () => {
         try {
+          // Stripe redirects here with the id of the payment, so reloading the page or retrying
+          // can't create a second order for the same payment
+          const paymentIntent = new URLSearchParams(location.search).get('payment_intent');
           const response = await fetch(`${FRONTEND_BASE_URL}/orders/create/${userData.id}`, {
             method: 'POST',
+            headers: paymentIntent ? { 'Idempotency-Key': paymentIntent } : {},
           });
 
           if (response.ok) {
@@ -7,6 +7,7 @@ import { FRONTEND_BASE_URL } from "./constants";
 function ProductDetailPage() {
   const { productId } = useParams();
   const [product, setProduct] = useState(null);
+  const [reviewSummary, setReviewSummary] = useState(null); // review count, average and per-star counts
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [isEditing, setIsEditing] = useState(false);
@@ -56,7 +57,20 @@ function ProductDetailPage() {
       }
     };
 
+    const fetchReviewSummary = async () => {
+      try {
+        const response = await fetch(`${BACKEND_BASE_URL}/reviews/product/${productId}/summary`);
+        if (response.ok) {
+          const data = await response.json();
+          setReviewSummary(data.summary);
+        }
+      } catch (err) {
+        console.error(err.message);
+      }
+    };
+
     fetchProduct();
+    fetchReviewSummary();
   }, [productId]);
 
   const handleInputChange = (e) => {
@@ -370,9 +384,21 @@ function ProductDetailPage() {
         <p style={{ fontSize: "20px", margin: "5px 0" }}>
           <strong>Price:</strong> ${product.price.toFixed(2)}
         </p>
+        {reviewSummary && reviewSummary.count > 0 && (
+          <div style={{ margin: "5px 0" }}>
+            <p style={{ margin: "5px 0" }}>
+              {reviewSummary.average.toFixed(1)} stars from {reviewSummary.count} reviews
+            </p>
+            {[5, 4, 3, 2, 1].map((stars) => (
+              <p key={stars} style={{ margin: "2px 0", fontSize: "small" }}>
+                {stars} stars: {reviewSummary.histogram[stars]}
+              </p>
+            ))}
+          </div>
+        )}
       </div>
       <div style={{ margin: "20px 0", textAlign: "center" }}>
-        {product.image && <img src={`data:image/png;base64,${product.image}`} alt={product.name} style={{ maxWidth: "100%", height: "auto", borderRadius: "10px" }} />}
+        {product.medium_url && <img src={`${BACKEND_BASE_URL}${product.medium_url}`} alt={product.name} style={{ maxWidth: "100%", height: "auto", borderRadius: "10px" }} />}
       </div>
       <p>
         <strong>Description:</strong> {product.description}
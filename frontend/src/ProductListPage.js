@@ -5,6 +5,7 @@ import { checkLoginStatus, get_user_info, redirectTo } from './services/authServ
 
 function ProductListPage({ setCart }) {
   const [products, setProducts] = useState([]); // Initial state as an empty array
+  const [nextCursor, setNextCursor] = useState(null); // cursor of the next page of products (null when there are no more)
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [isLoggedIn, setIsLoggedIn] = useState(false);
@@ -28,32 +29,38 @@ function ProductListPage({ setCart }) {
       }
     };
 
-    const fetchProducts = async () => {
-      try {
-        const response = await fetch(`${BACKEND_BASE_URL}/products`);
-        if (!response.ok) {
-          throw new Error('Failed to fetch products');
-        }
-
-        const data = await response.json();
-        console.log('Fetched data:', data); // Debugging the fetched data
-
-        if (data && Array.isArray(data.products)) {
-          setProducts(data.products);
-        } else {
-          throw new Error('Expected an array of products in the response');
-        }
-
-        setLoading(false);
-      } catch (err) {
-        setError(err.message);
-        setLoading(false);
-      }
-    };
     checkStatus();
     fetchProducts();
   }, []); // Run once when the component mounts
 
+  const fetchProducts = async (cursor = null) => {
+    try {
+      const url = cursor
+        ? `${BACKEND_BASE_URL}/products?cursor=${encodeURIComponent(cursor)}`
+        : `${BACKEND_BASE_URL}/products`;
+      const response = await fetch(url);
+      if (!response.ok) {
+        throw new Error('Failed to fetch products');
+      }
+
+      const data = await response.json();
+      console.log('Fetched data:', data); // Debugging the fetched data
+
+      if (data && Array.isArray(data.products)) {
+        // append the page to the products that are already loaded
+        setProducts((prevProducts) => (cursor ? [...prevProducts, ...data.products] : data.products));
+        setNextCursor(data.next_cursor);
+      } else {
+        throw new Error('Expected an array of products in the response');
+      }
+
+      setLoading(false);
+    } catch (err) {
+      setError(err.message);
+      setLoading(false);
+    }
+  };
+
   const handleBuy = async (product) => {
     console.log(product);
 
@@ -131,9 +138,9 @@ function ProductListPage({ setCart }) {
             <p>
               {prod.condition}
             </p>
-            {prod.image && (
+            {prod.thumbnail_url && (
               <img
-                src={prod.image.startsWith('data:') ? prod.image : `data:image/png;base64,${prod.image}`}
+                src={`${BACKEND_BASE_URL}${prod.thumbnail_url}`}
                 alt={prod.name}
                 style={{
                   width: '90%',
@@ -188,6 +195,23 @@ function ProductListPage({ setCart }) {
           </div>
         ))
       )}
+      {nextCursor && (
+        <button
+          onClick={() => fetchProducts(nextCursor)}
+          style={{
+            padding: '10px 15px',
+            backgroundColor: '#6c757d',
+            color: '#fff',
+            border: 'none',
+            borderRadius: '5px',
+            cursor: 'pointer',
+            display: 'block',
+            margin: '0 auto',
+          }}
+        >
+          Load More
+        </button>
+      )}
     </div>
   );
 }
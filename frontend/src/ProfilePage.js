@@ -1,10 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import { checkLoginStatus, redirectTo, get_user_info } from './services/authService';
 import { useNavigate } from 'react-router-dom';
+import { BACKEND_BASE_URL } from './constants';
 
 const ProfilePage = () => {
   const [user, setUser] = useState(null);  // User state to store logged-in user's info
   const [loading, setLoading] = useState(true);  // Loading state while checking login status
+  const [orderStats, setOrderStats] = useState(null);  // Number of orders and lifetime spend of the user
 
   const navigate = useNavigate();
 
@@ -14,6 +16,16 @@ const ProfilePage = () => {
       if (isLoggedIn) {
         const userData = await get_user_info();
         setUser(userData);
+        if (userData && userData.id) {
+          try {
+            const response = await fetch(`${BACKEND_BASE_URL}/users/${userData.id}/order-stats`);
+            if (response.ok) {
+              setOrderStats(await response.json());
+            }
+          } catch (error) {
+            console.error('Error fetching order stats:', error);
+          }
+        }
       }
       setLoading(false); 
     };
@@ -57,6 +69,12 @@ const ProfilePage = () => {
           <p>{user.name}</p>
           <p>{user.email}</p>
         </div>
+        {orderStats && (
+          <div>
+            <p>Orders placed: {orderStats.order_count}</p>
+            <p>Lifetime spend: ${orderStats.lifetime_spend.toFixed(2)}</p>
+          </div>
+        )}
         <button onClick={handleLogout}>Log Out</button>
       </div>
     );
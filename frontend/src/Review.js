@@ -11,6 +11,8 @@ function Review() {
   const { productId } = useParams();
 
   const [reviews, setReviews] = useState([]);
+  const [product, setProduct] = useState(null); // name and seller of the product (sent once, not with every review)
+  const [nextCursor, setNextCursor] = useState(null); // cursor of the next page of reviews (null when there are no more)
   const [reviewText, setReviewText] = useState('');
   const [rating, setRating] = useState(0);
   const [loading, setLoading] = useState(false);
@@ -30,16 +32,22 @@ function Review() {
     }
   };
 
-  const fetchReviews = async () => {
+  const fetchReviews = async (cursor = null) => {
     try {
       setLoading(true);
-      const response = await fetch(`${BACKEND_BASE_URL}/reviews/product/${productId}`);
+      const url = cursor
+        ? `${BACKEND_BASE_URL}/reviews/product/${productId}?cursor=${encodeURIComponent(cursor)}`
+        : `${BACKEND_BASE_URL}/reviews/product/${productId}`;
+      const response = await fetch(url);
       if (!response.ok) {
         throw new Error('Failed to fetch reviews');
       }
       const data = await response.json();
       console.log(data);
-      setReviews(data.reviews);
+      setProduct(data.product);
+      // append the page to the reviews that are already loaded
+      setReviews((prevReviews) => (cursor ? [...prevReviews, ...data.reviews] : data.reviews));
+      setNextCursor(data.next_cursor);
       setLoading(false);
     } catch (err) {
       setError(err.message);
@@ -99,13 +107,13 @@ function Review() {
     <div style={{ maxWidth: '900px', margin: '20px auto', padding: '20px', borderRadius: '10px', backgroundColor: '#d3d3d3' }}>
       <h1 style={{ textAlign: 'center', fontWeight: 'normal' }}>
         Write a Review for{' '}
-        {reviews.length > 0 ? (
-          <strong>{reviews[0].product_name}</strong>
+        {product ? (
+          <strong>{product.name}</strong>
         ) : (
           <span>this product</span>
         )}
       </h1>
-      {reviews.length > 0 && <p><strong>Seller:</strong> {reviews[0].seller_name}</p>}
+      {product && <p><strong>Seller:</strong> {product.seller_name}</p>}
 
       <div style={{ marginBottom: '20px' }}>
         <textarea
@@ -148,7 +156,7 @@ function Review() {
         <div>
           <h2 style={{ textAlign: 'center', marginBottom: '0px', color: 'white', fontWeight: 'normal' }}>
             {reviews.length > 0 ? (
-              `All Reviews for ${reviews[0].product_name}`
+              `All Reviews for ${product.name}`
             ) : (
               "No reviews yet for this product"
             )}
@@ -196,6 +204,21 @@ function Review() {
                 </p>
               </div>
             ))}
+            {nextCursor && (
+              <button
+                onClick={() => fetchReviews(nextCursor)}
+                style={{
+                  padding: '10px 15px',
+                  backgroundColor: '#6c757d',
+                  color: '#fff',
+                  border: 'none',
+                  borderRadius: '5px',
+                  cursor: 'pointer',
+                }}
+              >
+                Load More
+              </button>
+            )}
             </div>
           )}
         </div>